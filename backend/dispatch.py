@@ -0,0 +1,396 @@
+"""Nearest-ambulance dispatch engine.
+
+Idle ambulances are kept in a uniform lat/lng grid keyed by their latest
+reported position. Pending bookings wait in a heap ordered by priority and
+creation time; each dispatch pass walks the heap and offers every booking
+without an outstanding offer to the free ambulance with the lowest ETA that
+has not already turned it down. An offer reserves the ambulance until the
+driver accepts, declines or the offer times out, after which the booking
+cascades to the next candidate. Once every idle ambulance has turned a
+booking down it starts another round with all of them (`on_exhausted`).
+Such a booking is marked `exhausted`, so any driver may accept it, not only
+the one holding its current offer. An offer withdrawn before its driver answered
+(booking taken or cancelled, ambulance gone) is reported to `on_withdraw`.
+
+All decisions are synchronous and run on the event loop thread, so there is
+no locking; I/O (persisting the offer, notifying the driver) is left to the
+`on_offer` / `on_expire` / `on_withdraw` callbacks.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+# Lower rank is dispatched first
+PRIORITY_RANKS = {"critical": 0, "high": 1, "normal": 2}
+
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE = 111.32
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * math.asin(math.sqrt(a))
+
+
+class GridIndex:
+    """Uniform grid over lat/lng answering nearest-point queries by ring search"""
+
+    def __init__(self, cell_deg: float = 0.01):
+        self.cell_deg = cell_deg
+        self.cells: Dict[Tuple[int, int], Set[str]] = {}
+        self.points: Dict[str, Tuple[float, float, Tuple[int, int]]] = {}
+        # Bounding box of cells ever occupied; only grows, which keeps it a valid search bound
+        self._bounds: Optional[List[int]] = None
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.points
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lng / self.cell_deg))
+
+    def upsert(self, key: str, lat: float, lng: float):
+        cell = self._cell(lat, lng)
+        previous = self.points.get(key)
+        if previous is not None and previous[2] != cell:
+            self._discard(key, previous[2])
+        if previous is None or previous[2] != cell:
+            self.cells.setdefault(cell, set()).add(key)
+            if self._bounds is None:
+                self._bounds = [cell[0], cell[0], cell[1], cell[1]]
+            else:
+                bounds = self._bounds
+                bounds[0], bounds[1] = min(bounds[0], cell[0]), max(bounds[1], cell[0])
+                bounds[2], bounds[3] = min(bounds[2], cell[1]), max(bounds[3], cell[1])
+        self.points[key] = (lat, lng, cell)
+
+    def remove(self, key: str):
+        previous = self.points.pop(key, None)
+        if previous is not None:
+            self._discard(key, previous[2])
+
+    def _discard(self, key: str, cell: Tuple[int, int]):
+        members = self.cells.get(cell)
+        if members is not None:
+            members.discard(key)
+            if not members:
+                del self.cells[cell]
+
+    def nearest(self, lat: float, lng: float,
+                accept: Callable[[str], bool] = lambda key: True) -> Optional[Tuple[str, float]]:
+        """Closest accepted key and its distance in km, or None"""
+        if not self.points:
+            return None
+        row, col = self._cell(lat, lng)
+        bounds = self._bounds
+        max_ring = max(abs(row - bounds[0]), abs(row - bounds[1]), abs(col - bounds[2]), abs(col - bounds[3]))
+        # Anything in ring r is at least (r - 1) cells away along the shorter (longitude) axis
+        ring_km = self.cell_deg * KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01)
+        best_key, best_km = None, math.inf
+        for ring in range(max_ring + 1):
+            if (ring - 1) * ring_km > best_km:
+                break
+            for cell in _ring_cells(row, col, ring):
+                for key in self.cells.get(cell, ()):
+                    if not accept(key):
+                        continue
+                    point = self.points[key]
+                    distance = haversine_km(lat, lng, point[0], point[1])
+                    if distance < best_km:
+                        best_key, best_km = key, distance
+        if best_key is None:
+            return None
+        return best_key, best_km
+
+
+def _ring_cells(row: int, col: int, ring: int):
+    if ring == 0:
+        yield row, col
+        return
+    for c in range(col - ring, col + ring + 1):
+        yield row - ring, c
+        yield row + ring, c
+    for r in range(row - ring + 1, row + ring):
+        yield r, col - ring
+        yield r, col + ring
+
+
+@dataclass
+class Ambulance:
+    vehicle_id: str
+    vehicle_number: str
+    driver_id: str
+    driver_name: Optional[str]
+    lat: float
+    lng: float
+
+
+@dataclass
+class PendingBooking:
+    booking_id: str
+    lat: float
+    lng: float
+    priority: str
+    created_at: str
+    declined: Set[str] = field(default_factory=set)
+    attempts: int = 0
+    exhausted: bool = False  # every ambulance declined it once, so any driver may accept it
+
+
+@dataclass
+class Offer:
+    booking_id: str
+    vehicle_id: str
+    vehicle_number: str
+    driver_id: str
+    driver_name: Optional[str]
+    distance_km: float
+    eta_minutes: float
+    attempt: int
+    expires_at: float  # time.time() seconds
+    handle: Optional[asyncio.TimerHandle] = None
+
+    def to_dict(self) -> Dict:
+        return {
+            "booking_id": self.booking_id,
+            "vehicle_id": self.vehicle_id,
+            "vehicle_number": self.vehicle_number,
+            "driver_id": self.driver_id,
+            "driver_name": self.driver_name,
+            "distance_km": round(self.distance_km, 2),
+            "eta_minutes": round(self.eta_minutes, 1),
+            "attempt": self.attempt,
+            "expires_at": self.expires_at
+        }
+
+
+class DispatchEngine:
+    """Offers pending bookings to the nearest free ambulance, cascading on timeout or decline"""
+
+    def __init__(self, eta_minutes: Callable[[float], float], offer_timeout_s: float = 20.0,
+                 cell_deg: float = 0.01):
+        self.eta_minutes = eta_minutes
+        self.offer_timeout = offer_timeout_s
+        self.cell_deg = cell_deg
+        self.on_offer: Optional[Callable[[Offer], None]] = None
+        self.on_expire: Optional[Callable[[Offer], None]] = None
+        self.on_withdraw: Optional[Callable[[Offer], None]] = None
+        self.on_decision: Optional[Callable[[float], None]] = None
+        self.on_exhausted: Optional[Callable[[PendingBooking], None]] = None
+        self.reset()
+
+    def reset(self):
+        """Forget all state and cancel outstanding offer timers"""
+        for offer in getattr(self, "offers", {}).values():
+            if offer.handle is not None:
+                offer.handle.cancel()
+        self.index = GridIndex(self.cell_deg)
+        self.ambulances: Dict[str, Ambulance] = {}
+        self.busy: Set[str] = set()
+        self.bookings: Dict[str, PendingBooking] = {}
+        self.queue: List[Tuple[int, str, int, str]] = []
+        self.offers: Dict[str, Offer] = {}
+        self.reserved: Dict[str, str] = {}  # vehicle_id -> booking_id on offer
+        self._seq = itertools.count()
+
+    # Fleet
+
+    def set_available(self, vehicle_id: str, vehicle_number: str, driver_id: str,
+                      driver_name: Optional[str], lat: float, lng: float):
+        """Mark an ambulance idle at a position; newly idle ambulances trigger a dispatch pass"""
+        self.busy.discard(vehicle_id)
+        known = vehicle_id in self.ambulances
+        self.ambulances[vehicle_id] = Ambulance(vehicle_id, vehicle_number, driver_id, driver_name, lat, lng)
+        self.index.upsert(vehicle_id, lat, lng)
+        if not known:
+            self.dispatch()
+
+    def update_location(self, vehicle_id: str, lat: float, lng: float) -> bool:
+        """Move an idle ambulance; returns False if it is not in the pool"""
+        ambulance = self.ambulances.get(vehicle_id)
+        if ambulance is None:
+            return False
+        ambulance.lat, ambulance.lng = lat, lng
+        self.index.upsert(vehicle_id, lat, lng)
+        return True
+
+    def set_unavailable(self, vehicle_id: str, busy: bool = False):
+        """Drop an ambulance from the pool, withdrawing any offer it holds"""
+        self._remove(vehicle_id, busy)
+        self.dispatch()
+
+    def _remove(self, vehicle_id: str, busy: bool):
+        self.ambulances.pop(vehicle_id, None)
+        self.index.remove(vehicle_id)
+        if busy:
+            self.busy.add(vehicle_id)
+        else:
+            self.busy.discard(vehicle_id)
+        booking_id = self.reserved.get(vehicle_id)
+        if booking_id is not None:
+            self._revoke(booking_id)
+            self._enqueue(self.bookings[booking_id])
+
+    # Bookings
+
+    def submit(self, booking_id: str, lat: float, lng: float, priority: str, created_at: str) -> Optional[Offer]:
+        """Queue a booking and return the offer it received straight away, if any"""
+        booking = PendingBooking(booking_id, lat, lng, priority, created_at)
+        self.bookings[booking_id] = booking
+        self._enqueue(booking)
+        self.dispatch()
+        return self.offers.get(booking_id)
+
+    def decline(self, booking_id: str, driver_id: str) -> bool:
+        """Driver turned the offer down; cascade to the next candidate"""
+        offer = self.offers.get(booking_id)
+        if offer is None or offer.driver_id != driver_id:
+            return False
+        self._reject(offer)
+        return True
+
+    def assigned(self, booking_id: str, vehicle_id: str):
+        """Booking was accepted by `vehicle_id`, which is now busy with it"""
+        offer = self.offers.get(booking_id)
+        if offer is not None and offer.vehicle_id == vehicle_id:
+            self._withdraw(booking_id)
+        else:
+            self._revoke(booking_id)
+        self.bookings.pop(booking_id, None)
+        self._remove(vehicle_id, busy=True)
+        self.dispatch()
+
+    def close(self, booking_id: str):
+        """Booking left the pending state (accepted or cancelled)"""
+        self._revoke(booking_id)
+        self.bookings.pop(booking_id, None)
+        self.dispatch()
+
+    def offer_for_driver(self, driver_id: str) -> Optional[Offer]:
+        for offer in self.offers.values():
+            if offer.driver_id == driver_id:
+                return offer
+        return None
+
+    # Internals
+
+    def _enqueue(self, booking: PendingBooking):
+        rank = PRIORITY_RANKS.get(booking.priority, PRIORITY_RANKS["normal"])
+        heapq.heappush(self.queue, (rank, booking.created_at, next(self._seq), booking.booking_id))
+
+    def _withdraw(self, booking_id: str) -> Optional[Offer]:
+        offer = self.offers.pop(booking_id, None)
+        if offer is not None:
+            if offer.handle is not None:
+                offer.handle.cancel()
+            self.reserved.pop(offer.vehicle_id, None)
+        return offer
+
+    def _revoke(self, booking_id: str):
+        # Withdraw an offer its driver didn't answer, and tell them
+        offer = self._withdraw(booking_id)
+        if offer is not None and self.on_withdraw is not None:
+            self.on_withdraw(offer)
+
+    def _reject(self, offer: Offer):
+        self._withdraw(offer.booking_id)
+        booking = self.bookings.get(offer.booking_id)
+        if booking is not None:
+            booking.declined.add(offer.vehicle_id)
+            self._enqueue(booking)
+        self.dispatch()
+
+    def _expire(self, booking_id: str, vehicle_id: str):
+        offer = self.offers.get(booking_id)
+        if offer is None or offer.vehicle_id != vehicle_id:
+            return
+        self._reject(offer)
+        if self.on_expire is not None:
+            self.on_expire(offer)
+
+    def dispatch(self):
+        """Offer every waiting booking, in priority order, to its best free ambulance"""
+        if not self.queue:
+            return
+        started = time.perf_counter()
+        waiting = []
+        made = []
+        exhausted = []
+        seen = set()
+        free = None
+        queue = self.queue
+        while queue:
+            entry = heapq.heappop(queue)
+            booking_id = entry[3]
+            booking = self.bookings.get(booking_id)
+            # Stale heap entry: booking closed, already on offer or queued twice
+            if booking is None or booking_id in self.offers or booking_id in seen:
+                continue
+            seen.add(booking_id)
+            # Skip the grid search when no free ambulance is left for this booking
+            if free is None:
+                free = self.ambulances.keys() - self.reserved.keys()
+            if not free or free <= booking.declined:
+                if free and self.ambulances.keys() <= booking.declined:
+                    exhausted.append(entry)
+                else:
+                    waiting.append(entry)
+                continue
+            declined = booking.declined
+            vehicle_id, distance = self.index.nearest(
+                booking.lat, booking.lng,
+                lambda key: key in free and key not in declined
+            )
+            free.discard(vehicle_id)
+            made.append(self._offer(booking, self.ambulances[vehicle_id], distance))
+        # Every idle ambulance turned these down, so waiting for a new one could leave them
+        # pending forever: start another round, after the bookings that still had candidates
+        # so a decline doesn't bounce straight back ahead of them
+        for entry in exhausted:
+            booking = self.bookings[entry[3]]
+            booking.declined.clear()
+            booking.exhausted = True
+            if not free:
+                waiting.append(entry)
+                continue
+            vehicle_id, distance = self.index.nearest(booking.lat, booking.lng, free.__contains__)
+            free.discard(vehicle_id)
+            made.append(self._offer(booking, self.ambulances[vehicle_id], distance))
+        for entry in waiting:
+            heapq.heappush(queue, entry)
+        if self.on_decision is not None:
+            self.on_decision(time.perf_counter() - started)
+        if self.on_exhausted is not None:
+            for entry in exhausted:
+                self.on_exhausted(self.bookings[entry[3]])
+        if self.on_offer is not None:
+            for offer in made:
+                self.on_offer(offer)
+
+    def _offer(self, booking: PendingBooking, ambulance: Ambulance, distance: float) -> Offer:
+        booking.attempts += 1
+        offer = Offer(
+            booking_id=booking.booking_id,
+            vehicle_id=ambulance.vehicle_id,
+            vehicle_number=ambulance.vehicle_number,
+            driver_id=ambulance.driver_id,
+            driver_name=ambulance.driver_name,
+            distance_km=distance,
+            eta_minutes=self.eta_minutes(distance),
+            attempt=booking.attempts,
+            expires_at=time.time() + self.offer_timeout
+        )
+        offer.handle = asyncio.get_running_loop().call_later(
+            self.offer_timeout, self._expire, booking.booking_id, ambulance.vehicle_id
+        )
+        self.offers[booking.booking_id] = offer
+        self.reserved[ambulance.vehicle_id] = booking.booking_id
+        return offer
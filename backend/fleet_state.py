@@ -0,0 +1,79 @@
+"""Authoritative in-memory fleet state for Socket.IO clients.
+
+Every change to a vehicle's position (or its removal from the map) bumps a
+monotonically increasing version and is kept as a delta in a bounded ring
+buffer. A client connects, gets a snapshot tagged with the current version
+and then applies the deltas it is sent in version order. After a reconnect it
+presents the last version it applied and only gets the deltas it missed;
+when those have already left the ring buffer, or the state was rebuilt by a
+restart (a new ``epoch``), it gets a fresh snapshot instead.
+
+Deltas are the Socket.IO events the client already handles live
+(``vehicle_location`` carrying the full vehicle entry, ``vehicle_status``,
+``vehicle_removed``), so a replay is just those events in order.
+"""
+import uuid
+from collections import deque
+from itertools import islice
+from typing import Dict, List, Optional
+
+
+class FleetState:
+    """Vehicle entries by id, a version counter and the latest `history` deltas"""
+
+    def __init__(self, history: int = 4096):
+        self.epoch = uuid.uuid4().hex
+        self.version = 0
+        self.vehicles: Dict[str, Dict] = {}
+        # (version, event, payload) for consecutive versions ending at self.version
+        self.history: deque = deque(maxlen=history)
+
+    def __len__(self) -> int:
+        return len(self.vehicles)
+
+    def _record(self, event: str, payload: Dict) -> Dict:
+        self.history.append((self.version, event, payload))
+        return payload
+
+    def upsert(self, vehicle_id: str, entry: Dict) -> Dict:
+        """Replace a vehicle's entry; returns it tagged with its version (the `vehicle_location` delta)"""
+        self.version += 1
+        payload = self.vehicles[vehicle_id] = {**entry, "version": self.version}
+        return self._record("vehicle_location", payload)
+
+    def set_status(self, vehicle_id: str, status: str) -> Optional[Dict]:
+        """Change a vehicle's tracker status; returns the `vehicle_status` delta, or None if nothing changed"""
+        entry = self.vehicles.get(vehicle_id)
+        if entry is None or entry.get('status') == status:
+            return None
+        self.version += 1
+        self.vehicles[vehicle_id] = {**entry, "status": status, "version": self.version}
+        return self._record("vehicle_status", {"vehicle_id": vehicle_id, "status": status, "version": self.version})
+
+    def remove(self, vehicle_id: str) -> Optional[Dict]:
+        """Drop a vehicle; returns the `vehicle_removed` delta, or None if it wasn't on the map"""
+        if self.vehicles.pop(vehicle_id, None) is None:
+            return None
+        self.version += 1
+        return self._record("vehicle_removed", {"vehicle_id": vehicle_id, "version": self.version})
+
+    def snapshot(self) -> Dict:
+        return {"epoch": self.epoch, "version": self.version, "vehicles": list(self.vehicles.values())}
+
+    def deltas_since(self, epoch: Optional[str], version: Optional[int]) -> Optional[List[List]]:
+        """[event, payload] pairs after `version`, or None if they can't be replayed and a snapshot is needed"""
+        if epoch != self.epoch or not isinstance(version, int) or not 0 <= version <= self.version:
+            return None
+        if version == self.version:
+            return []
+        oldest = self.history[0][0] if self.history else self.version + 1
+        if version < oldest - 1:
+            return None
+        return [[event, payload] for _, event, payload in islice(self.history, version - oldest + 1, None)]
+
+    def reset(self):
+        """Start a new epoch: clients holding versions of the old one get snapshots"""
+        self.epoch = uuid.uuid4().hex
+        self.version = 0
+        self.vehicles.clear()
+        self.history.clear()
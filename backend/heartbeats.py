@@ -0,0 +1,116 @@
+"""Tracker heartbeat monitoring on a hashed timer wheel.
+
+Every GPS fix re-arms its vehicle's timer: the vehicle is due to go
+``stale`` after ``stale_after_s`` of silence and ``offline`` after
+``offline_after_s``. Timers live in a hashed wheel of ``slots`` buckets of
+``tick_s`` each, keyed by vehicle, so re-arming on a fix is a couple of dict
+operations and each tick only looks at the one bucket whose time has come
+(timers more than a full turn away stay put until their round). Nothing
+ever walks the whole fleet.
+"""
+from typing import Dict, List, Optional, Tuple
+
+LIVE = "live"
+STALE = "stale"
+OFFLINE = "offline"
+
+
+class TimerWheel:
+    """Keys due at deadlines (seconds), collected as time passes their bucket"""
+
+    def __init__(self, tick_s: float = 1.0, slots: int = 512, now: float = 0.0):
+        self.tick_s = tick_s
+        self.slots = slots
+        self.buckets: List[Dict[str, float]] = [{} for _ in range(slots)]
+        self.slot_of: Dict[str, int] = {}
+        # First tick not yet swept
+        self.current = int(now // tick_s)
+
+    def __len__(self) -> int:
+        return len(self.slot_of)
+
+    def schedule(self, key: str, deadline: float):
+        self.cancel(key)
+        # Deadlines already behind the sweep go in the bucket swept next
+        slot = max(int(deadline // self.tick_s), self.current) % self.slots
+        self.buckets[slot][key] = deadline
+        self.slot_of[key] = slot
+
+    def cancel(self, key: str):
+        slot = self.slot_of.pop(key, None)
+        if slot is not None:
+            del self.buckets[slot][key]
+
+    def advance(self, now: float) -> List[str]:
+        """Keys whose deadline has passed, from the ticks that ended by `now`"""
+        target = int(now // self.tick_s)
+        due = []
+        # After a full turn every bucket has been looked at once
+        for tick in range(self.current, min(target, self.current + self.slots)):
+            bucket = self.buckets[tick % self.slots]
+            expired = [key for key, deadline in bucket.items() if deadline <= now]
+            for key in expired:
+                del bucket[key]
+                del self.slot_of[key]
+            due += expired
+        self.current = max(self.current, target)
+        return due
+
+
+class HeartbeatMonitor:
+    """live -> stale -> offline as a vehicle's tracker goes quiet; back to live on its next fix"""
+
+    def __init__(self, stale_after_s: float, offline_after_s: float, tick_s: float = 1.0, slots: int = 512,
+                 now: float = 0.0):
+        self.stale_after_s = stale_after_s
+        self.offline_after_s = max(offline_after_s, stale_after_s)
+        self.wheel = TimerWheel(tick_s, slots, now)
+        self.last_fix: Dict[str, float] = {}
+        self.status: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.status)
+
+    def beat(self, vehicle_id: str, now: float) -> bool:
+        """Record a fix; True if it brings back a stale or offline vehicle"""
+        previous = self.status.get(vehicle_id)
+        self.last_fix[vehicle_id] = now
+        self.status[vehicle_id] = LIVE
+        self.wheel.schedule(vehicle_id, now + self.stale_after_s)
+        return previous not in (None, LIVE)
+
+    def track(self, vehicle_id: str, last_fix: float, now: float) -> str:
+        """Resume watching a vehicle whose last fix was at `last_fix` (after a restart)"""
+        silent = now - last_fix
+        self.last_fix[vehicle_id] = last_fix
+        if silent < self.stale_after_s:
+            status = LIVE
+            self.wheel.schedule(vehicle_id, last_fix + self.stale_after_s)
+        elif silent < self.offline_after_s:
+            status = STALE
+            self.wheel.schedule(vehicle_id, last_fix + self.offline_after_s)
+        else:
+            status = OFFLINE
+            self.wheel.cancel(vehicle_id)
+        self.status[vehicle_id] = status
+        return status
+
+    def forget(self, vehicle_id: str):
+        self.wheel.cancel(vehicle_id)
+        self.last_fix.pop(vehicle_id, None)
+        self.status.pop(vehicle_id, None)
+
+    def advance(self, now: float) -> List[Tuple[str, str]]:
+        """(vehicle id, new status) for every vehicle whose timer ran out by `now`"""
+        changes = []
+        for vehicle_id in self.wheel.advance(now):
+            if self.status[vehicle_id] == LIVE and self.offline_after_s > self.stale_after_s:
+                self.status[vehicle_id] = STALE
+                self.wheel.schedule(vehicle_id, self.last_fix[vehicle_id] + self.offline_after_s)
+            else:
+                self.status[vehicle_id] = OFFLINE
+            changes.append((vehicle_id, self.status[vehicle_id]))
+        return changes
+
+    def status_of(self, vehicle_id: str) -> Optional[str]:
+        return self.status.get(vehicle_id)
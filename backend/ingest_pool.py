@@ -0,0 +1,244 @@
+"""GPS fix handling spread over worker processes, partitioned by IMEI.
+
+One event loop validating, storing and broadcasting every fix caps ingest
+at one core. ``IngestPool`` hashes each fix's key (the tracker's IMEI) to
+one of ``shards`` worker processes, so a vehicle's fixes are always handled
+by the same worker, one at a time and in arrival order, while different
+vehicles proceed concurrently in every worker. State the handler keeps per
+vehicle in its own process is therefore only ever touched by one worker
+and needs no locking; anything the handler broadcasts to other processes
+is, of course, theirs as well.
+
+The front process talks to each worker over its own pipe (one writer and
+one reader at each end). Fixes submitted in the same event loop iteration
+travel as one batch, so pickling and syscalls are paid per batch; at most
+``window`` batches per worker are in flight, which keeps both directions of
+the pipe from filling up while the other end is busy.
+
+Workers build their handler with ``handler_factory()`` (a module-level
+callable, possibly async, so it can be pickled by reference) and run it for
+every payload; its return value is sent back as the result. A worker that
+dies is started again (at most once per ``respawn_delay_s``); whatever it
+had been sent fails with ``IngestWorkerError``, as do submissions to its
+shard until the replacement is up.
+"""
+import asyncio
+import inspect
+import itertools
+import logging
+import multiprocessing
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class IngestWorkerError(Exception):
+    """The handler raised in the worker, or the worker went away before answering"""
+
+
+def shard_of(key: str, shards: int) -> int:
+    """The worker owning `key`; stable across processes and restarts, unlike hash()"""
+    return zlib.crc32(key.encode()) % shards
+
+
+class IngestPool:
+    """`shards` worker processes each handling the keys that hash to them"""
+
+    def __init__(self, shards: int, handler_factory: Callable, batch_max: int = 256, window: int = 4,
+                 context: str = "spawn", respawn_delay_s: float = 1.0):
+        self.shards = shards
+        self.handler_factory = handler_factory
+        self.batch_max = batch_max
+        self.window = window
+        self.context = context
+        self.respawn_delay_s = respawn_delay_s
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * shards
+        self.conns: List = [None] * shards
+        # Per shard: submitted but not yet sent, futures by ticket, batches sent but not answered
+        self.outgoing: List[List[Tuple[int, str, Any]]] = [[] for _ in range(shards)]
+        self.waiting: List[Dict[int, asyncio.Future]] = [{} for _ in range(shards)]
+        self.inflight: List[int] = [0] * shards
+        self.spawned_at: List[float] = [0.0] * shards
+        self.respawns = 0
+        self.closing = False
+        self._tickets = itertools.count()
+        self._flush_scheduled = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def __len__(self) -> int:
+        return sum(len(waiting) for waiting in self.waiting)
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        for shard in range(self.shards):
+            self._spawn(shard)
+
+    def _spawn(self, shard: int):
+        if self.closing:
+            return
+        ctx = multiprocessing.get_context(self.context)
+        parent, child = ctx.Pipe()
+        process = ctx.Process(target=serve_shard, args=(child, self.handler_factory),
+                              name=f"ingest-{shard}", daemon=True)
+        process.start()
+        child.close()
+        self.processes[shard] = process
+        self.conns[shard] = parent
+        self.inflight[shard] = 0
+        self.spawned_at[shard] = self._loop.time()
+        self._loop.add_reader(parent.fileno(), self._receive, shard)
+
+    def submit(self, key: str, payload: Any) -> asyncio.Future:
+        """Hand `payload` to the worker owning `key`; the future resolves to the handler's result"""
+        shard = shard_of(key, self.shards)
+        if self.conns[shard] is None:
+            raise IngestWorkerError(f"ingest worker {shard} is gone")
+        ticket = next(self._tickets)
+        future = self.waiting[shard][ticket] = self._loop.create_future()
+        self.outgoing[shard].append((ticket, key, payload))
+        if len(self.outgoing[shard]) >= self.batch_max:
+            self._flush(shard)
+        elif not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._loop.call_soon(self._flush_all)
+        return future
+
+    def _flush_all(self):
+        self._flush_scheduled = False
+        for shard in range(self.shards):
+            self._flush(shard)
+
+    def _flush(self, shard: int):
+        outgoing = self.outgoing[shard]
+        while outgoing and self.inflight[shard] < self.window and self.conns[shard] is not None:
+            batch = outgoing[:self.batch_max]
+            del outgoing[:self.batch_max]
+            try:
+                self.conns[shard].send(batch)
+            except OSError:
+                self._lost(shard)
+                return
+            self.inflight[shard] += 1
+
+    def _receive(self, shard: int):
+        try:
+            results = self.conns[shard].recv()
+        except (EOFError, OSError):
+            self._lost(shard)
+            return
+        self.inflight[shard] -= 1
+        waiting = self.waiting[shard]
+        for ticket, ok, result in results:
+            future = waiting.pop(ticket, None)
+            if future is None or future.done():
+                continue  # the caller gave up on it
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(IngestWorkerError(result))
+        self._flush(shard)
+
+    def _lost(self, shard: int):
+        """The worker died or its pipe broke: fail everything it was given and start a new one"""
+        conn, self.conns[shard] = self.conns[shard], None
+        if conn is None:
+            return
+        self._loop.remove_reader(conn.fileno())
+        conn.close()
+        self.outgoing[shard].clear()
+        for future in self.waiting[shard].values():
+            if not future.done():
+                future.set_exception(IngestWorkerError(f"ingest worker {shard} is gone"))
+        self.waiting[shard].clear()
+        if self.closing:
+            return
+        self.respawns += 1
+        # A worker that dies straight after starting (a failing handler factory) is retried at a slower pace
+        delay = self.spawned_at[shard] + self.respawn_delay_s - self._loop.time()
+        logging.error(f"Ingest worker {shard} exited; starting a new one")
+        if delay > 0:
+            self._loop.call_later(delay, self._spawn, shard)
+        else:
+            self._spawn(shard)
+
+    async def close(self, timeout_s: float = 10.0):
+        """Let the workers finish what they were sent, then stop them"""
+        self.closing = True
+        self._flush_all()
+        pending = [future for waiting in self.waiting for future in waiting.values()]
+        if pending:
+            await asyncio.wait(pending, timeout=timeout_s)
+        for shard, conn in enumerate(self.conns):
+            if conn is not None:
+                self._loop.remove_reader(conn.fileno())
+                try:
+                    conn.send(None)
+                except OSError:
+                    pass
+        for process in self.processes:
+            if process is None:
+                continue
+            await self._loop.run_in_executor(None, process.join, timeout_s)
+            if process.is_alive():
+                process.terminate()
+        for shard, conn in enumerate(self.conns):
+            if conn is not None:
+                self.conns[shard] = None
+                conn.close()
+            for future in self.waiting[shard].values():
+                if not future.done():
+                    future.set_exception(IngestWorkerError("ingest pool closed"))
+            self.waiting[shard].clear()
+
+
+def serve_shard(conn, handler_factory: Callable):
+    """Worker process entry point"""
+    asyncio.run(_serve(conn, handler_factory))
+
+
+async def _serve(conn, handler_factory: Callable):
+    handler = handler_factory()
+    if inspect.isawaitable(handler):
+        handler = await handler
+    loop = asyncio.get_running_loop()
+    stopped = loop.create_future()
+    batches = set()
+    # Per key, the future the latest fix resolves when done: the next fix for that key waits on it
+    tails: Dict[str, asyncio.Future] = {}
+
+    async def run(ticket: int, key: str, payload: Any) -> Tuple[int, bool, Any]:
+        previous = tails.get(key)
+        done = tails[key] = loop.create_future()
+        try:
+            if previous is not None:
+                await previous
+            try:
+                return ticket, True, await handler(payload)
+            except Exception as exc:
+                logging.exception(f"Ingest handler failed for {key}")
+                return ticket, False, f"{type(exc).__name__}: {exc}"
+        finally:
+            done.set_result(None)
+            if tails.get(key) is done:
+                del tails[key]
+
+    async def answer(batch: List[Tuple[int, str, Any]]):
+        results = await asyncio.gather(*(run(ticket, key, payload) for ticket, key, payload in batch))
+        conn.send(results)
+
+    def readable():
+        try:
+            batch = conn.recv()
+        except (EOFError, OSError):
+            batch = None
+        if batch is None:
+            loop.remove_reader(conn.fileno())
+            stopped.set_result(None)
+            return
+        task = loop.create_task(answer(batch))
+        batches.add(task)
+        task.add_done_callback(batches.discard)
+
+    loop.add_reader(conn.fileno(), readable)
+    await stopped
+    if batches:
+        await asyncio.gather(*batches, return_exceptions=True)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+GCE Campus Transportation System - Maintenance commands
+
+Runs against the database configured in backend/.env (MONGO_URL, DB_NAME).
+
+    python manage.py migrate-geo                       # backfill GeoJSON points and the 2dsphere index
+    python manage.py archive [--older-than-days N]     # move finished documents to the archive tier
+    python manage.py rebuild-rollups                   # recompute offence and trip analytics rollups
+"""
+
+import argparse
+import asyncio
+import logging
+
+import server
+
+
+# ============ COMMANDS ============
+
+async def migrate_geo() -> int:
+    """Add `current_point` to vehicles that only have a {lat, lng} `current_location`"""
+    updated = 0
+    cursor = server.db.vehicles.find(
+        {"current_location.lat": {"$exists": True}, "current_point": {"$exists": False}},
+        {"_id": 0, "id": 1, "current_location": 1}
+    )
+    async for vehicle in cursor:
+        location = vehicle['current_location']
+        result = await server.db.vehicles.update_one(
+            {"id": vehicle['id'], "current_point": {"$exists": False}},
+            {"$set": {"current_point": server.geo_point(location['lat'], location['lng'])}}
+        )
+        updated += result.modified_count
+    await server.ensure_indexes()
+    return updated
+
+
+# ============ CLI ============
+
+async def run(args):
+    try:
+        if args.command == "migrate-geo":
+            updated = await migrate_geo()
+            print(f"Backfilled current_point on {updated} vehicles")
+        elif args.command == "archive":
+            moved = await server.archive_finished(args.older_than_days)
+            for collection, count in moved.items():
+                print(f"{collection}: archived {count}")
+        elif args.command == "rebuild-rollups":
+            counts = await server.rebuild_rollups()
+            for collection, count in counts.items():
+                print(f"{collection}: {count} documents")
+    finally:
+        await server.db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintenance commands for the campus backend")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("migrate-geo", help="store vehicle locations as GeoJSON points with a 2dsphere index")
+    archive = commands.add_parser("archive", help="move finished bookings, ended trips and paid offences to *_archive")
+    archive.add_argument("--older-than-days", type=int, help="defaults to ARCHIVE_AFTER_DAYS")
+    commands.add_parser("rebuild-rollups", help="recompute analytics rollups from offences and trips")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""Lightweight Prometheus-style metrics for the campus backend.
+
+Counters, gauges and histograms are plain Python numbers mutated from the
+event loop thread, so recording a sample is a dict lookup and an add with no
+locking. Samples produced on other threads (PyMongo command monitoring runs
+on Motor's executor threads) are appended to a deque, which is thread-safe
+without locks, and folded into the histograms when /metrics is scraped.
+"""
+import asyncio
+import bisect
+import time
+from collections import deque
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+from socketio import packet
+
+# Latency buckets in seconds, shared by HTTP, Mongo and event-loop lag histograms
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    """Monotonically increasing value per label tuple"""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, labels: Tuple = (), amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, labels: Tuple = ()) -> float:
+        return self.values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in self.values.items()
+        ]
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+    kind = "gauge"
+
+    def set(self, value: float, labels: Tuple = ()):
+        self.values[labels] = value
+
+    def dec(self, labels: Tuple = (), amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+
+class Histogram:
+    """Cumulative bucketed distribution per label tuple"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [bucket counts..., +Inf count, sum]
+        self.values: Dict[Tuple, List[float]] = {}
+
+    def observe(self, value: float, labels: Tuple = ()):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, labels: Tuple = ()) -> int:
+        series = self.values.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = []
+        for labels, series in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames + ('le',), labels + (le,))} {cumulative}"
+                )
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {series[-1]}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+class RateMeter:
+    """Events per second over the last completed one-second window, O(1) per mark"""
+
+    def __init__(self):
+        self._second = 0
+        self._count = 0
+        self._last_rate = 0
+
+    def mark(self, now: Optional[float] = None):
+        second = int(now if now is not None else time.monotonic())
+        if second != self._second:
+            self._last_rate = self._count if second == self._second + 1 else 0
+            self._second = second
+            self._count = 0
+        self._count += 1
+
+    def rate(self, now: Optional[float] = None) -> int:
+        second = int(now if now is not None else time.monotonic())
+        if second == self._second:
+            return self._last_rate
+        if second == self._second + 1:
+            return self._count
+        return 0
+
+
+class Registry:
+    """Collection of metrics rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, collector):
+        """Register a callable run before every render (drains, derived gauges)"""
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            collector()
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.counter(
+    "http_requests_total", "HTTP requests by router, route, method and status",
+    ("router", "route", "method", "status"))
+HTTP_LATENCY = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by router and route",
+    ("router", "route", "method"))
+MONGO_COMMANDS = registry.counter(
+    "mongo_commands_total", "MongoDB commands by collection, operation and outcome",
+    ("collection", "operation", "outcome"))
+MONGO_LATENCY = registry.histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency by collection and operation",
+    ("collection", "operation"))
+SOCKET_CLIENTS = registry.gauge(
+    "socketio_connected_clients", "Currently connected Socket.IO clients")
+SOCKET_EMITS = registry.counter(
+    "socketio_emits_total", "Socket.IO emits by event", ("event",))
+SOCKET_EMIT_BYTES = registry.counter(
+    "socketio_emit_bytes_total", "Encoded Socket.IO event bytes by event, counted on each worker delivering it",
+    ("event",))
+SOCKET_CLIENT_LAG = registry.histogram(
+    "socketio_client_lag_seconds", "Time a frame waited in a client's outbox before its transport took it")
+SOCKET_FRAMES_DROPPED = registry.counter(
+    "socketio_frames_dropped_total", "Location frames dropped from client outboxes by reason", ("reason",))
+SOCKET_OUTBOX_FRAMES = registry.gauge(
+    "socketio_outbox_frames", "Frames waiting in client outboxes")
+SOCKET_SLOW_DISCONNECTS = registry.counter(
+    "socketio_slow_disconnects_total", "Clients disconnected for falling behind, by reason", ("reason",))
+GPS_FIXES = registry.counter(
+    "gps_fixes_total", "GPS fixes received")
+GPS_FIX_OUTCOMES = registry.counter(
+    "gps_fix_outcomes_total", "GPS fixes by outcome: live, late (history only) or duplicate (dropped)",
+    ("outcome",))
+GPS_FIX_RATE = registry.gauge(
+    "gps_fixes_per_second", "GPS fixes received during the last full second")
+DISPATCH_DECISION = registry.histogram(
+    "dispatch_decision_seconds", "Time spent in one dispatch pass over the pending booking queue",
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05))
+DISPATCH_OFFERS = registry.counter(
+    "dispatch_offers_total", "Booking offers by outcome", ("outcome",))
+LOOP_LAG = registry.histogram(
+    "event_loop_lag_seconds", "Delay between a scheduled event loop wakeup and when it ran")
+LOOP_LAG_CURRENT = registry.gauge(
+    "event_loop_lag_current_seconds", "Most recent event loop lag measurement")
+
+gps_fix_meter = RateMeter()
+registry.add_collector(lambda: GPS_FIX_RATE.set(gps_fix_meter.rate()))
+
+
+def record_gps_fix():
+    """Count one ingested GPS fix"""
+    GPS_FIXES.inc()
+    gps_fix_meter.mark()
+
+
+# ============ SOCKET.IO PACKETS ============
+
+class MeteredPacket(packet.Packet):
+    """Socket.IO packet class that counts the bytes of every event it encodes
+
+    The client manager encodes an emit once for all its recipients, so the
+    size comes for free instead of serializing the payload a second time.
+    """
+
+    def encode(self):
+        encoded = super().encode()
+        if self.packet_type in (packet.EVENT, packet.BINARY_EVENT) and self.data:
+            parts = encoded if isinstance(encoded, list) else (encoded,)
+            SOCKET_EMIT_BYTES.inc((self.data[0],), sum(len(part) for part in parts))
+        return encoded
+
+
+# ============ MONGO COMMAND MONITORING ============
+
+class MongoCommandListener(monitoring.CommandListener):
+    """PyMongo command listener feeding per-collection latency histograms
+
+    Callbacks run on Motor's worker threads, so they only touch a dict keyed
+    by request and a deque; aggregation happens on scrape.
+    """
+
+    def __init__(self, maxlen: int = 100000):
+        self._pending: Dict[Tuple, str] = {}
+        self.samples = deque(maxlen=maxlen)
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else "-"
+        self._pending[(event.connection_id, event.request_id)] = collection
+
+    def _finish(self, event, outcome: str):
+        collection = self._pending.pop((event.connection_id, event.request_id), "-")
+        self.samples.append((collection, event.command_name, outcome, event.duration_micros / 1e6))
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+    def drain(self):
+        samples = self.samples
+        while samples:
+            try:
+                collection, operation, outcome, seconds = samples.popleft()
+            except IndexError:
+                break
+            MONGO_COMMANDS.inc((collection, operation, outcome))
+            MONGO_LATENCY.observe(seconds, (collection, operation))
+
+
+mongo_command_listener = MongoCommandListener()
+registry.add_collector(mongo_command_listener.drain)
+
+
+# ============ HTTP MIDDLEWARE ============
+
+def router_label(path: str) -> str:
+    """Map a route template to its router name (auth, public, driver, admin, gps, rfid)"""
+    parts = path.split("/")
+    if len(parts) > 2 and parts[1] == "api":
+        return parts[2] or "api"
+    return parts[1] if len(parts) > 1 and parts[1] else "root"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording request counts and latency per route"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            router = router_label(path) if route is not None else "unmatched"
+            method = scope.get("method", "")
+            HTTP_REQUESTS.inc((router, path, method, str(status_holder[0])))
+            HTTP_LATENCY.observe(elapsed, (router, path, method))
+
+
+# ============ EVENT LOOP LAG ============
+
+async def monitor_event_loop_lag(interval: float = 0.5):
+    """Sample how late the event loop wakes a sleeping task"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - start - interval)
+        LOOP_LAG.observe(lag)
+        LOOP_LAG_CURRENT.set(lag)
@@ -0,0 +1,41 @@
+"""One owner among the worker processes of a host.
+
+Some jobs must run in exactly one process: ambulance dispatch keeps offers
+and their timers in memory, and two processes doing it would offer every
+booking twice. The owner is whichever worker holds an exclusive ``flock`` on
+the job's lock file. The kernel releases the lock when that process exits,
+so another worker's next ``claim`` takes the job over.
+"""
+import fcntl
+import os
+from typing import Optional
+
+
+class OwnerLock:
+    """Non-blocking exclusive lock on a file; with an empty path this process never owns the job"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fd: Optional[int] = None
+        self.owner = False
+
+    def claim(self) -> bool:
+        """Become the owner if nobody is; True if this process owns the job"""
+        if self.owner or not self.path:
+            return self.owner
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        self.owner = True
+        return True
+
+    def release(self):
+        if self.fd is None:
+            return
+        # Closing the descriptor drops the lock
+        os.close(self.fd)
+        self.fd = None
+        self.owner = False
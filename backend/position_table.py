@@ -0,0 +1,196 @@
+"""Latest vehicle positions in a memory-mapped table shared by every worker on a host.
+
+Every worker already hears every fix (``run_everywhere``), but without a
+shared copy each one answers position reads from the database. The table
+is a file mapped into each worker (``/dev/shm`` keeps it in memory) with a
+fixed layout: a header, then one slot per vehicle holding its id, lat,
+lng, speed, fix time and a flags word. Slots are handed out in order and a
+vehicle keeps its slot for as long as the file exists, so readers learn
+the id -> slot mapping once and only ever extend it.
+
+Exactly one worker writes: whichever holds the ``flock`` on the file. The
+lock goes away with its holder, and the next worker to ``claim()`` it
+refreshes every slot from its own fleet state and carries on. Readers take
+no lock. Each slot is guarded by a seqlock: the writer makes the slot's
+sequence number odd, writes the fields and makes it even again, and a
+reader accepts what it copied only if it saw the same even number before
+and after.
+"""
+import fcntl
+import mmap
+import os
+import struct
+from typing import Dict, Iterable, Optional, Tuple
+
+from heartbeats import LIVE, OFFLINE, STALE
+
+MAGIC = b"GCEPOS1\0"
+# magic, capacity, slots in use, writer pid
+HEADER = struct.Struct("<8sIIQ")
+COUNT = struct.Struct("<I")
+COUNT_OFFSET = 12
+# sequence, vehicle id, lat, lng, speed (km/h), fix time (epoch seconds), flags
+SLOT = struct.Struct("<Q40sddddI4x")
+SLOT_FIELDS = struct.Struct("<Q40xddddI4x")
+# Everything after the sequence: pack_into zeroes its whole range before packing, so the
+# writer must never pack over the sequence word or readers could see an even 0 mid-write
+PAYLOAD = struct.Struct("<40sddddI4x")
+SEQUENCE = struct.Struct("<Q")
+ID_SIZE = 40
+
+PRESENT = 0x1
+STALE_FLAG = 0x2
+OFFLINE_FLAG = 0x4
+STATUS_FLAGS = {LIVE: 0, STALE: STALE_FLAG, OFFLINE: OFFLINE_FLAG}
+
+# A slot read that keeps colliding with writes gives up and lets the caller go to the database
+READ_ATTEMPTS = 8
+
+# (lat, lng, speed, ts, flags)
+Position = Tuple[float, float, float, float, int]
+
+
+def status_of(flags: int) -> str:
+    if flags & OFFLINE_FLAG:
+        return OFFLINE
+    return STALE if flags & STALE_FLAG else LIVE
+
+
+class PositionTable:
+    """Fixed-layout vehicle positions at `path`; writable by whichever process claims it"""
+
+    def __init__(self, path: str, capacity: int = 4096):
+        self.path = path
+        self.capacity = capacity
+        self.size = HEADER.size + capacity * SLOT.size
+        self.fd: Optional[int] = None
+        self.buffer: Optional[mmap.mmap] = None
+        self.writer = False
+        # Byte offset of each vehicle's slot, for the first `count` slots
+        self.offsets: Dict[str, int] = {}
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def open(self):
+        if self.buffer is not None or not self.path:
+            return
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.fd).st_size < self.size:
+            os.ftruncate(self.fd, self.size)
+        self.buffer = mmap.mmap(self.fd, self.size)
+
+    def close(self):
+        if self.buffer is None:
+            return
+        if self.writer:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            self.writer = False
+        self.buffer.close()
+        os.close(self.fd)
+        self.buffer = self.fd = None
+        self.offsets.clear()
+        self.count = 0
+
+    def claim(self) -> bool:
+        """Become the writer if nobody is; True if this process writes the table"""
+        if self.buffer is None:
+            return False
+        if not self.writer:
+            try:
+                fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            self.writer = True
+            magic, capacity, _, _ = HEADER.unpack_from(self.buffer, 0)
+            if magic != MAGIC or capacity != self.capacity:
+                HEADER.pack_into(self.buffer, 0, MAGIC, self.capacity, 0, os.getpid())
+            else:
+                HEADER.pack_into(self.buffer, 0, MAGIC, self.capacity, self._sync(), os.getpid())
+        return True
+
+    # Writer
+
+    def rebuild(self, vehicles: Iterable[Tuple[str, float, float, float, float, str]]):
+        """Write every (vehicle id, lat, lng, speed, ts, status) row; vehicles not among them are marked absent"""
+        stale = set(self.offsets)
+        for row in vehicles:
+            stale.discard(row[0])
+            self.put(*row)
+        for vehicle_id in stale:
+            self.remove(vehicle_id)
+
+    def put(self, vehicle_id: str, lat: float, lng: float, speed: float, ts: float, status: str = LIVE) -> bool:
+        """Write a vehicle's position; False if it has no slot (table full, or an id too long to store)"""
+        offset = self.offsets.get(vehicle_id)
+        if offset is not None:
+            self._write(offset, vehicle_id, lat, lng, speed, ts, PRESENT | STATUS_FLAGS.get(status, 0))
+            return True
+        if self.count >= self.capacity or len(vehicle_id.encode()) > ID_SIZE:
+            return False
+        offset = self.offsets[vehicle_id] = HEADER.size + self.count * SLOT.size
+        self.count += 1
+        self._write(offset, vehicle_id, lat, lng, speed, ts, PRESENT | STATUS_FLAGS.get(status, 0))
+        # Readers only look at slots below the header's count, which now includes this one
+        COUNT.pack_into(self.buffer, COUNT_OFFSET, self.count)
+        return True
+
+    def set_status(self, vehicle_id: str, status: str):
+        offset = self.offsets.get(vehicle_id)
+        if offset is not None:
+            _, lat, lng, speed, ts, flags = SLOT_FIELDS.unpack_from(self.buffer, offset)
+            if flags & PRESENT:
+                flags = flags & ~(STALE_FLAG | OFFLINE_FLAG) | STATUS_FLAGS.get(status, 0)
+                self._write(offset, vehicle_id, lat, lng, speed, ts, flags)
+
+    def remove(self, vehicle_id: str):
+        """Mark a vehicle absent; its slot stays reserved for it"""
+        offset = self.offsets.get(vehicle_id)
+        if offset is not None:
+            self._write(offset, vehicle_id, 0.0, 0.0, 0.0, 0.0, 0)
+
+    def _write(self, offset: int, vehicle_id: str, lat: float, lng: float, speed: float, ts: float, flags: int):
+        sequence, = SEQUENCE.unpack_from(self.buffer, offset)
+        sequence |= 1  # a writer that died mid-write left it odd
+        SEQUENCE.pack_into(self.buffer, offset, sequence)
+        PAYLOAD.pack_into(self.buffer, offset + SEQUENCE.size, vehicle_id.encode(), lat, lng, speed, ts, flags)
+        SEQUENCE.pack_into(self.buffer, offset, sequence + 1)
+
+    # Readers (the writer reads through the same path)
+
+    def _sync(self) -> int:
+        """Learn the slots the writer added since the last look; returns the slot count"""
+        count, = COUNT.unpack_from(self.buffer, COUNT_OFFSET)
+        if count == self.count:
+            return count
+        if count < self.count or count > self.capacity:
+            # The file was laid out afresh (capacity changed): start over
+            self.offsets.clear()
+            self.count = 0
+            count = min(count, self.capacity)
+        buffer = self.buffer
+        for slot in range(self.count, count):
+            offset = HEADER.size + slot * SLOT.size
+            self.offsets[buffer[offset + 8:offset + 8 + ID_SIZE].rstrip(b"\0").decode()] = offset
+        self.count = count
+        return count
+
+    def get(self, vehicle_id: str) -> Optional[Position]:
+        """The vehicle's latest position, or None if the table can't vouch for one (use the database)"""
+        if self.buffer is None:
+            return None
+        offset = self.offsets.get(vehicle_id)
+        if offset is None:
+            if self.writer or self._sync() == 0:
+                return None
+            offset = self.offsets.get(vehicle_id)
+            if offset is None:
+                return None
+        buffer = self.buffer
+        for _ in range(READ_ATTEMPTS):
+            values = SLOT_FIELDS.unpack_from(buffer, offset)
+            sequence = values[0]
+            if not sequence & 1 and SEQUENCE.unpack_from(buffer, offset)[0] == sequence:
+                return values[1:] if values[5] & PRESENT else None
+        return None
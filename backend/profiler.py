@@ -0,0 +1,225 @@
+"""On-demand sampling profiler and event-loop blocking watchdog.
+
+The profiler runs a daemon thread that periodically snapshots the event loop
+thread's Python stack via ``sys._current_frames()`` and aggregates the stacks
+in the collapsed format understood by flamegraph.pl / speedscope
+(``outer;inner;leaf <count>``). It can sample the whole worker for a time
+window, or only a percentage of requests to a single route: in route mode the
+middleware registers the request's coroutine frame and samples are kept only
+while that frame is on the stack, then discarded if the request turned out to
+hit a different route.
+
+The watchdog keeps a heartbeat callback on the loop and, from a second
+thread, captures the loop thread's stack whenever the heartbeat is late by
+more than a threshold, which pinpoints synchronous calls (bcrypt, logging
+handlers, blocking I/O) that stall every request on the worker.
+"""
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+
+def collapse_stack(frame, stop_at=None) -> str:
+    """Render a frame chain root-first as `file:function;...`"""
+    names = []
+    while frame is not None and frame is not stop_at:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+class SamplingProfiler:
+    """Statistical profiler for the thread running the event loop"""
+
+    def __init__(self):
+        self.mode: Optional[str] = None
+        self.route: Optional[str] = None
+        self.percent = 0.0
+        self.interval = 0.005
+        self.started_at: Optional[float] = None
+        self.deadline: Optional[float] = None
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        # id(request frame) -> stacks sampled while that request was on-CPU
+        self._requests: Dict[int, List[str]] = {}
+        self._target_thread: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, mode: str, duration_s: float, route: Optional[str] = None,
+              percent: float = 100.0, interval_s: float = 0.005):
+        """Begin sampling; must be called from the event loop thread"""
+        if self.running:
+            raise RuntimeError("Profiler already running")
+        if mode not in ("window", "route"):
+            raise ValueError("mode must be 'window' or 'route'")
+        if mode == "route" and not route:
+            raise ValueError("route is required in route mode")
+        self.mode = mode
+        self.route = route
+        self.percent = max(0.0, min(100.0, percent))
+        self.interval = max(0.001, interval_s)
+        self.started_at = time.monotonic()
+        self.deadline = self.started_at + duration_s
+        self.samples = 0
+        self.stacks = Counter()
+        self._requests = {}
+        self._target_thread = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+
+    def _run(self):
+        while not self._stop.is_set() and time.monotonic() < self.deadline:
+            frame = sys._current_frames().get(self._target_thread)
+            if frame is not None:
+                self._sample(frame)
+            self._stop.wait(self.interval)
+
+    def _sample(self, frame):
+        if self.mode == "window":
+            self.stacks[collapse_stack(frame)] += 1
+            self.samples += 1
+            return
+        requests = self._requests
+        if not requests:
+            return
+        walker = frame
+        while walker is not None:
+            bucket = requests.get(id(walker))
+            if bucket is not None:
+                bucket.append(collapse_stack(frame))
+                return
+            walker = walker.f_back
+
+    # Route mode hooks, called from the middleware on the loop thread
+
+    def wants_request(self) -> bool:
+        return self.mode == "route" and self.running and random.random() * 100 < self.percent
+
+    def enter_request(self, frame):
+        self._requests[id(frame)] = []
+
+    def exit_request(self, frame, route_path: Optional[str]):
+        stacks = self._requests.pop(id(frame), None)
+        if stacks and route_path == self.route:
+            self.stacks.update(stacks)
+            self.samples += len(stacks)
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def status(self) -> Dict:
+        now = time.monotonic()
+        return {
+            "running": self.running,
+            "mode": self.mode,
+            "route": self.route,
+            "percent": self.percent,
+            "interval_ms": round(self.interval * 1000, 3),
+            "elapsed_s": round(now - self.started_at, 3) if self.started_at else None,
+            "remaining_s": round(max(0.0, self.deadline - now), 3) if self.deadline and self.running else 0,
+            "samples": self.samples,
+            "distinct_stacks": len(self.stacks)
+        }
+
+
+class ProfilerMiddleware:
+    """ASGI middleware enrolling a sample of requests into route-mode profiling"""
+
+    def __init__(self, app, profiler: SamplingProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.wants_request():
+            await self.app(scope, receive, send)
+            return
+        # This coroutine's frame sits below the handler on the loop thread's
+        # stack whenever the request is running, which is what the sampler matches.
+        frame = sys._getframe()
+        self.profiler.enter_request(frame)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route = scope.get("route")
+            self.profiler.exit_request(frame, getattr(route, "path", None))
+
+
+class LoopWatchdog:
+    """Flag event-loop stalls longer than a threshold, with the blocking stack"""
+
+    def __init__(self, threshold_s: float = 0.1, max_events: int = 200):
+        self.threshold = threshold_s
+        self.events = deque(maxlen=max_events)
+        self._beat = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._handle = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Begin watching the running loop; must be called from the loop thread"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._stop.clear()
+        self._heartbeat()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._handle is not None:
+            self._handle.cancel()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+
+    def _heartbeat(self):
+        self._beat = time.monotonic()
+        self._handle = self._loop.call_later(self.threshold / 4, self._heartbeat)
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stop.wait(self.threshold / 4):
+            beat = self._beat
+            stalled = time.monotonic() - beat
+            if stalled < self.threshold:
+                if reported_beat is not None and beat != reported_beat:
+                    # Loop recovered: record how long the stall lasted in total
+                    self.events[-1]["blocked_ms"] = round((beat - reported_beat) * 1000, 1)
+                    reported_beat = None
+                continue
+            if reported_beat == beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            self.events.append({
+                "detected_at": datetime.now(timezone.utc).isoformat(),
+                "blocked_ms": round(stalled * 1000, 1),
+                "stack": collapse_stack(frame) if frame is not None else None
+            })
+            reported_beat = beat
+
+    def report(self) -> Dict:
+        return {"threshold_ms": round(self.threshold * 1000, 1), "events": list(self.events)}
+
+
+profiler = SamplingProfiler()
+watchdog = LoopWatchdog(float(os.environ.get('LOOP_BLOCK_THRESHOLD_MS', '100')) / 1000)
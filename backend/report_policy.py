@@ -0,0 +1,103 @@
+"""How often each tracker should report, decided by the server.
+
+Trackers report at whatever interval they were told in the last GPS
+response. A parked bus gains nothing from a fix every few seconds, while an
+ambulance closing in on a student, or a bus someone is waiting for, needs
+them often. ``ReportPolicy.interval`` picks the interval from the vehicle's
+motion, whether it is on a trip or a booking, how close it is to users
+waiting on its ETA and how loaded ingest is; routine intervals stretch
+under load, the ones that matter to someone waiting never do.
+
+``EtaWatchers`` remembers where users recently asked for a vehicle's ETA,
+so the policy can tell when a bus nears someone looking at it. A student
+polling the ETA page repeats the same lookup every few seconds; ``known``
+tells the caller when noting it again would change nothing, so it need not
+be broadcast to every worker.
+"""
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional, Tuple
+
+from dispatch import haversine_km
+
+
+@dataclass
+class ReportPolicy:
+    """Reporting intervals in seconds by situation"""
+    parked_s: float = 60.0       # no trip or booking and not moving
+    stopped_s: float = 20.0      # on a trip, standing (stop, traffic light)
+    moving_s: float = 10.0
+    fast_s: float = 5.0          # at or above fast_kmh
+    booking_s: float = 3.0       # ambulance on an accepted booking
+    watched_s: float = 5.0       # someone is waiting on this vehicle's ETA
+    near_s: float = 2.0          # ... and it is within near_km of them
+    idle_kmh: float = 3.0
+    fast_kmh: float = 30.0
+    near_km: float = 1.0
+    max_stretch: float = 4.0     # routine intervals grow at most this much under load
+    min_s: float = 1.0
+    max_s: float = 300.0
+
+    def interval(self, speed_kmh: float, on_trip: bool = False, on_booking: bool = False,
+                 waiting_km: Optional[float] = None, load: float = 0.0) -> int:
+        """Seconds until the next fix; `load` is the ingest rate over its target (1.0 = at target)"""
+        if speed_kmh < self.idle_kmh:
+            interval = self.stopped_s if on_trip or on_booking else self.parked_s
+        elif speed_kmh >= self.fast_kmh:
+            interval = self.fast_s
+        else:
+            interval = self.moving_s
+        # Someone is waiting on this vehicle: never stretched
+        if on_booking or waiting_km is not None:
+            urgent = self.booking_s if on_booking else self.watched_s
+            if waiting_km is not None and waiting_km <= self.near_km:
+                urgent = min(urgent, self.near_s)
+            interval = min(interval, urgent)
+        elif load > 1.0:
+            interval *= min(load, self.max_stretch)
+        return int(round(min(max(interval, self.min_s), self.max_s)))
+
+
+class EtaWatchers:
+    """Recent ETA lookups per vehicle: where the user was and when, newest `per_vehicle` kept"""
+
+    def __init__(self, ttl_s: float = 300.0, per_vehicle: int = 32, refresh_s: float = 30.0,
+                 same_deg: float = 0.0005):
+        self.ttl_s = ttl_s
+        self.per_vehicle = per_vehicle
+        # A lookup within same_deg (~50 m) of one noted less than refresh_s ago adds nothing
+        self.refresh_s = refresh_s
+        self.same_deg = same_deg
+        self.watchers: Dict[str, Deque[Tuple[float, float, float]]] = {}
+
+    def note(self, vehicle_id: str, lat: float, lng: float, now: float):
+        watchers = self.watchers.get(vehicle_id)
+        if watchers is None:
+            watchers = self.watchers[vehicle_id] = deque(maxlen=self.per_vehicle)
+        watchers.append((lat, lng, now))
+
+    def known(self, vehicle_id: str, lat: float, lng: float, now: float) -> bool:
+        """Whether a lookup from about here was noted within refresh_s"""
+        watchers = self.watchers.get(vehicle_id)
+        if not watchers:
+            return False
+        same = self.same_deg
+        for w_lat, w_lng, at in reversed(watchers):
+            if now - at > self.refresh_s:
+                return False
+            if abs(w_lat - lat) <= same and abs(w_lng - lng) <= same:
+                return True
+        return False
+
+    def nearest_km(self, vehicle_id: str, lat: float, lng: float, now: float) -> Optional[float]:
+        """Distance to the closest user who asked within ttl_s, or None if nobody is waiting"""
+        watchers = self.watchers.get(vehicle_id)
+        if not watchers:
+            return None
+        # Oldest first, so expired lookups come off the left
+        while watchers and now - watchers[0][2] > self.ttl_s:
+            watchers.popleft()
+        if not watchers:
+            del self.watchers[vehicle_id]
+            return None
+        return min(haversine_km(lat, lng, w_lat, w_lng) for w_lat, w_lng, _ in watchers)
@@ -0,0 +1,113 @@
+"""Section control: average speed between consecutive RFID gates.
+
+Each scan is compared with the same student's previous gate passage; when a
+distance is configured for that pair of gates, the average speed over the
+section is the distance over the elapsed time. Scanner-reported spot speeds
+are not needed.
+
+Per-student state is one ``Passage`` (two slots: interned gate number and
+epoch seconds) in a dict keyed by registration id. The dict is kept in
+last-seen order, so passages older than the maximum section time are
+dropped from its front without scanning the rest.
+"""
+import math
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+
+class Passage:
+    """A student's latest gate passage"""
+    __slots__ = ("gate", "ts")
+
+    def __init__(self, gate: int, ts: float):
+        self.gate = gate
+        self.ts = ts
+
+
+class SectionSpeed(NamedTuple):
+    from_gate: str
+    to_gate: str
+    meters: float
+    seconds: float
+    kmh: float
+
+
+class SectionTracker:
+    """Last gate passage per student and the gate-to-gate distance matrix"""
+
+    def __init__(self, max_section_s: float = 1800.0, sweep_interval_s: float = 60.0):
+        self.max_section_s = max_section_s
+        self.sweep_interval_s = sweep_interval_s
+        self.passages: Dict[str, Passage] = {}
+        self._gate_ids: Dict[str, int] = {}
+        self._gate_names: List[str] = []
+        # (lower gate id, higher gate id) -> meters
+        self._meters: Dict[Tuple[int, int], float] = {}
+        self._latest = -math.inf
+        self._next_sweep = -math.inf
+
+    def __len__(self) -> int:
+        return len(self.passages)
+
+    def _gate(self, name: str) -> int:
+        gate = self._gate_ids.get(name)
+        if gate is None:
+            gate = self._gate_ids[name] = len(self._gate_names)
+            self._gate_names.append(name)
+        return gate
+
+    def set_distances(self, pairs: Iterable[Tuple[str, str, float]]):
+        """Replace the distance matrix with symmetric (gate, gate, meters) entries"""
+        meters = {}
+        for first, second, distance in pairs:
+            a, b = self._gate(first), self._gate(second)
+            if a != b and distance > 0:
+                meters[(a, b) if a < b else (b, a)] = float(distance)
+        self._meters = meters
+
+    def distances(self) -> List[Dict]:
+        names = self._gate_names
+        return [{"from": names[a], "to": names[b], "meters": meters} for (a, b), meters in self._meters.items()]
+
+    def clear(self):
+        self.passages.clear()
+        self._latest = self._next_sweep = -math.inf
+
+    def observe(self, student: str, gate_name: str, ts: float) -> Optional[SectionSpeed]:
+        """Record a passage; returns the section speed if it closes a configured section"""
+        gate = self._gate(gate_name)
+        passages = self.passages
+        previous = passages.pop(student, None)
+        if previous is not None and ts < previous.ts:
+            # Late scan from a lagging scanner: keep the newer passage
+            passages[student] = previous
+            return None
+        passages[student] = Passage(gate, ts)
+
+        if ts > self._latest:
+            self._latest = ts
+            if ts >= self._next_sweep:
+                self.expire(ts)
+                self._next_sweep = ts + self.sweep_interval_s
+
+        if previous is None or previous.gate == gate:
+            return None
+        seconds = ts - previous.ts
+        if seconds <= 0 or seconds > self.max_section_s:
+            return None
+        key = (previous.gate, gate) if previous.gate < gate else (gate, previous.gate)
+        meters = self._meters.get(key)
+        if meters is None:
+            return None
+        return SectionSpeed(self._gate_names[previous.gate], gate_name, meters, seconds, meters / seconds * 3.6)
+
+    def expire(self, now: float) -> int:
+        """Drop passages too old to start a section; returns how many were dropped"""
+        cutoff = now - self.max_section_s
+        stale = []
+        for student, passage in self.passages.items():
+            if passage.ts >= cutoff:
+                break
+            stale.append(student)
+        for student in stale:
+            del self.passages[student]
+        return len(stale)
@@ -2,27 +2,63 @@ from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.responses import StreamingResponse, PlainTextResponse
 import os
 import logging
+import re
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
 from typing import List, Optional, Dict, Any
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import uuid
 from datetime import datetime, timezone, timedelta
 import jwt
 import bcrypt
 import socketio
 import math
+import asyncio
+import heapq
+import time
+import csv
+import io
+import json
+import zlib
+import tempfile
+from urllib.parse import parse_qs
 from contextlib import asynccontextmanager
+import metrics
+from storage import Storage, MongoStorage, MemoryStorage, matches, apply_update
+from profiler import profiler, watchdog, ProfilerMiddleware
+from dispatch import DispatchEngine, PRIORITY_RANKS
+from section_control import SectionTracker
+from socket_managers import client_manager_from_url
+from viewports import ViewportIndex
+from fleet_state import FleetState
+from trip_stats import TripAccumulator
+from heartbeats import HeartbeatMonitor, LIVE
+from report_policy import EtaWatchers, ReportPolicy
+from ingest_pool import IngestPool, IngestWorkerError
+from position_table import PositionTable, status_of
+from owner_lock import OwnerLock
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Storage backend: "mongo" (default) or "memory" for tests and benchmarks.
+# Bound by create_app(); every route goes through this module-level handle.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo')
+db: Storage = None
+
+def storage_from_env() -> Storage:
+    """Build the storage backend selected by STORAGE_BACKEND"""
+    if STORAGE_BACKEND == 'memory':
+        return MemoryStorage()
+    return MongoStorage(
+        os.environ['MONGO_URL'],
+        os.environ['DB_NAME'],
+        event_listeners=[metrics.mongo_command_listener]
+    )
 
 # JWT Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'gce-campus-secret-key-2024')
@@ -34,8 +70,85 @@ BUS_SPEED_LIMIT = 40
 AMBULANCE_SPEED = 60
 CAMPUS_SPEED_LIMIT = 40
 
+# Dashboard counters are reconciled against the source collections this often (seconds)
+STATS_RECONCILE_INTERVAL_SECONDS = int(os.environ.get('STATS_RECONCILE_INTERVAL_SECONDS', '300'))
+
+# Finished bookings, ended trips and paid offences older than this move to *_archive collections
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '30'))
+ARCHIVE_INTERVAL_SECONDS = int(os.environ.get('ARCHIVE_INTERVAL_SECONDS', '3600'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '500'))
+
+# RFID scanners may post up to this many scans per batch; other workers see
+# device registry changes after at most RFID_REGISTRY_TTL_SECONDS
+RFID_SCAN_BATCH_MAX = 1000
+RFID_REGISTRY_TTL_SECONDS = float(os.environ.get('RFID_REGISTRY_TTL_SECONDS', '60'))
+
+# Two passages of the same student further apart than this don't form a speed-checked section
+RFID_SECTION_MAX_SECONDS = float(os.environ.get('RFID_SECTION_MAX_SECONDS', '1800'))
+
+# Active trips' running statistics are written to their trip documents this often (and at the
+# trip's end); fixes reporting less than TRIP_IDLE_SPEED_KMH count as idling until the next one
+TRIP_STATS_FLUSH_SECONDS = float(os.environ.get('TRIP_STATS_FLUSH_SECONDS', '30'))
+TRIP_IDLE_SPEED_KMH = float(os.environ.get('TRIP_IDLE_SPEED_KMH', '3'))
+
+# A vehicle whose tracker has been silent this long is shown as stale, then offline
+VEHICLE_STALE_SECONDS = float(os.environ.get('VEHICLE_STALE_SECONDS', '60'))
+VEHICLE_OFFLINE_SECONDS = float(os.environ.get('VEHICLE_OFFLINE_SECONDS', '300'))
+
+# Trackers are told when to report next; routine intervals stretch once GPS ingest passes this rate
+GPS_INGEST_TARGET_PER_SECOND = float(os.environ.get('GPS_INGEST_TARGET_PER_SECOND', '500'))
+
+# Latest vehicle positions are shared by the workers on a host through this memory-mapped file
+# (one worker writes it, all of them read it); empty reads positions from the database instead
+POSITION_TABLE_PATH = os.environ.get('POSITION_TABLE_PATH', os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+    f"gce-positions-{os.environ.get('DB_NAME', 'default')}"
+))
+POSITION_TABLE_CAPACITY = int(os.environ.get('POSITION_TABLE_CAPACITY', '4096'))
+
+# GPS fixes are handled in this many worker processes, a vehicle's fixes always by the worker its
+# IMEI hashes to; 0 handles them in the web process. Workers share MongoDB and reach sockets through
+# SOCKETIO_MESSAGE_QUEUE, so both are required
+GPS_INGEST_WORKERS = int(os.environ.get('GPS_INGEST_WORKERS', '0'))
+
+# Seconds a driver has to accept a dispatch offer before it cascades to the next ambulance
+DISPATCH_OFFER_TIMEOUT_SECONDS = float(os.environ.get('DISPATCH_OFFER_TIMEOUT_SECONDS', '20'))
+
+# Ambulance dispatch runs in one worker: the one holding a lock on this file (another takes over
+# when it exits). Only one host may dispatch, so workers on any further host must set it empty
+DISPATCH_LOCK_PATH = os.environ.get('DISPATCH_LOCK_PATH', os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+    f"gce-dispatch-{os.environ.get('DB_NAME', 'default')}.lock"
+))
+
+# Socket.IO fan-out across workers: empty keeps rooms in this process (one worker);
+# "mongo", a mongodb:// URL or a redis:// / valkey:// URL shares emits through that broker,
+# batching cross-worker messages for SOCKETIO_BATCH_WINDOW_MS
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE', '')
+SOCKETIO_BATCH_WINDOW_MS = float(os.environ.get('SOCKETIO_BATCH_WINDOW_MS', '2'))
+
+# Each client's outbox holds at most this many vehicle/ETA frames (the newest per vehicle);
+# a client whose transport takes nothing for SOCKETIO_SLOW_CLIENT_SECONDS is disconnected
+SOCKETIO_CLIENT_QUEUE_DEPTH = int(os.environ.get('SOCKETIO_CLIENT_QUEUE_DEPTH', '64'))
+SOCKETIO_SLOW_CLIENT_SECONDS = float(os.environ.get('SOCKETIO_SLOW_CLIENT_SECONDS', '30'))
+
+# Map viewport subscriptions are indexed in grid cells this many degrees wide (0.01 is about 1.1 km)
+VIEWPORT_CELL_DEG = float(os.environ.get('VIEWPORT_CELL_DEG', '0.01'))
+
+# Fleet state deltas kept for clients resuming after a reconnect; older gaps get a full snapshot
+FLEET_DELTA_HISTORY = int(os.environ.get('FLEET_DELTA_HISTORY', '4096'))
+
 # Socket.IO server
-sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
+sio = socketio.AsyncServer(
+    async_mode='asgi',
+    cors_allowed_origins='*',
+    serializer=metrics.MeteredPacket,
+    client_manager=client_manager_from_url(
+        SOCKETIO_MESSAGE_QUEUE, os.environ.get('MONGO_URL', ''), os.environ.get('DB_NAME', ''),
+        SOCKETIO_BATCH_WINDOW_MS / 1000, SOCKETIO_CLIENT_QUEUE_DEPTH, SOCKETIO_SLOW_CLIENT_SECONDS
+    )
+)
+metrics.registry.add_collector(lambda: metrics.SOCKET_OUTBOX_FRAMES.set(sio.manager.pending_frames()))
 
 # Security
 security = HTTPBearer()
@@ -93,6 +206,7 @@ class VehicleResponse(BaseModel):
     assigned_driver_name: Optional[str] = None
     is_out_of_station: bool = False
     current_location: Optional[Dict] = None
+    tracker_status: Optional[str] = None
     created_at: str
 
 class TripCreate(BaseModel):
@@ -109,6 +223,12 @@ class TripResponse(BaseModel):
     start_time: str
     end_time: Optional[str] = None
     is_active: bool = True
+    duration_s: Optional[float] = None
+    distance_km: Optional[float] = None
+    max_speed_kmh: Optional[float] = None
+    avg_speed_kmh: Optional[float] = None
+    idle_s: Optional[float] = None
+    overspeed_s: Optional[float] = None
 
 class BookingCreate(BaseModel):
     student_registration_id: str
@@ -116,6 +236,7 @@ class BookingCreate(BaseModel):
     place: str
     place_details: Optional[str] = None
     user_location: Dict  # {lat, lng}
+    priority: str = "normal"  # "critical", "high" or "normal"
 
 class BookingResponse(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -133,6 +254,7 @@ class BookingResponse(BaseModel):
     vehicle_id: Optional[str] = None
     vehicle_number: Optional[str] = None
     eta_minutes: Optional[float] = None
+    priority: str = "normal"
     created_at: str
 
 class GPSDataInput(BaseModel):
@@ -141,6 +263,7 @@ class GPSDataInput(BaseModel):
     longitude: float
     speed: float  # km/h
     timestamp: Optional[str] = None
+    sequence: Optional[int] = None  # tracker's message counter, tells apart fixes sent in the same second
 
 class OffenceResponse(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -157,6 +280,7 @@ class OffenceResponse(BaseModel):
     speed_limit: float
     location: Optional[Dict] = None
     rfid_number: Optional[str] = None
+    section: Optional[Dict] = None  # student_speed: gates, distance and time the speed was averaged over
     timestamp: str
     is_paid: bool = False
 
@@ -171,14 +295,30 @@ class RFIDDeviceResponse(BaseModel):
     location_name: str
     created_at: str
 
+class RFIDSectionCreate(BaseModel):
+    from_rfid: str
+    to_rfid: str
+    distance_m: float = Field(..., gt=0)
+
+class RFIDSectionResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    from_rfid: str
+    to_rfid: str
+    distance_m: float
+    created_at: str
+
 class RFIDScanInput(BaseModel):
     rfid_device_id: str
     student_registration_id: str
     student_name: str
     phone: str
-    speed: float
+    speed: Optional[float] = None  # scanner's own spot reading; recorded, not enforced
     timestamp: Optional[str] = None
 
+class RFIDScanBatchInput(BaseModel):
+    scans: List[RFIDScanInput] = Field(..., min_length=1, max_length=RFID_SCAN_BATCH_MAX)
+
 class OTPVerifyInput(BaseModel):
     booking_id: str
     otp: str
@@ -194,6 +334,13 @@ class ResetPasswordInput(BaseModel):
 class MarkOutOfStationInput(BaseModel):
     is_out_of_station: bool
 
+class ProfilerStartInput(BaseModel):
+    mode: str = "window"  # "window" (whole worker) or "route" (sampled requests)
+    duration_s: float = Field(30, gt=0, le=600)
+    route: Optional[str] = None  # route template, e.g. "/api/public/buses"
+    percent: float = Field(10, gt=0, le=100)
+    interval_ms: float = Field(5, ge=1, le=1000)
+
 # ============ UTILITIES ============
 
 def hash_password(password: str) -> str:
@@ -247,6 +394,22 @@ def calculate_eta(distance_km: float, speed_kmh: float) -> float:
         return 0
     return (distance_km / speed_kmh) * 60
 
+def geo_point(lat: float, lng: float) -> Dict:
+    """GeoJSON point for a 2dsphere-indexed field (coordinates are lng, lat)"""
+    return {"type": "Point", "coordinates": [lng, lat]}
+
+def device_time(timestamp: Optional[str], now: datetime) -> datetime:
+    """Device-supplied time in UTC; missing, unparseable or future times fall back to `now`"""
+    if not timestamp:
+        return now
+    try:
+        parsed = datetime.fromisoformat(timestamp)
+    except ValueError:
+        return now
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return min(parsed.astimezone(timezone.utc), now)
+
 def generate_otp() -> str:
     """Generate 6-digit OTP"""
     import random
@@ -288,6 +451,930 @@ def verify_otp_mock(phone: str, otp: str) -> bool:
             return True
     return False
 
+async def emit(event: str, data: Any, **kwargs):
+    """Emit a Socket.IO event, recording the per-event count (MeteredPacket records the size)"""
+    metrics.SOCKET_EMITS.inc((event,))
+    await sio.emit(event, data, **kwargs)
+
+# Rooms the server manages itself; clients cannot join them with `join_room`
+USER_ROOM = "user:{}"
+BOOKING_ROOM = "booking:{}"
+DRIVERS_ROOM = "drivers"
+# Every vehicle's positions; sockets leave it while they watch a map viewport instead
+FLEET_ROOM = "fleet"
+PRIVATE_ROOM_PREFIXES = ("user:", "booking:", DRIVERS_ROOM, FLEET_ROOM)
+
+async def join_user_to_room(user_id: str, room: str):
+    """Add every socket the user has open, on any worker, to `room`"""
+    await sio.manager.enter_room_members('/', USER_ROOM.format(user_id), room)
+
+# ============ DASHBOARD COUNTERS ============
+
+# Single document in `stats` holding the /admin/stats counters. Write paths
+# apply $inc deltas to it and a periodic job recounts to correct any drift.
+STATS_DOC_ID = "dashboard"
+
+ROLE_COUNTERS = {"student": "total_students", "driver": "total_drivers"}
+VEHICLE_COUNTERS = {"bus": "total_buses", "ambulance": "total_ambulances"}
+
+async def bump_stats(**deltas: int):
+    """Atomically apply counter deltas to the dashboard counters document"""
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    await db.stats.update_one({"id": STATS_DOC_ID}, {"$inc": deltas}, upsert=True)
+
+async def reconcile_stats() -> Dict[str, int]:
+    """Recount every dashboard counter from the source collections"""
+    counts = {
+        "total_students": await db.users.count_documents({"role": "student"}),
+        "total_drivers": await db.users.count_documents({"role": "driver"}),
+        "total_buses": await db.vehicles.count_documents({"vehicle_type": "bus"}),
+        "total_ambulances": await db.vehicles.count_documents({"vehicle_type": "ambulance"}),
+        "active_trips": await db.trips.count_documents({"is_active": True}),
+        "pending_bookings": await db.bookings.count_documents({"status": "pending"}),
+        "total_offences": await db.offences.count_documents({}) + await db.offences_archive.count_documents({}),
+        "unpaid_offences": await db.offences.count_documents({"is_paid": False})
+    }
+    await db.stats.update_one(
+        {"id": STATS_DOC_ID},
+        {"$set": {**counts, "reconciled_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True
+    )
+    return counts
+
+async def stats_reconcile_loop():
+    """Periodically correct drift in the dashboard counters"""
+    while True:
+        try:
+            await reconcile_stats()
+        except Exception:
+            logging.exception("Dashboard counter reconciliation failed")
+        await asyncio.sleep(STATS_RECONCILE_INTERVAL_SECONDS)
+
+# ============ BOOKING STATE MACHINE ============
+
+# pending → accepted → in_progress → completed; cancellable from pending, accepted and
+# in_progress (a driver may abort mid-ride), never once completed
+BOOKING_TRANSITIONS = {
+    "pending": {"accepted", "cancelled"},
+    "accepted": {"in_progress", "cancelled"},
+    "in_progress": {"completed", "cancelled"},
+    "completed": set(),
+    "cancelled": set()
+}
+
+def booking_sources(target: str) -> List[str]:
+    """Statuses a booking may move to `target` from"""
+    return [source for source, targets in BOOKING_TRANSITIONS.items() if target in targets]
+
+async def transition_booking(
+    booking_id: str,
+    target: str,
+    conditions: Optional[Dict] = None,
+    fields: Optional[Dict] = None,
+    mismatch_detail: str = "Booking cannot be updated"
+) -> Dict:
+    """Atomically move a booking to `target` and return the updated document
+
+    The allowed source statuses and any extra `conditions` are part of the
+    update filter, so concurrent transitions race inside the database and
+    exactly one wins in a single round trip. The booking is only re-read on
+    failure, to pick the right error.
+    """
+    conditions = conditions or {}
+    sources = booking_sources(target)
+    booking = await db.bookings.find_one_and_update(
+        {"id": booking_id, "status": {"$in": sources}, **conditions},
+        {"$set": {"status": target, **(fields or {})}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if booking:
+        return booking
+    
+    current = await db.bookings.find_one({"id": booking_id}, {"_id": 0})
+    if not current:
+        raise HTTPException(status_code=404, detail="Booking not found")
+    if "driver_id" in conditions and current.get('driver_id') != conditions['driver_id']:
+        raise HTTPException(status_code=403, detail="This booking is not assigned to you")
+    if current['status'] not in sources:
+        if target == "accepted":
+            raise HTTPException(status_code=400, detail="Booking no longer available")
+        raise HTTPException(status_code=400, detail=f"Booking is {current['status']}, cannot move to {target}")
+    raise HTTPException(status_code=400, detail=mismatch_detail)
+
+# ============ DISPATCH ============
+
+# Offers pending bookings to the nearest idle ambulance; the engine's state
+# mirrors the database and is rebuilt from it on startup.
+dispatcher = DispatchEngine(
+    eta_minutes=lambda distance_km: calculate_eta(distance_km, AMBULANCE_SPEED),
+    offer_timeout_s=DISPATCH_OFFER_TIMEOUT_SECONDS
+)
+dispatcher.on_decision = metrics.DISPATCH_DECISION.observe
+
+# Only the worker holding the dispatch lock runs the engine; with more than one, every booking would
+# be offered once per worker. The others hand bookings, drivers' answers and ambulance changes to it
+# through run_everywhere, and answer offer lookups from the board it publishes to every process.
+# GPS ingest workers never claim it.
+dispatch_lock = OwnerLock(DISPATCH_LOCK_PATH)
+dispatch_owner = False
+# Booking id -> the offer it is out on, as published by the dispatching worker
+offer_board: Dict[str, Dict] = {}
+
+# Strong references to fire-and-forget tasks so they are not garbage collected
+background_tasks = set()
+
+def spawn(coro):
+    """Run a coroutine in the background from synchronous code"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def offer_entry(offer) -> Dict:
+    """An offer as shown on the board: its fields, and whether any driver may take the booking"""
+    booking = dispatcher.bookings.get(offer.booking_id)
+    return {**offer.to_dict(), "open": booking is not None and booking.exhausted}
+
+# Board updates are spawned in the order the engine decides, so other workers apply them in that order
+def post_offer(offer):
+    spawn(sio.manager.run_everywhere('offer_posted', offer_entry(offer)))
+
+def end_offer(booking_id: str, attempt: Optional[int] = None):
+    spawn(sio.manager.run_everywhere('offer_ended', {"booking_id": booking_id, "attempt": attempt}))
+
+def offer_for_booking(booking_id: str) -> Optional[Dict]:
+    """The offer a booking is out on: from the engine in the dispatching worker, the board elsewhere"""
+    if dispatch_owner:
+        offer = dispatcher.offers.get(booking_id)
+        return offer_entry(offer) if offer else None
+    entry = offer_board.get(booking_id)
+    return entry if entry and entry['expires_at'] > time.time() else None
+
+def offer_for_driver(driver_id: str) -> Optional[Dict]:
+    """The offer a driver holds, if any"""
+    if dispatch_owner:
+        offer = dispatcher.offer_for_driver(driver_id)
+        return offer_entry(offer) if offer else None
+    now = time.time()
+    return next((entry for entry in offer_board.values()
+                 if entry['driver_id'] == driver_id and entry['expires_at'] > now), None)
+
+def on_dispatch_offer(offer):
+    metrics.DISPATCH_OFFERS.inc(("offered",))
+    post_offer(offer)
+    spawn(emit('booking_offer', offer.to_dict(), room=USER_ROOM.format(offer.driver_id)))
+
+def on_dispatch_expire(offer):
+    metrics.DISPATCH_OFFERS.inc(("expired",))
+    end_offer(offer.booking_id, offer.attempt)
+    spawn(emit('booking_offer_expired', {"booking_id": offer.booking_id}, room=USER_ROOM.format(offer.driver_id)))
+
+def on_dispatch_withdraw(offer):
+    # The booking was taken or cancelled, or the ambulance left, before the driver answered
+    metrics.DISPATCH_OFFERS.inc(("withdrawn",))
+    end_offer(offer.booking_id, offer.attempt)
+    spawn(emit('booking_offer_expired', {"booking_id": offer.booking_id}, room=USER_ROOM.format(offer.driver_id)))
+
+async def announce_pending_booking(booking: Dict):
+    """Tell drivers a booking is waiting, without exposing the student's details"""
+    await emit('booking_pending', {
+        "booking_id": booking['id'],
+        "place": booking['place'],
+        "priority": booking['priority'],
+        "created_at": booking['created_at']
+    }, room=DRIVERS_ROOM)
+
+async def reannounce_pending_booking(booking_id: str):
+    booking = await db.bookings.find_one({"id": booking_id, "status": "pending"}, {"_id": 0})
+    if booking:
+        await announce_pending_booking(booking)
+
+def on_dispatch_exhausted(pending):
+    # Every idle ambulance declined: offers start over, and any driver may now take it
+    metrics.DISPATCH_OFFERS.inc(("exhausted",))
+    spawn(reannounce_pending_booking(pending.booking_id))
+
+dispatcher.on_offer = on_dispatch_offer
+dispatcher.on_expire = on_dispatch_expire
+dispatcher.on_withdraw = on_dispatch_withdraw
+dispatcher.on_exhausted = on_dispatch_exhausted
+
+async def refresh_ambulance(vehicle_id: str):
+    """Re-derive from the database whether an ambulance can receive offers"""
+    vehicle = await db.vehicles.find_one({"id": vehicle_id}, {"_id": 0})
+    if (not vehicle or vehicle['vehicle_type'] != 'ambulance'
+            or not vehicle.get('assigned_to') or not vehicle.get('current_location')):
+        dispatcher.set_unavailable(vehicle_id)
+        return
+    active_booking = await db.bookings.find_one({
+        "vehicle_id": vehicle_id,
+        "status": {"$in": ["accepted", "in_progress"]}
+    }, {"_id": 0})
+    if active_booking:
+        dispatcher.set_unavailable(vehicle_id, busy=True)
+        return
+    location = vehicle['current_location']
+    dispatcher.set_available(
+        vehicle_id, vehicle['vehicle_number'], vehicle['assigned_to'],
+        vehicle.get('assigned_driver_name'), location['lat'], location['lng']
+    )
+
+async def load_dispatcher():
+    """Rebuild the dispatch engine from ambulances and pending bookings"""
+    dispatcher.reset()
+    busy = set()
+    async for booking in db.bookings.find({"status": {"$in": ["accepted", "in_progress"]}}, {"_id": 0}):
+        busy.add(booking.get('vehicle_id'))
+    async for vehicle in db.vehicles.find(
+        {"vehicle_type": "ambulance", "assigned_to": {"$ne": None}}, {"_id": 0}
+    ):
+        location = vehicle.get('current_location')
+        if vehicle['id'] in busy:
+            dispatcher.set_unavailable(vehicle['id'], busy=True)
+        elif location:
+            dispatcher.set_available(
+                vehicle['id'], vehicle['vehicle_number'], vehicle['assigned_to'],
+                vehicle.get('assigned_driver_name'), location['lat'], location['lng']
+            )
+    pending = await db.bookings.find({"status": "pending"}, {"_id": 0}).sort("created_at", 1).to_list(None)
+    for booking in pending:
+        submit_booking(booking)
+
+def submit_booking(booking: Dict):
+    """Queue a pending booking for dispatch; returns the immediate offer, if any"""
+    location = booking.get('user_location') or {}
+    if location.get('lat') is None or location.get('lng') is None:
+        return None
+    return dispatcher.submit(
+        booking['id'], location['lat'], location['lng'],
+        booking.get('priority', 'normal'), booking['created_at']
+    )
+
+async def claim_dispatch():
+    """Run the dispatcher here if no other worker does, rebuilding it from the database"""
+    global dispatch_owner
+    if dispatch_owner or not dispatch_lock.claim():
+        return
+    dispatch_owner = True
+    # Offers a previous owner published died with it
+    await sio.manager.run_everywhere('offers_reset', {})
+    await load_dispatcher()
+
+def release_dispatch():
+    """Stop dispatching here, leaving it to the next worker to claim the lock"""
+    global dispatch_owner
+    dispatcher.reset()
+    dispatch_lock.release()
+    dispatch_owner = False
+    offer_board.clear()
+
+async def booking_submitted(booking: Dict):
+    # Offer to the nearest idle ambulance; if none can take it, tell drivers
+    if dispatch_owner and submit_booking(booking) is None:
+        await announce_pending_booking(booking)
+
+async def offer_declined(data: Dict):
+    if not dispatch_owner:
+        return
+    offer = dispatcher.offers.get(data['booking_id'])
+    if dispatcher.decline(data['booking_id'], data['driver_id']):
+        end_offer(offer.booking_id, offer.attempt)
+
+async def booking_assigned(data: Dict):
+    if dispatch_owner:
+        dispatcher.assigned(data['booking_id'], data['vehicle_id'])
+        end_offer(data['booking_id'])
+
+async def booking_closed(data: Dict):
+    if dispatch_owner:
+        dispatcher.close(data['booking_id'])
+        end_offer(data['booking_id'])
+
+async def ambulance_changed(data: Dict):
+    if dispatch_owner:
+        await refresh_ambulance(data['vehicle_id'])
+
+async def offer_posted(entry: Dict):
+    if not dispatch_owner:
+        offer_board[entry['booking_id']] = entry
+
+async def offer_ended(data: Dict):
+    # A newer offer for the booking may have been posted before the old one's end
+    entry = offer_board.get(data['booking_id'])
+    if entry is not None and data['attempt'] in (None, entry['attempt']):
+        del offer_board[data['booking_id']]
+
+async def offers_reset(data: Dict):
+    offer_board.clear()
+
+async def offers_wanted(data: Dict):
+    # A worker just started: send it the offers already out
+    if dispatch_owner:
+        for offer in dispatcher.offers.values():
+            post_offer(offer)
+
+sio.manager.add_handler('booking_submitted', booking_submitted)
+sio.manager.add_handler('offer_declined', offer_declined)
+sio.manager.add_handler('booking_assigned', booking_assigned)
+sio.manager.add_handler('booking_closed', booking_closed)
+sio.manager.add_handler('ambulance_changed', ambulance_changed)
+sio.manager.add_handler('offer_posted', offer_posted)
+sio.manager.add_handler('offer_ended', offer_ended)
+sio.manager.add_handler('offers_reset', offers_reset)
+sio.manager.add_handler('offers_wanted', offers_wanted)
+
+# ============ FLEET STATE & MAP VIEWPORTS ============
+
+# Each worker applies every fix itself (through run_everywhere), so versions
+# are per worker and a client resuming on another worker gets a snapshot
+fleet = FleetState(FLEET_DELTA_HISTORY)
+viewports = ViewportIndex(VIEWPORT_CELL_DEG)
+# Written by one worker from its fleet state, read by all of them to answer position lookups
+positions = PositionTable(POSITION_TABLE_PATH, POSITION_TABLE_CAPACITY)
+
+def vehicle_update(vehicle: Dict, location: Dict, status: str = LIVE) -> Dict:
+    """The `vehicle_location` payload for a vehicle at `location`"""
+    return {
+        "vehicle_id": vehicle['id'],
+        "vehicle_number": vehicle['vehicle_number'],
+        "vehicle_type": vehicle['vehicle_type'],
+        "location": location,
+        "status": status
+    }
+
+async def publish_vehicle_location(update: Dict):
+    """Apply a fix to the fleet state and viewports of every worker"""
+    await sio.manager.run_everywhere('vehicle_moved', update)
+
+async def publish_vehicle_gone(vehicle_id: str):
+    """Take a vehicle off every viewport showing it"""
+    await sio.manager.run_everywhere('vehicle_gone', {"vehicle_id": vehicle_id})
+
+async def vehicle_moved(update: Dict):
+    heartbeats.beat(update['vehicle_id'], time.time())
+    record_trip_fix(update)
+    location = update['location']
+    if update['vehicle_type'] == 'ambulance' and dispatch_owner:
+        dispatcher.update_location(update['vehicle_id'], location['lat'], location['lng'])
+    update = fleet.upsert(update['vehicle_id'], update)
+    if positions.writer:
+        positions.put(*position_row(update['vehicle_id'], location, update['status']))
+    # Versions and subscribers belong to this worker's own sockets, so these emits skip the message queue
+    await emit('vehicle_location', update, room=FLEET_ROOM, ignore_queue=True)
+    change = viewports.move(update['vehicle_id'], location['lat'], location['lng'], update)
+    if change.entered:
+        await emit('vehicle_enter', update, to=list(change.entered), ignore_queue=True)
+    if change.moved:
+        await emit('vehicle_location', update, to=list(change.moved), ignore_queue=True)
+    if change.left:
+        await emit('vehicle_leave', {"vehicle_id": update['vehicle_id']}, to=list(change.left), ignore_queue=True)
+
+async def ambulance_idle(data: Dict):
+    # A crewed ambulance without a booking reported in: add it to dispatch if it isn't there yet
+    vehicle_id = data['vehicle_id']
+    if dispatch_owner and vehicle_id not in dispatcher.ambulances and vehicle_id not in dispatcher.busy:
+        await refresh_ambulance(vehicle_id)
+
+async def vehicle_gone(data: Dict):
+    # Off the map means off duty: an ambulance gets offers again from its next fix
+    if dispatch_owner:
+        dispatcher.set_unavailable(data['vehicle_id'])
+    removed = fleet.remove(data['vehicle_id'])
+    if positions.writer:
+        positions.remove(data['vehicle_id'])
+    if removed:
+        await emit('vehicle_removed', removed, room=FLEET_ROOM, ignore_queue=True)
+    heartbeats.forget(data['vehicle_id'])
+    subscribers = viewports.remove(data['vehicle_id'])
+    if subscribers:
+        await emit('vehicle_leave', data, to=list(subscribers), ignore_queue=True)
+
+sio.manager.add_handler('vehicle_moved', vehicle_moved)
+sio.manager.add_handler('ambulance_idle', ambulance_idle)
+sio.manager.add_handler('vehicle_gone', vehicle_gone)
+
+async def load_fleet():
+    """Rebuild the fleet state, viewport positions and heartbeat timers from the vehicles' last fixes"""
+    global heartbeats
+    fleet.reset()
+    viewports.clear()
+    now = datetime.now(timezone.utc)
+    heartbeats = new_heartbeat_monitor()
+    async for vehicle in db.vehicles.find(
+        {"current_point": {"$exists": True}},
+        {"_id": 0, "id": 1, "vehicle_number": 1, "vehicle_type": 1, "current_location": 1, "tracker_status": 1}
+    ):
+        location = vehicle.get('current_location')
+        if location and location.get('lat') is not None:
+            last_fix = device_time(location.get('timestamp'), now).timestamp()
+            status = heartbeats.track(vehicle['id'], last_fix, now.timestamp())
+            if status != vehicle.get('tracker_status', LIVE):
+                await db.vehicles.update_one({"id": vehicle['id']}, {"$set": {"tracker_status": status}})
+            update = fleet.upsert(vehicle['id'], vehicle_update(vehicle, location, status))
+            viewports.move(vehicle['id'], location['lat'], location['lng'], update)
+    claim_positions()
+
+def position_row(vehicle_id: str, location: Dict, status: str) -> tuple:
+    """A fleet entry as a row of the shared position table"""
+    fixed_at = device_time(location.get('timestamp'), datetime.now(timezone.utc))
+    return vehicle_id, location['lat'], location['lng'], location.get('speed') or 0, fixed_at.timestamp(), status
+
+def claim_positions():
+    """Write the shared position table from this worker's fleet state if no other worker does"""
+    if positions.claim():
+        positions.rebuild(position_row(vehicle_id, entry['location'], entry['status'])
+                          for vehicle_id, entry in fleet.vehicles.items())
+
+def position_location(position: tuple) -> Dict:
+    """A position from the shared table in the shape of a vehicle's `current_location`"""
+    lat, lng, speed, ts, _ = position
+    return {"lat": lat, "lng": lng, "speed": speed, "timestamp": datetime.fromtimestamp(ts, timezone.utc).isoformat()}
+
+async def send_fleet_state(sid: str, epoch: Optional[str] = None, version: Optional[int] = None):
+    """Bring a fleet room socket up to date: the deltas after `version` if still buffered, else a snapshot"""
+    deltas = fleet.deltas_since(epoch, version)
+    if deltas is None:
+        await emit('fleet_snapshot', fleet.snapshot(), to=sid, ignore_queue=True)
+    else:
+        await emit('fleet_deltas', {"epoch": fleet.epoch, "from_version": version, "version": fleet.version,
+                                    "deltas": deltas}, to=sid, ignore_queue=True)
+
+def parse_viewport(data: Any) -> Optional[tuple]:
+    """(south, west, north, east) from a `subscribe_viewport` payload, or None if it isn't a valid box"""
+    if not isinstance(data, dict):
+        return None
+    try:
+        south, west, north, east = (float(data[key]) for key in ("south", "west", "north", "east"))
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (-90 <= south <= north <= 90 and -180 <= west <= east <= 180):
+        return None
+    return south, west, north, east
+
+# ============ TRACKER HEARTBEATS ============
+
+def new_heartbeat_monitor() -> HeartbeatMonitor:
+    return HeartbeatMonitor(VEHICLE_STALE_SECONDS, VEHICLE_OFFLINE_SECONDS, now=time.time())
+
+# Fixes re-arm a vehicle's timer; the loop below only sees vehicles whose timers run out
+heartbeats = new_heartbeat_monitor()
+
+async def apply_tracker_statuses(changes) -> int:
+    """Persist and announce tracker status changes from the heartbeat monitor"""
+    for vehicle_id, status in changes:
+        await db.vehicles.update_one({"id": vehicle_id}, {"$set": {"tracker_status": status}})
+        delta = fleet.set_status(vehicle_id, status)
+        if delta is None:
+            continue
+        if positions.writer:
+            positions.set_status(vehicle_id, status)
+        await emit('vehicle_status', delta, room=FLEET_ROOM, ignore_queue=True)
+        if vehicle_id in viewports.payloads:
+            viewports.payloads[vehicle_id] = fleet.vehicles[vehicle_id]
+        subscribers = viewports.shown_in.get(vehicle_id)
+        if subscribers:
+            await emit('vehicle_status', delta, to=list(subscribers), ignore_queue=True)
+    return len(changes)
+
+async def heartbeat_loop():
+    """Mark vehicles stale or offline as their trackers' timers run out"""
+    while True:
+        await asyncio.sleep(heartbeats.wheel.tick_s)
+        try:
+            await apply_tracker_statuses(heartbeats.advance(time.time()))
+            # Take over the position table and dispatch if the workers running them have gone
+            if not positions.writer:
+                claim_positions()
+            if not dispatch_owner:
+                await claim_dispatch()
+        except Exception:
+            logging.exception("Tracker heartbeat check failed")
+
+# ============ TRIP STATISTICS ============
+
+# Running statistics of active trips by vehicle id; every worker folds in every fix
+trip_stats: Dict[str, TripAccumulator] = {}
+
+def new_trip_accumulator(trip_id: str) -> TripAccumulator:
+    return TripAccumulator(trip_id, CAMPUS_SPEED_LIMIT, TRIP_IDLE_SPEED_KMH)
+
+def record_trip_fix(update: Dict):
+    accumulator = trip_stats.get(update['vehicle_id'])
+    if accumulator is not None:
+        location = update['location']
+        fixed_at = device_time(location.get('timestamp'), datetime.now(timezone.utc))
+        accumulator.add(location['lat'], location['lng'], location.get('speed') or 0, fixed_at.timestamp())
+
+async def trip_started(data: Dict):
+    trip_stats[data['vehicle_id']] = new_trip_accumulator(data['trip_id'])
+
+async def trip_ended(data: Dict):
+    accumulator = trip_stats.get(data['vehicle_id'])
+    if accumulator is not None and accumulator.trip_id == data['trip_id']:
+        del trip_stats[data['vehicle_id']]
+
+sio.manager.add_handler('trip_started', trip_started)
+sio.manager.add_handler('trip_ended', trip_ended)
+
+async def flush_trip_stats() -> int:
+    """Write the running statistics of trips that got fixes since the last flush"""
+    flushed = 0
+    for accumulator in list(trip_stats.values()):
+        if accumulator.dirty:
+            accumulator.dirty = False
+            await db.trips.update_one({"id": accumulator.trip_id, "is_active": True}, {"$set": accumulator.summary()})
+            flushed += 1
+    return flushed
+
+async def trip_stats_loop():
+    """Periodically persist active trips' statistics"""
+    while True:
+        await asyncio.sleep(TRIP_STATS_FLUSH_SECONDS)
+        try:
+            await flush_trip_stats()
+        except Exception:
+            logging.exception("Flushing trip statistics failed")
+
+async def load_trip_stats():
+    """Carry on active trips' statistics from their last flush and their vehicles' last fixes"""
+    trip_stats.clear()
+    async for trip in db.trips.find({"is_active": True}, {"_id": 0}):
+        accumulator = trip_stats[trip['vehicle_id']] = new_trip_accumulator(trip['id'])
+        accumulator.restore(trip)
+    if not trip_stats:
+        return
+    async for vehicle in db.vehicles.find(
+        {"id": {"$in": list(trip_stats)}, "current_point": {"$exists": True}},
+        {"_id": 0, "id": 1, "current_location": 1}
+    ):
+        record_trip_fix({"vehicle_id": vehicle['id'], "location": vehicle['current_location']})
+        trip_stats[vehicle['id']].dirty = False
+
+# ============ ARCHIVAL ============
+
+# Which documents are finished for good, and the field their age is measured on.
+# Hot collections keep only live and recent documents; history reads both tiers.
+ARCHIVE_SPECS = {
+    "bookings": {"filter": {"status": {"$in": ["completed", "cancelled"]}}, "age_field": "created_at"},
+    "trips": {"filter": {"is_active": False}, "age_field": "end_time"},
+    "offences": {"filter": {"is_paid": True}, "age_field": "timestamp"}
+}
+
+def archive_name(collection: str) -> str:
+    return f"{collection}_archive"
+
+async def archive_collection(collection: str, cutoff: str) -> int:
+    """Move finished documents older than `cutoff` to the archive in batches"""
+    spec = ARCHIVE_SPECS[collection]
+    query = {**spec['filter'], spec['age_field']: {"$lt": cutoff}}
+    archive = db[archive_name(collection)]
+    moved = 0
+    while True:
+        batch = await db[collection].find(query, {"_id": 0}).limit(ARCHIVE_BATCH_SIZE).to_list(ARCHIVE_BATCH_SIZE)
+        if not batch:
+            break
+        ids = [doc['id'] for doc in batch]
+        # Replace copies left by an interrupted run, so a document is never archived twice
+        await archive.delete_many({"id": {"$in": ids}})
+        await archive.insert_many(batch)
+        result = await db[collection].delete_many({"id": {"$in": ids}, **spec['filter']})
+        moved += result.deleted_count
+        if len(batch) < ARCHIVE_BATCH_SIZE or result.deleted_count == 0:
+            break
+    return moved
+
+async def archive_finished(older_than_days: int = None) -> Dict[str, int]:
+    """Archive every collection in ARCHIVE_SPECS; returns documents moved per collection"""
+    days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+    moved = {}
+    for collection in ARCHIVE_SPECS:
+        moved[collection] = await archive_collection(collection, cutoff)
+    return moved
+
+async def archive_loop():
+    """Periodically move finished documents out of the hot collections"""
+    while True:
+        try:
+            moved = await archive_finished()
+            if any(moved.values()):
+                logging.info(f"Archived {moved}")
+        except Exception:
+            logging.exception("Archival failed")
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+def may_be_archived(collection: str, query: Dict) -> bool:
+    """False when the filter pins a field to a value archived documents never have"""
+    for field, condition in ARCHIVE_SPECS[collection]['filter'].items():
+        value = query.get(field)
+        if value is not None and not isinstance(value, dict) and not matches({field: value}, {field: condition}):
+            return False
+    return True
+
+async def find_history(collection: str, query: Dict, sort_field: str, limit: int) -> List[Dict]:
+    """Newest-first documents matching `query` across the hot and archive tiers"""
+    docs = await db[collection].find(query, {"_id": 0}).sort(sort_field, -1).to_list(limit)
+    if may_be_archived(collection, query):
+        archived = await db[archive_name(collection)].find(query, {"_id": 0}).sort(sort_field, -1).to_list(limit)
+        if archived:
+            docs = sorted(docs + archived, key=lambda doc: doc.get(sort_field) or "", reverse=True)[:limit]
+    return docs
+
+async def find_one_history(collection: str, query: Dict) -> Optional[Dict]:
+    """Look a document up in the hot tier, then the archive"""
+    doc = await db[collection].find_one(query, {"_id": 0})
+    if doc is None and may_be_archived(collection, query):
+        doc = await db[archive_name(collection)].find_one(query, {"_id": 0})
+    return doc
+
+async def merge_sorted(cursors: List, field: str):
+    """Merge cursors each sorted ascending on `field` into one ascending stream"""
+    iterators = [cursor.__aiter__() for cursor in cursors]
+    heap = []
+    for position, iterator in enumerate(iterators):
+        doc = await anext(iterator, None)
+        if doc is not None:
+            heap.append((doc.get(field) or "", position, doc))
+    heapq.heapify(heap)
+    while heap:
+        _, position, doc = heap[0]
+        yield doc
+        following = await anext(iterators[position], None)
+        if following is None:
+            heapq.heappop(heap)
+        else:
+            heapq.heapreplace(heap, (following.get(field) or "", position, following))
+
+# ============ ROLLUPS ============
+
+# Analytics counters per (period, bucket, dimension, key), e.g. offences by
+# driver for month "2026-10". Write paths $inc them as events happen, so the
+# analytics endpoints read a handful of small documents instead of scanning.
+ROLLUP_PERIODS = {"day": 10, "month": 7}  # prefix length of the UTC ISO date
+ROLLUP_BUCKET_PATTERNS = {"day": r"^\d{4}-\d{2}-\d{2}$", "month": r"^\d{4}-\d{2}$"}
+ROLLUP_BATCH_SIZE = 1000
+
+def rollup_buckets(timestamp: Optional[str]) -> Dict[str, str]:
+    """UTC day and month buckets for an ISO timestamp"""
+    try:
+        parsed = datetime.fromisoformat(timestamp)
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc)
+        date = parsed.date().isoformat()
+    except (TypeError, ValueError):
+        date = datetime.now(timezone.utc).date().isoformat()
+    return {period: date[:length] for period, length in ROLLUP_PERIODS.items()}
+
+def offence_rollup_updates(offence: Dict):
+    """(rollup id, update) pairs for one offence"""
+    keys = []
+    if offence.get('driver_id'):
+        keys.append(("driver", offence['driver_id'], offence.get('driver_name')))
+    if offence.get('vehicle_id'):
+        keys.append(("vehicle", offence['vehicle_id'], offence.get('vehicle_number')))
+    if offence.get('student_registration_id'):
+        keys.append(("student", offence['student_registration_id'], offence.get('student_name')))
+    for period, bucket in rollup_buckets(offence.get('timestamp')).items():
+        for dimension, key, label in keys:
+            yield f"{period}:{bucket}:{dimension}:{key}", {
+                "$inc": {"count": 1},
+                "$max": {"max_speed": offence.get('speed') or 0},
+                "$set": {"label": label},
+                "$setOnInsert": {"period": period, "bucket": bucket, "dimension": dimension, "key": key}
+            }
+
+def trip_rollup_updates(trip: Dict):
+    """(rollup id, update) pairs for one ended trip, bucketed by its start"""
+    keys = [
+        ("driver", trip['driver_id'], trip.get('driver_name')),
+        ("vehicle", trip['vehicle_id'], trip.get('vehicle_number'))
+    ]
+    for period, bucket in rollup_buckets(trip.get('start_time')).items():
+        for dimension, key, label in keys:
+            yield f"{period}:{bucket}:{dimension}:{key}", {
+                "$inc": {
+                    "trips": 1,
+                    "duration_s": trip.get('duration_s') or 0,
+                    "distance_km": trip.get('distance_km') or 0
+                },
+                "$set": {"label": label, "vehicle_type": trip.get('vehicle_type')},
+                "$setOnInsert": {"period": period, "bucket": bucket, "dimension": dimension, "key": key}
+            }
+
+def fold_rollup_updates(pairs) -> Dict[str, Dict]:
+    """Merge (rollup id, update) pairs so each rollup gets a single update"""
+    folded: Dict[str, Dict] = {}
+    for rollup_id, update in pairs:
+        current = folded.get(rollup_id)
+        if current is None:
+            folded[rollup_id] = {op: dict(fields) for op, fields in update.items()}
+            continue
+        for path, amount in update.get('$inc', {}).items():
+            current['$inc'][path] = current['$inc'].get(path, 0) + amount
+        for path, value in update.get('$max', {}).items():
+            current['$max'][path] = max(current['$max'].get(path, value), value)
+        current['$set'].update(update.get('$set', {}))
+    return folded
+
+async def record_offence_rollups(offences: List[Dict]):
+    pairs = (pair for offence in offences for pair in offence_rollup_updates(offence))
+    for rollup_id, update in fold_rollup_updates(pairs).items():
+        await db.offence_rollups.update_one({"id": rollup_id}, update, upsert=True)
+
+async def record_trip_rollup(trip: Dict):
+    for rollup_id, update in trip_rollup_updates(trip):
+        await db.trip_rollups.update_one({"id": rollup_id}, update, upsert=True)
+
+async def rebuild_rollups() -> Dict[str, int]:
+    """Recompute both rollup collections from offences and ended trips in every tier"""
+    sources = {
+        "offence_rollups": (["offences", "offences_archive"], {}, offence_rollup_updates),
+        "trip_rollups": (["trips", "trips_archive"], {"is_active": False}, trip_rollup_updates)
+    }
+    counts = {}
+    for target, (collections, query, updates) in sources.items():
+        # Fold every source document into local rollup documents, then swap them in
+        rollups: Dict[str, Dict] = {}
+        for collection in collections:
+            async for doc in db[collection].find(query, {"_id": 0}).batch_size(ROLLUP_BATCH_SIZE):
+                for rollup_id, update in updates(doc):
+                    rollup = rollups.get(rollup_id)
+                    inserting = rollup is None
+                    if inserting:
+                        rollup = rollups[rollup_id] = {"id": rollup_id}
+                    apply_update(rollup, update, inserting=inserting)
+        await db[target].delete_many({})
+        docs = list(rollups.values())
+        for start in range(0, len(docs), ROLLUP_BATCH_SIZE):
+            await db[target].insert_many(docs[start:start + ROLLUP_BATCH_SIZE])
+        counts[target] = len(docs)
+    return counts
+
+# ============ RFID INGEST ============
+
+# rfid_id -> device, loaded on first use and dropped when devices or sections change
+rfid_registry: Optional[Dict[str, Dict]] = None
+rfid_registry_loaded_at = 0.0
+rfid_registry_generation = 0
+
+# Each student's last gate passage and the gate-to-gate distances (rfid_sections). Every worker
+# folds in every passage through run_everywhere, so a student's next scan closes the section
+# whichever worker it reaches
+section_tracker = SectionTracker(max_section_s=RFID_SECTION_MAX_SECONDS)
+
+async def gate_passages(data: Dict):
+    # The worker that took the scans has already folded them in; the tracker ignores them as repeats
+    for student, gate, ts in data['passages']:
+        section_tracker.observe(student, gate, ts)
+
+sio.manager.add_handler('gate_passages', gate_passages)
+
+def invalidate_rfid_registry():
+    global rfid_registry, rfid_registry_generation
+    rfid_registry = None
+    rfid_registry_generation += 1
+
+async def get_rfid_registry() -> Dict[str, Dict]:
+    """Registered scanners by rfid_id, cached in memory with the section distances"""
+    global rfid_registry, rfid_registry_loaded_at
+    now = time.monotonic()
+    if rfid_registry is not None and now - rfid_registry_loaded_at < RFID_REGISTRY_TTL_SECONDS:
+        return rfid_registry
+    generation = rfid_registry_generation
+    devices = await db.rfid_devices.find({}, {"_id": 0}).to_list(None)
+    sections = await db.rfid_sections.find({}, {"_id": 0}).to_list(None)
+    registry = {device['rfid_id']: device for device in devices}
+    # A device added or deleted while loading makes this snapshot stale; serve it once, don't cache it
+    if generation == rfid_registry_generation:
+        rfid_registry, rfid_registry_loaded_at = registry, now
+        section_tracker.set_distances(
+            (section['from_rfid'], section['to_rfid'], section['distance_m']) for section in sections
+        )
+    return registry
+
+async def load_section_tracker():
+    """Rebuild the last-passage index from scans recent enough to still close a section"""
+    section_tracker.clear()
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=RFID_SECTION_MAX_SECONDS)).isoformat()
+    cursor = db.rfid_scans.find(
+        {"timestamp": {"$gte": cutoff}},
+        {"_id": 0, "rfid_device_id": 1, "student_registration_id": 1, "timestamp": 1}
+    ).sort("timestamp", 1)
+    async for scan in cursor:
+        section_tracker.observe(scan['student_registration_id'], scan['rfid_device_id'],
+                                datetime.fromisoformat(scan['timestamp']).timestamp())
+
+async def ingest_rfid_scans(scans: List[RFIDScanInput]) -> List[Dict]:
+    """Record scans and raise offences on the average speed between consecutive gates
+
+    Returns one result per scan, in order: status "unknown_device", "ok" or
+    "violation" with the new offence_id, plus section_speed when the scan
+    closed a configured section. Scans are written with one insert_many,
+    students looked up with one $in query and offences written with one
+    insert_many.
+    """
+    registry = await get_rfid_registry()
+    now = datetime.now(timezone.utc)
+    results = []
+    records = []
+    passages = []
+    violations = []
+    for scan in scans:
+        device = registry.get(scan.rfid_device_id)
+        if device is None:
+            results.append({"status": "unknown_device"})
+            continue
+        scanned_at = device_time(scan.timestamp, now)
+        passage = (scan.student_registration_id, scan.rfid_device_id, scanned_at.timestamp())
+        section = section_tracker.observe(*passage)
+        passages.append(passage)
+        result = {"status": "ok"}
+        if section is not None:
+            result['section_speed'] = round(section.kmh, 1)
+            if section.kmh > CAMPUS_SPEED_LIMIT:
+                result['status'] = "violation"
+                violations.append((len(results), scan, device, section, scanned_at.isoformat()))
+        records.append({
+            "id": str(uuid.uuid4()),
+            "rfid_device_id": scan.rfid_device_id,
+            "student_registration_id": scan.student_registration_id,
+            "reported_speed": scan.speed,
+            "section_speed": result.get('section_speed'),
+            "timestamp": scanned_at.isoformat()
+        })
+        results.append(result)
+    if records:
+        await db.rfid_scans.insert_many(records)
+        await sio.manager.run_everywhere('gate_passages', {"passages": passages})
+    if not violations:
+        return results
+    
+    registration_ids = list({scan.student_registration_id for _, scan, _, _, _ in violations})
+    students = {
+        student['registration_id']: student['id']
+        async for student in db.users.find(
+            {"registration_id": {"$in": registration_ids}},
+            {"_id": 0, "id": 1, "registration_id": 1}
+        )
+    }
+    offences = []
+    for position, scan, device, section, timestamp in violations:
+        speed = results[position]['section_speed']
+        start = registry.get(section.from_gate)
+        offence = {
+            "id": str(uuid.uuid4()),
+            "offence_type": "student_speed",
+            "student_id": students.get(scan.student_registration_id),
+            "student_name": scan.student_name,
+            "student_registration_id": scan.student_registration_id,
+            "phone": scan.phone,
+            "speed": speed,
+            "speed_limit": CAMPUS_SPEED_LIMIT,
+            "rfid_number": scan.rfid_device_id,
+            "location": {"name": device['location_name']},
+            "section": {
+                "from_rfid": section.from_gate,
+                "from_name": start['location_name'] if start else None,
+                "to_rfid": section.to_gate,
+                "distance_m": section.meters,
+                "seconds": round(section.seconds, 1)
+            },
+            "timestamp": timestamp,
+            "is_paid": False
+        }
+        offences.append(offence)
+        results[position]['offence_id'] = offence['id']
+        logging.warning(f"Student speed violation: {scan.student_name} averaged {speed} km/h "
+                        f"from {section.from_gate} to {section.to_gate}")
+    await db.offences.insert_many(offences)
+    await bump_stats(total_offences=len(offences), unpaid_offences=len(offences))
+    await record_offence_rollups(offences)
+    return results
+
+# ============ INDEXES ============
+
+async def ensure_indexes():
+    """Create the indexes the lookup, export, history and archival queries rely on"""
+    await db.offences.create_index("timestamp")
+    await db.trips.create_index("start_time")
+    await db.bookings.create_index("created_at")
+    await db.users.create_index("registration_id")
+    await db.rfid_devices.create_index("rfid_id")
+    await db.rfid_scans.create_index("timestamp")
+    for collection, spec in ARCHIVE_SPECS.items():
+        await db[collection].create_index(spec['age_field'])
+        await db[archive_name(collection)].create_index("id")
+        await db[archive_name(collection)].create_index(EXPORT_SPECS[collection]['time_field'])
+    for rollups, order in (("offence_rollups", "count"), ("trip_rollups", "duration_s")):
+        await db[rollups].create_index("id", unique=True)
+        await db[rollups].create_index([("period", 1), ("bucket", 1), ("dimension", 1), (order, -1)])
+    await db.vehicles.create_index([("current_point", "2dsphere")])
+    await db.gps_history.create_index("fix_key", unique=True)
+    await db.gps_history.create_index([("vehicle_id", 1), ("fixed_at", 1)])
+
 # ============ ROUTERS ============
 
 # Create the main app
@@ -309,11 +1396,49 @@ async def lifespan(app: FastAPI):
         }
         await db.users.insert_one(admin_user)
         logging.info("Admin user seeded")
+    await ensure_indexes()
+    invalidate_rfid_registry()
+    await load_section_tracker()
+    # Hear the other workers from the start, not only once a socket connects: dispatch work
+    # and gate passages reach this worker through the broker
+    if not sio.manager_initialized:
+        sio.manager_initialized = True
+        sio.manager.initialize()
+    await claim_dispatch()
+    if not dispatch_owner:
+        await sio.manager.run_everywhere('offers_wanted', {})
+    positions.open()
+    await load_fleet()
+    await load_trip_stats()
+    reconcile_task = asyncio.create_task(stats_reconcile_loop())
+    trip_stats_task = asyncio.create_task(trip_stats_loop())
+    heartbeat_task = asyncio.create_task(heartbeat_loop())
+    archive_task = asyncio.create_task(archive_loop())
+    loop_lag_task = asyncio.create_task(metrics.monitor_event_loop_lag())
+    watchdog.start()
+    global ingest_pool
+    if GPS_INGEST_WORKERS > 0:
+        if isinstance(db, MemoryStorage) or not SOCKETIO_MESSAGE_QUEUE:
+            logging.warning("GPS_INGEST_WORKERS needs MongoDB and SOCKETIO_MESSAGE_QUEUE; handling fixes here")
+        else:
+            ingest_pool = IngestPool(GPS_INGEST_WORKERS, gps_shard_handler)
+            ingest_pool.start()
     yield
     # Shutdown
-    client.close()
-
-app = FastAPI(lifespan=lifespan)
+    if ingest_pool is not None:
+        await ingest_pool.close()
+        ingest_pool = None
+    watchdog.stop()
+    profiler.stop()
+    release_dispatch()
+    reconcile_task.cancel()
+    trip_stats_task.cancel()
+    heartbeat_task.cancel()
+    archive_task.cancel()
+    loop_lag_task.cancel()
+    positions.close()
+    await sio.manager.close()
+    await db.close()
 
 # Create routers
 api_router = APIRouter(prefix="/api")
@@ -349,6 +1474,8 @@ async def signup(user_data: UserCreate):
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.users.insert_one(user)
+    if user['role'] in ROLE_COUNTERS:
+        await bump_stats(**{ROLE_COUNTERS[user['role']]: 1})
     
     token = create_token(user['id'], user['role'])
     return TokenResponse(
@@ -463,6 +1590,19 @@ async def get_active_buses():
     if active_trips:
         buses = []
         for trip in active_trips:
+            # Live positions come from the shared table; only vehicles it can't vouch for are read
+            position = positions.get(trip['vehicle_id'])
+            if position is not None:
+                buses.append({
+                    "trip_id": trip['id'],
+                    "vehicle_id": trip['vehicle_id'],
+                    "vehicle_number": trip['vehicle_number'],
+                    "driver_name": trip['driver_name'],
+                    "location": position_location(position),
+                    "tracker_status": status_of(position[4]),
+                    "is_out_of_station": False
+                })
+                continue
             vehicle = await db.vehicles.find_one({"id": trip['vehicle_id']}, {"_id": 0})
             if vehicle:
                 # If trip is active, bus is NOT out of station - reset flag if needed
@@ -477,6 +1617,7 @@ async def get_active_buses():
                     "vehicle_number": vehicle['vehicle_number'],
                     "driver_name": trip['driver_name'],
                     "location": vehicle.get('current_location'),
+                    "tracker_status": vehicle.get('tracker_status'),
                     "is_out_of_station": False
                 })
         return {"buses": buses, "all_out_of_station": False}
@@ -501,14 +1642,24 @@ async def get_active_buses():
 @public_router.get("/bus/{bus_id}/eta")
 async def get_bus_eta(bus_id: str, user_lat: float, user_lng: float):
     """Calculate ETA for a specific bus to user location"""
-    vehicle = await db.vehicles.find_one({"id": bus_id}, {"_id": 0})
-    if not vehicle:
-        raise HTTPException(status_code=404, detail="Bus not found")
-    
-    if not vehicle.get('current_location'):
-        return {"eta_minutes": None, "message": "Bus location not available"}
-    
-    bus_loc = vehicle['current_location']
+    position = positions.get(bus_id)
+    if position is not None:
+        bus_loc = position_location(position)
+    else:
+        vehicle = await db.vehicles.find_one({"id": bus_id}, {"_id": 0})
+        if not vehicle:
+            raise HTTPException(status_code=404, detail="Bus not found")
+        
+        if not vehicle.get('current_location'):
+            return {"eta_minutes": None, "message": "Bus location not available"}
+        bus_loc = vehicle['current_location']
+    
+    # The bus reports more often while someone is waiting for it; a repeat of a
+    # recent lookup (the ETA page polling) leaves that unchanged, so isn't broadcast
+    now = time.time()
+    if not eta_watchers.known(bus_id, user_lat, user_lng, now):
+        await sio.manager.run_everywhere('eta_watched', {"vehicle_id": bus_id, "lat": user_lat, "lng": user_lng,
+                                                         "at": now})
     distance = calculate_distance(bus_loc['lat'], bus_loc['lng'], user_lat, user_lng)
     eta = calculate_eta(distance, BUS_SPEED_LIMIT)
     
@@ -530,9 +1681,50 @@ async def get_available_ambulances():
     ).to_list(100)
     return {"ambulances": ambulances}
 
+@public_router.get("/vehicles/nearby")
+async def get_nearby_vehicles(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius: float = Query(2000, gt=0, le=50000, description="Search radius in meters"),
+    type: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100)
+):
+    """Vehicles with a known location within `radius` meters, nearest first"""
+    query = {}
+    if type:
+        if type not in VEHICLE_COUNTERS:
+            raise HTTPException(status_code=400, detail="Invalid vehicle type")
+        query["vehicle_type"] = type
+    
+    vehicles = await db.vehicles.aggregate([
+        {"$geoNear": {
+            "near": geo_point(lat, lng),
+            "key": "current_point",
+            "distanceField": "distance_m",
+            "maxDistance": radius,
+            "query": query,
+            "spherical": True
+        }},
+        {"$limit": limit},
+        # Public: name the fields to show, so assignment, odometer and tracker internals stay out
+        {"$project": {"_id": 0, "id": 1, "vehicle_number": 1, "vehicle_type": 1, "current_location": 1,
+                      "tracker_status": 1, "distance_m": 1}}
+    ]).to_list(limit)
+    
+    for vehicle in vehicles:
+        vehicle['status'] = vehicle.pop('tracker_status', LIVE)
+        distance_km = vehicle.pop('distance_m') / 1000
+        speed = AMBULANCE_SPEED if vehicle['vehicle_type'] == 'ambulance' else BUS_SPEED_LIMIT
+        vehicle['distance_km'] = round(distance_km, 3)
+        vehicle['eta_minutes'] = round(calculate_eta(distance_km, speed), 1)
+    return {"vehicles": vehicles}
+
 @public_router.post("/ambulance/book", response_model=BookingResponse)
 async def book_ambulance(booking_data: BookingCreate, user: dict = Depends(get_current_user)):
     """Book an ambulance"""
+    if booking_data.priority not in PRIORITY_RANKS:
+        raise HTTPException(status_code=400, detail="Invalid priority")
+    
     # Get student info
     student = await db.users.find_one(
         {"registration_id": booking_data.student_registration_id},
@@ -548,25 +1740,36 @@ async def book_ambulance(booking_data: BookingCreate, user: dict = Depends(get_c
         "place_details": booking_data.place_details,
         "user_location": booking_data.user_location,
         "status": "pending",
+        "user_id": user['id'],
         "otp": None,
         "driver_id": None,
         "driver_name": None,
         "vehicle_id": None,
         "vehicle_number": None,
         "eta_minutes": None,
+        "priority": booking_data.priority,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.bookings.insert_one(booking)
+    await bump_stats(pending_bookings=1)
+    response = BookingResponse(**booking)
     
-    # Broadcast to drivers via socket
-    await sio.emit('new_booking', booking)
+    # Booking events only reach the creator and, once accepted, the driver
+    room = BOOKING_ROOM.format(booking['id'])
+    await join_user_to_room(user['id'], room)
+    await emit('new_booking', response.model_dump(), room=room)
     
-    return BookingResponse(**booking)
+    # The dispatching worker offers it to the nearest idle ambulance, or tells drivers it is waiting
+    await sio.manager.run_everywhere('booking_submitted', {
+        key: booking[key] for key in ("id", "place", "priority", "user_location", "created_at")
+    })
+    
+    return response
 
 @public_router.get("/booking/{booking_id}", response_model=BookingResponse)
 async def get_booking(booking_id: str):
     """Get booking status"""
-    booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0})
+    booking = await find_one_history("bookings", {"id": booking_id})
     if not booking:
         raise HTTPException(status_code=404, detail="Booking not found")
     return BookingResponse(**booking)
@@ -574,10 +1777,7 @@ async def get_booking(booking_id: str):
 @public_router.get("/my-bookings")
 async def get_my_bookings(user: dict = Depends(get_current_user)):
     """Get user's bookings"""
-    bookings = await db.bookings.find(
-        {"phone": user['phone']},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(100)
+    bookings = await find_history("bookings", {"phone": user['phone']}, "created_at", 100)
     return {"bookings": bookings}
 
 # ============ DRIVER ROUTES ============
@@ -611,6 +1811,8 @@ async def assign_vehicle(vehicle_id: str, user: dict = Depends(get_current_user)
         {"id": vehicle_id},
         {"$set": {"assigned_to": user['id'], "assigned_driver_name": user['name']}}
     )
+    if vehicle['vehicle_type'] == 'ambulance':
+        await sio.manager.run_everywhere('ambulance_changed', {"vehicle_id": vehicle_id})
     
     return {"message": "Vehicle assigned successfully"}
 
@@ -631,6 +1833,8 @@ async def release_vehicle(vehicle_id: str, user: dict = Depends(get_current_user
         {"id": vehicle_id},
         {"$set": {"assigned_to": None, "assigned_driver_name": None}}
     )
+    if vehicle['vehicle_type'] == 'ambulance':
+        await sio.manager.run_everywhere('ambulance_changed', {"vehicle_id": vehicle_id})
     
     return {"message": "Vehicle released successfully"}
 
@@ -664,9 +1868,15 @@ async def start_trip(trip_data: TripCreate, user: dict = Depends(get_current_use
         "vehicle_type": vehicle['vehicle_type'],
         "start_time": datetime.now(timezone.utc).isoformat(),
         "end_time": None,
-        "is_active": True
+        "is_active": True,
+        "start_odometer_km": vehicle.get('odometer_km', 0)
     }
     await db.trips.insert_one(trip)
+    await bump_stats(active_trips=1)
+    # A bus on a trip is in station; the bus listing no longer reads vehicles to notice
+    if vehicle.get('is_out_of_station'):
+        await db.vehicles.update_one({"id": vehicle['id']}, {"$set": {"is_out_of_station": False}})
+    await sio.manager.run_everywhere('trip_started', {"trip_id": trip['id'], "vehicle_id": trip['vehicle_id']})
     
     return TripResponse(**trip)
 
@@ -683,19 +1893,39 @@ async def end_trip(trip_id: str, user: dict = Depends(get_current_user)):
     if not trip['is_active']:
         raise HTTPException(status_code=400, detail="Trip already ended")
     
-    await db.trips.update_one(
-        {"id": trip_id},
+    # Clear vehicle location, reading the odometer the trip distance is measured on
+    vehicle = await db.vehicles.find_one_and_update(
+        {"id": trip['vehicle_id']},
+        {"$set": {"current_location": None}, "$unset": {"current_point": "", "tracker_status": ""}},
+        projection={"_id": 0, "odometer_km": 1}
+    )
+    
+    end_time = datetime.now(timezone.utc)
+    duration_s = max(0.0, (end_time - datetime.fromisoformat(trip['start_time'])).total_seconds())
+    accumulator = trip_stats.get(trip['vehicle_id'])
+    if accumulator is not None and accumulator.trip_id == trip_id:
+        summary = accumulator.summary()
+    else:
+        # Started before trip statistics were kept
+        distance_km = max(0.0, (vehicle or {}).get('odometer_km', 0) - trip.get('start_odometer_km', 0))
+        summary = {"distance_km": round(distance_km, 3)}
+    ended = await db.trips.find_one_and_update(
+        {"id": trip_id, "is_active": True},
         {"$set": {
             "is_active": False,
-            "end_time": datetime.now(timezone.utc).isoformat()
-        }}
+            "end_time": end_time.isoformat(),
+            "duration_s": round(duration_s, 1),
+            **summary
+        }},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
     )
+    if ended:
+        await bump_stats(active_trips=-1)
+        await record_trip_rollup(ended)
     
-    # Clear vehicle location
-    await db.vehicles.update_one(
-        {"id": trip['vehicle_id']},
-        {"$set": {"current_location": None}}
-    )
+    await sio.manager.run_everywhere('trip_ended', {"trip_id": trip_id, "vehicle_id": trip['vehicle_id']})
+    await publish_vehicle_gone(trip['vehicle_id'])
     
     return {"message": "Trip ended successfully"}
 
@@ -737,13 +1967,6 @@ async def accept_booking(booking_id: str, user: dict = Depends(get_current_user)
     if user['role'] != 'driver':
         raise HTTPException(status_code=403, detail="Only drivers can access this")
     
-    booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0})
-    if not booking:
-        raise HTTPException(status_code=404, detail="Booking not found")
-    
-    if booking['status'] != 'pending':
-        raise HTTPException(status_code=400, detail="Booking no longer available")
-    
     # Get driver's assigned ambulance
     vehicle = await db.vehicles.find_one({
         "assigned_to": user['id'],
@@ -752,37 +1975,49 @@ async def accept_booking(booking_id: str, user: dict = Depends(get_current_user)
     
     if not vehicle:
         raise HTTPException(status_code=400, detail="No ambulance assigned to you")
+    # While on offer only its driver may take it, until every ambulance has declined it once
+    offer = offer_for_booking(booking_id)
+    if offer is not None and offer['driver_id'] != user['id'] and not offer['open']:
+        raise HTTPException(status_code=403, detail="This booking is offered to another driver")
     
     # Generate OTP
     otp = generate_otp()
-    send_otp_mock(booking['phone'], otp)
     
-    # Calculate initial ETA if vehicle has location
-    eta = None
-    if vehicle.get('current_location') and booking.get('user_location'):
-        v_loc = vehicle['current_location']
-        u_loc = booking['user_location']
-        distance = calculate_distance(v_loc['lat'], v_loc['lng'], u_loc['lat'], u_loc['lng'])
-        eta = calculate_eta(distance, AMBULANCE_SPEED)
+    # Initial ETA from the ambulance's last fix, so the accepting update can store it too
+    eta_minutes = None
+    if vehicle.get('current_location'):
+        pending = dispatcher.bookings.get(booking_id)
+        if pending is not None:
+            u_loc = {"lat": pending.lat, "lng": pending.lng}
+        else:
+            # Dispatched by another worker
+            u_loc = (await db.bookings.find_one({"id": booking_id}, {"_id": 0, "user_location": 1}) or {}).get('user_location')
+        if u_loc:
+            v_loc = vehicle['current_location']
+            distance = calculate_distance(v_loc['lat'], v_loc['lng'], u_loc['lat'], u_loc['lng'])
+            eta = calculate_eta(distance, AMBULANCE_SPEED)
+            if eta:
+                eta_minutes = round(eta, 1)
     
-    await db.bookings.update_one(
-        {"id": booking_id},
-        {"$set": {
-            "status": "accepted",
-            "driver_id": user['id'],
-            "driver_name": user['name'],
-            "vehicle_id": vehicle['id'],
-            "vehicle_number": vehicle['vehicle_number'],
-            "otp": otp,
-            "eta_minutes": round(eta, 1) if eta else None
-        }}
-    )
+    # Claim the booking: only one concurrent accept can match status "pending"
+    booking = await transition_booking(booking_id, "accepted", fields={
+        "driver_id": user['id'],
+        "driver_name": user['name'],
+        "vehicle_id": vehicle['id'],
+        "vehicle_number": vehicle['vehicle_number'],
+        "otp": otp,
+        "eta_minutes": eta_minutes
+    })
+    await bump_stats(pending_bookings=-1)
+    await sio.manager.run_everywhere('booking_assigned', {"booking_id": booking_id, "vehicle_id": vehicle['id']})
+    send_otp_mock(booking['phone'], otp)
     
-    # Notify user via socket
-    updated_booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0})
-    await sio.emit('booking_accepted', updated_booking)
+    # Notify the student; the driver joins the booking room from now on
+    room = BOOKING_ROOM.format(booking_id)
+    await join_user_to_room(user['id'], room)
+    await emit('booking_accepted', booking, room=room)
     
-    return {"message": "Booking accepted", "otp": otp, "booking": updated_booking}
+    return {"message": "Booking accepted", "otp": otp, "booking": booking}
 
 @driver_router.post("/abort-booking/{booking_id}")
 async def abort_booking(booking_id: str, user: dict = Depends(get_current_user)):
@@ -790,34 +2025,53 @@ async def abort_booking(booking_id: str, user: dict = Depends(get_current_user))
     if user['role'] != 'driver':
         raise HTTPException(status_code=403, detail="Only drivers can access this")
     
-    await db.bookings.update_one(
-        {"id": booking_id, "driver_id": user['id']},
-        {"$set": {"status": "cancelled"}}
-    )
+    booking = await transition_booking(booking_id, "cancelled", conditions={"driver_id": user['id']})
+    await sio.manager.run_everywhere('booking_closed', {"booking_id": booking_id})
+    await sio.manager.run_everywhere('ambulance_changed', {"vehicle_id": booking['vehicle_id']})
     
-    await sio.emit('booking_cancelled', {"booking_id": booking_id})
+    room = BOOKING_ROOM.format(booking_id)
+    await emit('booking_cancelled', {"booking_id": booking_id}, room=room)
+    await sio.close_room(room)
     
     return {"message": "Booking cancelled"}
 
-@driver_router.post("/verify-otp")
-async def verify_booking_otp(data: OTPVerifyInput, user: dict = Depends(get_current_user)):
-    """Verify OTP to start ambulance ride"""
+@driver_router.get("/offer")
+async def get_dispatch_offer(user: dict = Depends(get_current_user)):
+    """Get the booking currently offered to this driver by the dispatcher"""
     if user['role'] != 'driver':
         raise HTTPException(status_code=403, detail="Only drivers can access this")
     
-    booking = await db.bookings.find_one({"id": data.booking_id}, {"_id": 0})
-    if not booking:
-        raise HTTPException(status_code=404, detail="Booking not found")
+    offer = offer_for_driver(user['id'])
+    if not offer:
+        return {"offer": None, "booking": None}
+    booking = await db.bookings.find_one({"id": offer['booking_id']}, {"_id": 0})
+    return {"offer": offer, "booking": booking}
+
+@driver_router.post("/decline-booking/{booking_id}")
+async def decline_booking(booking_id: str, user: dict = Depends(get_current_user)):
+    """Decline a dispatch offer so it cascades to the next ambulance"""
+    if user['role'] != 'driver':
+        raise HTTPException(status_code=403, detail="Only drivers can access this")
     
-    if booking['driver_id'] != user['id']:
-        raise HTTPException(status_code=403, detail="This booking is not assigned to you")
+    offer = offer_for_booking(booking_id)
+    if offer is None or offer['driver_id'] != user['id']:
+        raise HTTPException(status_code=400, detail="No pending offer for this booking")
+    await sio.manager.run_everywhere('offer_declined', {"booking_id": booking_id, "driver_id": user['id']})
+    metrics.DISPATCH_OFFERS.inc(("declined",))
     
-    if booking['otp'] != data.otp:
-        raise HTTPException(status_code=400, detail="Invalid OTP")
+    return {"message": "Offer declined"}
+
+@driver_router.post("/verify-otp")
+async def verify_booking_otp(data: OTPVerifyInput, user: dict = Depends(get_current_user)):
+    """Verify OTP to start ambulance ride"""
+    if user['role'] != 'driver':
+        raise HTTPException(status_code=403, detail="Only drivers can access this")
     
-    await db.bookings.update_one(
-        {"id": data.booking_id},
-        {"$set": {"status": "in_progress"}}
+    await transition_booking(
+        data.booking_id,
+        "in_progress",
+        conditions={"driver_id": user['id'], "otp": data.otp},
+        mismatch_detail="Invalid OTP"
     )
     
     return {"message": "OTP verified, ride started"}
@@ -828,12 +2082,12 @@ async def complete_booking(booking_id: str, user: dict = Depends(get_current_use
     if user['role'] != 'driver':
         raise HTTPException(status_code=403, detail="Only drivers can access this")
     
-    await db.bookings.update_one(
-        {"id": booking_id, "driver_id": user['id']},
-        {"$set": {"status": "completed"}}
-    )
+    booking = await transition_booking(booking_id, "completed", conditions={"driver_id": user['id']})
+    await sio.manager.run_everywhere('ambulance_changed', {"vehicle_id": booking['vehicle_id']})
     
-    await sio.emit('booking_completed', {"booking_id": booking_id})
+    room = BOOKING_ROOM.format(booking_id)
+    await emit('booking_completed', {"booking_id": booking_id}, room=room)
+    await sio.close_room(room)
     
     return {"message": "Booking completed"}
 
@@ -843,10 +2097,7 @@ async def get_my_trips(user: dict = Depends(get_current_user)):
     if user['role'] != 'driver':
         raise HTTPException(status_code=403, detail="Only drivers can access this")
     
-    trips = await db.trips.find(
-        {"driver_id": user['id']},
-        {"_id": 0}
-    ).sort("start_time", -1).to_list(100)
+    trips = await find_history("trips", {"driver_id": user['id']}, "start_time", 100)
     return {"trips": trips}
 
 @driver_router.get("/active-trip")
@@ -869,26 +2120,29 @@ async def get_admin_stats(user: dict = Depends(get_current_user)):
     if user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    total_students = await db.users.count_documents({"role": "student"})
-    total_drivers = await db.users.count_documents({"role": "driver"})
-    total_buses = await db.vehicles.count_documents({"vehicle_type": "bus"})
-    total_ambulances = await db.vehicles.count_documents({"vehicle_type": "ambulance"})
-    active_trips = await db.trips.count_documents({"is_active": True})
-    pending_bookings = await db.bookings.count_documents({"status": "pending"})
-    total_offences = await db.offences.count_documents({})
-    unpaid_offences = await db.offences.count_documents({"is_paid": False})
+    stats = await db.stats.find_one({"id": STATS_DOC_ID}, {"_id": 0})
+    if not stats:
+        stats = await reconcile_stats()
     
     return {
-        "total_students": total_students,
-        "total_drivers": total_drivers,
-        "total_buses": total_buses,
-        "total_ambulances": total_ambulances,
-        "active_trips": active_trips,
-        "pending_bookings": pending_bookings,
-        "total_offences": total_offences,
-        "unpaid_offences": unpaid_offences
+        "total_students": stats.get("total_students", 0),
+        "total_drivers": stats.get("total_drivers", 0),
+        "total_buses": stats.get("total_buses", 0),
+        "total_ambulances": stats.get("total_ambulances", 0),
+        "active_trips": stats.get("active_trips", 0),
+        "pending_bookings": stats.get("pending_bookings", 0),
+        "total_offences": stats.get("total_offences", 0),
+        "unpaid_offences": stats.get("unpaid_offences", 0)
     }
 
+@admin_router.post("/archive/run")
+async def run_archival(older_than_days: Optional[int] = Query(None, ge=0), user: dict = Depends(get_current_user)):
+    """Archive finished bookings, ended trips and paid offences now"""
+    if user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return {"archived": await archive_finished(older_than_days)}
+
 @admin_router.post("/vehicles", response_model=VehicleResponse)
 async def add_vehicle(vehicle_data: VehicleCreate, user: dict = Depends(get_current_user)):
     """Add a new vehicle"""
@@ -918,6 +2172,8 @@ async def add_vehicle(vehicle_data: VehicleCreate, user: dict = Depends(get_curr
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.vehicles.insert_one(vehicle)
+    if vehicle['vehicle_type'] in VEHICLE_COUNTERS:
+        await bump_stats(**{VEHICLE_COUNTERS[vehicle['vehicle_type']]: 1})
     
     return VehicleResponse(**vehicle)
 
@@ -949,9 +2205,12 @@ async def delete_vehicle(vehicle_id: str, user: dict = Depends(get_current_user)
     if user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    result = await db.vehicles.delete_one({"id": vehicle_id})
-    if result.deleted_count == 0:
+    vehicle = await db.vehicles.find_one_and_delete({"id": vehicle_id}, {"_id": 0, "vehicle_type": 1})
+    if not vehicle:
         raise HTTPException(status_code=404, detail="Vehicle not found")
+    if vehicle.get('vehicle_type') in VEHICLE_COUNTERS:
+        await bump_stats(**{VEHICLE_COUNTERS[vehicle['vehicle_type']]: -1})
+    await publish_vehicle_gone(vehicle_id)
     
     return {"message": "Vehicle deleted"}
 
@@ -984,6 +2243,7 @@ async def delete_student(student_id: str, user: dict = Depends(get_current_user)
     result = await db.users.delete_one({"id": student_id, "role": "student"})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Student not found")
+    await bump_stats(total_students=-1)
     
     return {"message": "Student deleted"}
 
@@ -1016,15 +2276,21 @@ async def delete_driver(driver_id: str, user: dict = Depends(get_current_user)):
     if user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    # First release any assigned vehicles
+    # First release any assigned vehicles; their ambulances stop receiving offers
+    ambulances = [vehicle['id'] async for vehicle in db.vehicles.find(
+        {"assigned_to": driver_id, "vehicle_type": "ambulance"}, {"_id": 0, "id": 1}
+    )]
     await db.vehicles.update_many(
         {"assigned_to": driver_id},
         {"$set": {"assigned_to": None, "assigned_driver_name": None}}
     )
+    for vehicle_id in ambulances:
+        await sio.manager.run_everywhere('ambulance_changed', {"vehicle_id": vehicle_id})
     
     result = await db.users.delete_one({"id": driver_id, "role": "driver"})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Driver not found")
+    await bump_stats(total_drivers=-1)
     
     return {"message": "Driver deleted"}
 
@@ -1051,7 +2317,7 @@ async def get_all_offences(
             {"vehicle_number": {"$regex": search, "$options": "i"}}
         ]
     
-    offences = await db.offences.find(query, {"_id": 0}).sort("timestamp", -1).to_list(1000)
+    offences = await find_history("offences", query, "timestamp", 1000)
     return {"offences": offences}
 
 @admin_router.delete("/offences/{offence_id}")
@@ -1060,9 +2326,12 @@ async def delete_offence(offence_id: str, user: dict = Depends(get_current_user)
     if user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    result = await db.offences.delete_one({"id": offence_id})
-    if result.deleted_count == 0:
+    offence = await db.offences.find_one_and_delete({"id": offence_id}, {"_id": 0, "is_paid": 1})
+    if not offence:
+        offence = await db.offences_archive.find_one_and_delete({"id": offence_id}, {"_id": 0, "is_paid": 1})
+    if not offence:
         raise HTTPException(status_code=404, detail="Offence not found")
+    await bump_stats(total_offences=-1, unpaid_offences=0 if offence.get('is_paid') else -1)
     
     return {"message": "Offence deleted"}
 
@@ -1072,12 +2341,16 @@ async def mark_offence_paid(offence_id: str, user: dict = Depends(get_current_us
     if user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin access required")
     
+    # Only the request that flips is_paid moves the counter; repeating it is a no-op
     result = await db.offences.update_one(
-        {"id": offence_id},
+        {"id": offence_id, "is_paid": False},
         {"$set": {"is_paid": True}}
     )
     if result.modified_count == 0:
-        raise HTTPException(status_code=404, detail="Offence not found")
+        if not await find_one_history("offences", {"id": offence_id}):
+            raise HTTPException(status_code=404, detail="Offence not found")
+        return {"message": "Offence already marked as paid"}
+    await bump_stats(unpaid_offences=-1)
     
     return {"message": "Offence marked as paid"}
 
@@ -1098,6 +2371,7 @@ async def add_rfid_device(device_data: RFIDDeviceCreate, user: dict = Depends(ge
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.rfid_devices.insert_one(device)
+    invalidate_rfid_registry()
     
     return RFIDDeviceResponse(**device)
 
@@ -1119,9 +2393,61 @@ async def delete_rfid_device(device_id: str, user: dict = Depends(get_current_us
     result = await db.rfid_devices.delete_one({"id": device_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Device not found")
+    invalidate_rfid_registry()
     
     return {"message": "Device deleted"}
 
+@admin_router.post("/rfid-sections", response_model=RFIDSectionResponse)
+async def add_rfid_section(section_data: RFIDSectionCreate, user: dict = Depends(get_current_user)):
+    """Set the distance between two RFID gates for section speed checks"""
+    if user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    if section_data.from_rfid == section_data.to_rfid:
+        raise HTTPException(status_code=400, detail="A section needs two different gates")
+    
+    gates = [section_data.from_rfid, section_data.to_rfid]
+    if await db.rfid_devices.count_documents({"rfid_id": {"$in": gates}}) < 2:
+        raise HTTPException(status_code=404, detail="RFID device not registered")
+    
+    section = {
+        "id": str(uuid.uuid4()),
+        "from_rfid": section_data.from_rfid,
+        "to_rfid": section_data.to_rfid,
+        "distance_m": section_data.distance_m,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    # Sections are undirected: replace any existing entry for the pair either way round
+    await db.rfid_sections.delete_many({"$or": [
+        {"from_rfid": gates[0], "to_rfid": gates[1]},
+        {"from_rfid": gates[1], "to_rfid": gates[0]}
+    ]})
+    await db.rfid_sections.insert_one(section)
+    invalidate_rfid_registry()
+    
+    return RFIDSectionResponse(**section)
+
+@admin_router.get("/rfid-sections")
+async def get_rfid_sections(user: dict = Depends(get_current_user)):
+    """Get the configured gate-to-gate distances"""
+    if user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    sections = await db.rfid_sections.find({}, {"_id": 0}).to_list(None)
+    return {"sections": sections}
+
+@admin_router.delete("/rfid-sections/{section_id}")
+async def delete_rfid_section(section_id: str, user: dict = Depends(get_current_user)):
+    """Delete a gate-to-gate distance"""
+    if user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    result = await db.rfid_sections.delete_one({"id": section_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Section not found")
+    invalidate_rfid_registry()
+    
+    return {"message": "Section deleted"}
+
 @admin_router.get("/trips")
 async def get_all_trips(
     is_active: Optional[bool] = None,
@@ -1138,7 +2464,7 @@ async def get_all_trips(
     if vehicle_type:
         query["vehicle_type"] = vehicle_type
     
-    trips = await db.trips.find(query, {"_id": 0}).sort("start_time", -1).to_list(1000)
+    trips = await find_history("trips", query, "start_time", 1000)
     return {"trips": trips}
 
 @admin_router.get("/bookings")
@@ -1154,31 +2480,391 @@ async def get_all_bookings(
     if status:
         query["status"] = status
     
-    bookings = await db.bookings.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    bookings = await find_history("bookings", query, "created_at", 1000)
     return {"bookings": bookings}
 
+# ============ ADMIN EXPORTS ============
+
+# Per-collection export layout: the field filtered by the date range, the
+# field matched by the `type` filter and the exported columns, in order.
+EXPORT_SPECS = {
+    "offences": {
+        "time_field": "timestamp",
+        "type_field": "offence_type",
+        "columns": [
+            "id", "offence_type", "driver_id", "driver_name", "student_id", "student_name",
+            "student_registration_id", "vehicle_id", "vehicle_number", "speed", "speed_limit",
+            "location", "rfid_number", "timestamp", "is_paid"
+        ]
+    },
+    "trips": {
+        "time_field": "start_time",
+        "type_field": "vehicle_type",
+        "columns": [
+            "id", "vehicle_id", "vehicle_number", "driver_id", "driver_name", "vehicle_type",
+            "start_time", "end_time", "is_active"
+        ]
+    },
+    "bookings": {
+        "time_field": "created_at",
+        "type_field": "status",
+        "columns": [
+            "id", "student_registration_id", "student_name", "phone", "place", "place_details",
+            "user_location", "status", "driver_id", "driver_name", "vehicle_id", "vehicle_number",
+            "eta_minutes", "created_at"
+        ]
+    }
+}
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+def parse_export_bound(value: Optional[str], name: str) -> Optional[str]:
+    """Normalise an ISO date/datetime query bound to the stored UTC isoformat"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name} date, expected ISO 8601")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).isoformat()
+
+def export_cell(value: Any) -> Any:
+    """Flatten nested values (locations) into JSON for a CSV cell"""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(',', ':'))
+    return value
+
+async def export_rows(cursor, columns: List[str], fmt: str):
+    """Stream cursor documents as CSV or NDJSON text chunks"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        writer.writerow(columns)
+        # Flush the header right away so the download starts immediately
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    
+    async for doc in cursor:
+        if fmt == "csv":
+            writer.writerow([export_cell(doc.get(column)) for column in columns])
+        else:
+            buffer.write(json.dumps({column: doc.get(column) for column in columns}))
+            buffer.write("\n")
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    
+    if buffer.tell():
+        yield buffer.getvalue()
+
+async def gzip_chunks(chunks):
+    """Gzip-compress a stream of text chunks on the fly"""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+@admin_router.get("/export/{collection}")
+async def export_collection(
+    collection: str,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    type: Optional[str] = None,
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    gzip: bool = False,
+    user: dict = Depends(get_current_user)
+):
+    """Stream offences, trips or bookings as CSV/NDJSON (start inclusive, end exclusive)"""
+    if user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    spec = EXPORT_SPECS.get(collection)
+    if not spec:
+        raise HTTPException(status_code=404, detail="Unknown export collection")
+    
+    query = {}
+    time_range = {}
+    start_bound = parse_export_bound(start, "start")
+    end_bound = parse_export_bound(end, "end")
+    if start_bound:
+        time_range["$gte"] = start_bound
+    if end_bound:
+        time_range["$lt"] = end_bound
+    if time_range:
+        query[spec['time_field']] = time_range
+    if type:
+        query[spec['type_field']] = type
+    
+    projection = {"_id": 0, **{column: 1 for column in spec['columns']}}
+    tiers = [collection]
+    if may_be_archived(collection, query):
+        tiers.append(archive_name(collection))
+    cursors = [
+        db[tier].find(query, projection).sort(spec['time_field'], 1).batch_size(EXPORT_BATCH_SIZE)
+        for tier in tiers
+    ]
+    
+    body = export_rows(merge_sorted(cursors, spec['time_field']), spec['columns'], format)
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"{collection}-{datetime.now(timezone.utc).strftime('%Y%m%d')}.{format}"
+    if gzip:
+        body = gzip_chunks(body)
+        media_type = "application/gzip"
+        filename += ".gz"
+    
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# ============ ADMIN ANALYTICS ============
+
+def rollup_query(period: str, bucket: Optional[str], dimension: str) -> Dict:
+    """Filter for one rollup bucket, defaulting to the current day/month"""
+    if bucket is None:
+        bucket = datetime.now(timezone.utc).date().isoformat()[:ROLLUP_PERIODS[period]]
+    elif not re.match(ROLLUP_BUCKET_PATTERNS[period], bucket):
+        raise HTTPException(status_code=400, detail=f"Invalid bucket for period '{period}'")
+    return {"period": period, "bucket": bucket, "dimension": dimension}
+
+@admin_router.get("/analytics/offences")
+async def get_offence_analytics(
+    period: str = Query("month", pattern="^(day|month)$"),
+    bucket: Optional[str] = None,
+    dimension: str = Query("driver", pattern="^(driver|vehicle|student)$"),
+    limit: int = Query(10, ge=1, le=100),
+    user: dict = Depends(get_current_user)
+):
+    """Top offenders for one day or month, with their highest recorded speed"""
+    if user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    query = rollup_query(period, bucket, dimension)
+    rows = await db.offence_rollups.find(query, {"_id": 0}).sort("count", -1).limit(limit).to_list(limit)
+    return {**query, "rows": rows}
+
+@admin_router.get("/analytics/trips")
+async def get_trip_analytics(
+    period: str = Query("day", pattern="^(day|month)$"),
+    bucket: Optional[str] = None,
+    dimension: str = Query("vehicle", pattern="^(driver|vehicle)$"),
+    limit: int = Query(50, ge=1, le=500),
+    user: dict = Depends(get_current_user)
+):
+    """Trip count, hours and distance per vehicle or driver for one day or month"""
+    if user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    query = rollup_query(period, bucket, dimension)
+    rows = await db.trip_rollups.find(query, {"_id": 0}).sort("duration_s", -1).limit(limit).to_list(limit)
+    for row in rows:
+        row['trip_hours'] = round(row.get('duration_s', 0) / 3600, 2)
+        row['distance_km'] = round(row.get('distance_km', 0), 3)
+    return {**query, "rows": rows}
+
+@admin_router.post("/analytics/rebuild")
+async def rebuild_analytics(user: dict = Depends(get_current_user)):
+    """Recompute the analytics rollups from the raw offences and trips"""
+    if user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return {"rebuilt": await rebuild_rollups()}
+
+# ============ ADMIN SOCKET CLIENTS ============
+
+@admin_router.get("/socket-clients")
+async def get_socket_clients(limit: int = Query(50, ge=1, le=1000), user: dict = Depends(get_current_user)):
+    """Slowest Socket.IO clients on this worker: outbox depth, lag and dropped frames"""
+    if user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    clients = sorted(sio.manager.client_stats(), key=lambda client: client['lag_s'], reverse=True)
+    return {
+        "clients": clients[:limit],
+        "tracked": len(clients),
+        "pending_frames": sum(client['depth'] for client in clients),
+        "queue_depth": sio.manager.queue_depth,
+        "slow_client_seconds": sio.manager.slow_client_s
+    }
+
+# ============ ADMIN PROFILER ============
+
+@admin_router.post("/profiler/start")
+async def start_profiler(data: ProfilerStartInput, user: dict = Depends(get_current_user)):
+    """Attach the sampling profiler to a time window or a share of one route's requests"""
+    if user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    try:
+        profiler.start(
+            mode=data.mode,
+            duration_s=data.duration_s,
+            route=data.route,
+            percent=data.percent if data.mode == "route" else 100,
+            interval_s=data.interval_ms / 1000
+        )
+    except (RuntimeError, ValueError) as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    
+    return profiler.status()
+
+@admin_router.post("/profiler/stop")
+async def stop_profiler(user: dict = Depends(get_current_user)):
+    """Stop sampling early"""
+    if user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    profiler.stop()
+    return profiler.status()
+
+@admin_router.get("/profiler/status")
+async def get_profiler_status(user: dict = Depends(get_current_user)):
+    """Get the current profiling session state"""
+    if user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return profiler.status()
+
+@admin_router.get("/profiler/profile")
+async def get_profile(user: dict = Depends(get_current_user)):
+    """Get collected samples as flamegraph-compatible collapsed stacks"""
+    if user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return PlainTextResponse(profiler.collapsed())
+
+@admin_router.get("/profiler/blocking")
+async def get_blocking_calls(user: dict = Depends(get_current_user)):
+    """Get event-loop stalls over the threshold with the stack that caused them"""
+    if user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return watchdog.report()
+
 # ============ GPS & RFID RECEIVER ROUTES ============
 
-@api_router.post("/gps/receive")
-async def receive_gps_data(gps_data: GPSDataInput):
-    """Receive GPS data from vehicle tracking device (Mock endpoint)"""
+report_policy = ReportPolicy()
+# Where users recently asked for a bus's ETA; every worker hears of every lookup
+eta_watchers = EtaWatchers()
+
+async def eta_watched(data: Dict):
+    eta_watchers.note(data['vehicle_id'], data['lat'], data['lng'], data['at'])
+
+sio.manager.add_handler('eta_watched', eta_watched)
+
+def next_report_interval(vehicle: Dict, gps_data: GPSDataInput, booking_km: Optional[float] = None,
+                         on_booking: bool = False) -> int:
+    """Seconds the tracker should wait before its next fix"""
+    waiting_km = eta_watchers.nearest_km(vehicle['id'], gps_data.latitude, gps_data.longitude, time.time())
+    if booking_km is not None:
+        waiting_km = booking_km if waiting_km is None else min(waiting_km, booking_km)
+    return report_policy.interval(
+        gps_data.speed,
+        on_trip=vehicle['id'] in trip_stats,
+        on_booking=on_booking or booking_km is not None,
+        waiting_km=waiting_km,
+        load=metrics.gps_fix_meter.rate() / GPS_INGEST_TARGET_PER_SECOND
+    )
+
+def gps_ack(vehicle: Dict, gps_data: GPSDataInput, status: str, message: str,
+            booking_km: Optional[float] = None, on_booking: bool = False) -> Dict:
+    """What happened to a tracker's fix and when it should send the next one"""
+    return {
+        "message": message,
+        "vehicle_id": vehicle['id'],
+        "status": status,
+        "next_report_interval_s": next_report_interval(vehicle, gps_data, booking_km, on_booking)
+    }
+
+def fix_order(fix: Dict, last: Optional[Dict]) -> int:
+    """1 if `fix` is newer than the vehicle's last live fix, 0 for the same fix again, -1 if older"""
+    if not last:
+        return 1
+    ours, theirs = (fix['ts'], fix['seq']), (last['ts'], last['seq'])
+    return (ours > theirs) - (ours < theirs)
+
+def live_fix_filter(vehicle_id: str, fix: Dict) -> Dict:
+    """Matches the vehicle only while its live fix is older than `fix`, so concurrent fixes can't regress it"""
+    return {"id": vehicle_id, "$or": [
+        {"last_fix": {"$exists": False}},
+        {"last_fix.ts": {"$lt": fix['ts']}},
+        {"last_fix.ts": fix['ts'], "last_fix.seq": {"$lt": fix['seq']}}
+    ]}
+
+async def record_late_fix(vehicle: Dict, location: Dict, fix: Dict) -> bool:
+    """Keep a fix that arrived after a newer one in gps_history; False if it was already there"""
+    fix_key = f"{vehicle['id']}:{fix['ts']}:{fix['seq']}"
+    try:
+        result = await db.gps_history.update_one({"fix_key": fix_key}, {"$setOnInsert": {
+            "fix_key": fix_key,
+            "vehicle_id": vehicle['id'],
+            "imei": vehicle['gps_imei'],
+            "fixed_at": datetime.fromtimestamp(fix['ts'], timezone.utc).isoformat(),
+            "sequence": fix['seq'] if fix['seq'] >= 0 else None,
+            "location": location,
+            "received_at": datetime.now(timezone.utc).isoformat()
+        }}, upsert=True)
+    except DuplicateKeyError:
+        return False  # a retransmission racing its twin
+    return result.upserted_id is not None
+
+async def ingest_gps_fix(gps_data: GPSDataInput) -> Dict:
+    """Store, check and broadcast one fix; runs in the web process or the IMEI's ingest worker"""
     # Find vehicle by IMEI
     vehicle = await db.vehicles.find_one({"gps_imei": gps_data.imei}, {"_id": 0})
     if not vehicle:
         raise HTTPException(status_code=404, detail="Vehicle not found for this IMEI")
     
     # Update vehicle location
+    now = datetime.now(timezone.utc)
     location = {
         "lat": gps_data.latitude,
         "lng": gps_data.longitude,
         "speed": gps_data.speed,
-        "timestamp": gps_data.timestamp or datetime.now(timezone.utc).isoformat()
+        "timestamp": gps_data.timestamp or now.isoformat()
     }
     
-    await db.vehicles.update_one(
-        {"id": vehicle['id']},
-        {"$set": {"current_location": location}}
-    )
+    # Trackers retransmit after dropouts: the same fix again is dropped, an older one only goes to history
+    fix = {"ts": device_time(gps_data.timestamp, now).timestamp(),
+           "seq": gps_data.sequence if gps_data.sequence is not None else -1}
+    order = fix_order(fix, vehicle.get('last_fix'))
+    if order == 0:
+        metrics.GPS_FIX_OUTCOMES.inc(("duplicate",))
+        return gps_ack(vehicle, gps_data, "duplicate", "Duplicate fix ignored")
+    
+    # Odometer advances by the segment since the previous fix; trips diff it for distance
+    previous = vehicle.get('current_location')
+    segment_km = 0
+    if previous and previous.get('lat') is not None:
+        segment_km = calculate_distance(previous['lat'], previous['lng'], gps_data.latitude, gps_data.longitude)
+    
+    updated = order > 0 and (await db.vehicles.update_one(
+        live_fix_filter(vehicle['id'], fix),
+        {
+            "$set": {
+                "current_location": location,
+                "current_point": geo_point(gps_data.latitude, gps_data.longitude),
+                "tracker_status": LIVE,
+                "last_fix": fix
+            },
+            "$inc": {"odometer_km": segment_km}
+        }
+    )).matched_count
+    if not updated:
+        if not await record_late_fix(vehicle, location, fix):
+            metrics.GPS_FIX_OUTCOMES.inc(("duplicate",))
+            return gps_ack(vehicle, gps_data, "duplicate", "Duplicate fix ignored")
+        metrics.GPS_FIX_OUTCOMES.inc(("late",))
+        return gps_ack(vehicle, gps_data, "late", "Late fix recorded in history")
+    metrics.GPS_FIX_OUTCOMES.inc(("live",))
     
     # Check for overspeeding (only for buses)
     if vehicle['vehicle_type'] == 'bus' and gps_data.speed > CAMPUS_SPEED_LIMIT:
@@ -1200,26 +2886,28 @@ async def receive_gps_data(gps_data: GPSDataInput):
                 "is_paid": False
             }
             await db.offences.insert_one(offence)
+            await bump_stats(total_offences=1, unpaid_offences=1)
+            await record_offence_rollups([offence])
             logging.warning(f"Overspeeding detected: {vehicle['vehicle_number']} at {gps_data.speed} km/h")
     
     # Broadcast location update via socket
-    await sio.emit('vehicle_location', {
-        "vehicle_id": vehicle['id'],
-        "vehicle_number": vehicle['vehicle_number'],
-        "vehicle_type": vehicle['vehicle_type'],
-        "location": location
-    })
+    await publish_vehicle_location(vehicle_update(vehicle, location))
     
     # Update ETA for active bookings if ambulance
+    booking_km = None
+    active_booking = None
     if vehicle['vehicle_type'] == 'ambulance':
         active_booking = await db.bookings.find_one({
             "vehicle_id": vehicle['id'],
             "status": {"$in": ["accepted", "in_progress"]}
         }, {"_id": 0})
+        # Idle ones moved in the dispatch index with the fix above; the web process adds any it doesn't know
+        if not active_booking and vehicle.get('assigned_to'):
+            await sio.manager.run_everywhere('ambulance_idle', {"vehicle_id": vehicle['id']})
         
         if active_booking and active_booking.get('user_location'):
             u_loc = active_booking['user_location']
-            distance = calculate_distance(location['lat'], location['lng'], u_loc['lat'], u_loc['lng'])
+            distance = booking_km = calculate_distance(location['lat'], location['lng'], u_loc['lat'], u_loc['lng'])
             eta = calculate_eta(distance, AMBULANCE_SPEED)
             
             await db.bookings.update_one(
@@ -1227,71 +2915,119 @@ async def receive_gps_data(gps_data: GPSDataInput):
                 {"$set": {"eta_minutes": round(eta, 1)}}
             )
             
-            await sio.emit('eta_update', {
+            await emit('eta_update', {
                 "booking_id": active_booking['id'],
                 "eta_minutes": round(eta, 1),
                 "vehicle_location": location
-            })
+            }, room=BOOKING_ROOM.format(active_booking['id']))
     
-    return {"message": "GPS data received", "vehicle_id": vehicle['id']}
+    return gps_ack(vehicle, gps_data, "live", "GPS data received", booking_km, active_booking is not None)
+
+# Worker processes handling GPS fixes by IMEI, when GPS_INGEST_WORKERS is set. The worker owning a
+# vehicle does the lookup, ordering and writes for its fixes; the fleet state, trip statistics and
+# heartbeats those fixes feed are still applied by every process through run_everywhere, since each
+# web worker serves sockets and trips from its own copy
+ingest_pool: Optional[IngestPool] = None
+
+async def handle_gps_payload(payload: Dict) -> tuple:
+    """(status code, body) for a fix handed to this ingest worker"""
+    metrics.record_gps_fix()
+    try:
+        return 200, await ingest_gps_fix(GPSDataInput(**payload))
+    except HTTPException as exc:
+        return exc.status_code, exc.detail
+
+async def gps_shard_handler():
+    """Set up an ingest worker process (its own storage and broker connections) and return its fix handler"""
+    sio.manager_initialized = True
+    sio.manager.initialize()
+    await load_trip_stats()
+    spawn(trip_stats_loop())
+    return handle_gps_payload
+
+@api_router.post("/gps/receive")
+async def receive_gps_data(gps_data: GPSDataInput):
+    """Receive GPS data from vehicle tracking device (Mock endpoint)"""
+    metrics.record_gps_fix()
+    if ingest_pool is None:
+        return await ingest_gps_fix(gps_data)
+    try:
+        status_code, body = await ingest_pool.submit(gps_data.imei, gps_data.model_dump())
+    except IngestWorkerError:
+        # The vehicle's worker died (a new one is on its way); trackers resend unacknowledged fixes
+        logging.exception("GPS ingest worker failed")
+        raise HTTPException(status_code=503, detail="GPS ingest temporarily unavailable")
+    if status_code != 200:
+        raise HTTPException(status_code=status_code, detail=body)
+    return body
 
 @api_router.post("/rfid/scan")
 async def receive_rfid_scan(scan_data: RFIDScanInput):
     """Receive RFID scan data from campus scanners"""
-    # Verify RFID device exists
-    device = await db.rfid_devices.find_one({"rfid_id": scan_data.rfid_device_id}, {"_id": 0})
-    if not device:
+    result, = await ingest_rfid_scans([scan_data])
+    if result['status'] == "unknown_device":
         raise HTTPException(status_code=404, detail="RFID device not registered")
-    
-    # Check for speed violation
-    if scan_data.speed > CAMPUS_SPEED_LIMIT:
-        # Get student info
-        student = await db.users.find_one(
-            {"registration_id": scan_data.student_registration_id},
-            {"_id": 0}
-        )
-        
-        offence = {
-            "id": str(uuid.uuid4()),
-            "offence_type": "student_speed",
-            "student_id": student['id'] if student else None,
-            "student_name": scan_data.student_name,
-            "student_registration_id": scan_data.student_registration_id,
-            "phone": scan_data.phone,
-            "speed": scan_data.speed,
-            "speed_limit": CAMPUS_SPEED_LIMIT,
-            "rfid_number": scan_data.rfid_device_id,
-            "location": {"name": device['location_name']},
-            "timestamp": scan_data.timestamp or datetime.now(timezone.utc).isoformat(),
-            "is_paid": False
-        }
-        await db.offences.insert_one(offence)
-        logging.warning(f"Student speed violation: {scan_data.student_name} at {scan_data.speed} km/h")
-        
-        return {"message": "Speed violation recorded", "offence_id": offence['id']}
+    if result['status'] == "violation":
+        return {"message": "Speed violation recorded", "offence_id": result['offence_id']}
     
     return {"message": "Scan recorded, no violation"}
 
-# ============ INCLUDE ROUTERS ============
+@api_router.post("/rfid/scan-batch")
+async def receive_rfid_scan_batch(batch: RFIDScanBatchInput):
+    """Receive a burst of RFID scans from a gate scanner in one request"""
+    results = await ingest_rfid_scans(batch.scans)
+    return {
+        "received": len(results),
+        "violations": sum(1 for result in results if result['status'] == "violation"),
+        "unknown_devices": sum(1 for result in results if result['status'] == "unknown_device"),
+        "results": results
+    }
+
+# ============ APP FACTORY ============
 
 api_router.include_router(auth_router)
 api_router.include_router(public_router)
 api_router.include_router(driver_router)
 api_router.include_router(admin_router)
-app.include_router(api_router)
+
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+def create_app(storage: Optional[Storage] = None) -> FastAPI:
+    """Build the FastAPI app bound to `storage` (defaults to STORAGE_BACKEND)
+
+    The storage handle is process-wide: the latest call rebinds `db` for all
+    routes, so build one app per process (tests may rebuild between cases).
+    """
+    global db
+    db = storage if storage is not None else storage_from_env()
+    
+    application = FastAPI(lifespan=lifespan)
+    application.include_router(api_router)
+    application.add_api_route("/metrics", get_metrics, methods=["GET"], include_in_schema=False)
+    
+    # Route-mode profiling enrolment
+    application.add_middleware(ProfilerMiddleware, profiler=profiler)
+    
+    # Request metrics per route (CORS preflights are answered before reaching it)
+    application.add_middleware(metrics.MetricsMiddleware)
+    
+    # CORS
+    application.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    return application
+
+app = create_app()
 
 # Mount Socket.IO
 socket_app = socketio.ASGIApp(sio, app)
 
-# CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
 # Logging
 logging.basicConfig(
     level=logging.INFO,
@@ -1302,21 +3038,75 @@ logger = logging.getLogger(__name__)
 # ============ SOCKET.IO EVENTS ============
 
 @sio.event
-async def connect(sid, environ):
-    logger.info(f"Client connected: {sid}")
+async def connect(sid, environ, auth=None):
+    """Authenticate the socket and join the user's private and booking rooms
+
+    The JWT comes from the Socket.IO auth payload (`{"token": ...}`) or a
+    `token` query parameter. Anonymous sockets are allowed for public vehicle
+    tracking but never join private rooms.
+
+    Every socket starts in the fleet room with a `fleet_snapshot`, or with
+    just the `fleet_deltas` it missed when the auth payload carries the
+    `fleet_epoch` and `fleet_version` it last applied.
+    """
+    token = auth.get('token') if isinstance(auth, dict) else None
+    if not token:
+        token = parse_qs(environ.get('QUERY_STRING', '')).get('token', [None])[0]
+    user = None
+    if token:
+        try:
+            payload = decode_token(token)
+        except HTTPException:
+            raise socketio.exceptions.ConnectionRefusedError("Invalid token")
+        user = await db.users.find_one({"id": payload['user_id']}, {"_id": 0, "id": 1, "role": 1})
+        if not user:
+            raise socketio.exceptions.ConnectionRefusedError("User not found")
+    
+    metrics.SOCKET_CLIENTS.inc()
+    await sio.enter_room(sid, FLEET_ROOM)
+    if user:
+        await sio.enter_room(sid, USER_ROOM.format(user['id']))
+        if user['role'] == 'driver':
+            await sio.enter_room(sid, DRIVERS_ROOM)
+        # Rejoin bookings still in flight after a reconnect
+        async for booking in db.bookings.find({
+            "status": {"$in": ["pending", "accepted", "in_progress"]},
+            "$or": [{"user_id": user['id']}, {"driver_id": user['id']}]
+        }, {"_id": 0, "id": 1}):
+            await sio.enter_room(sid, BOOKING_ROOM.format(booking['id']))
+    if isinstance(auth, dict):
+        await send_fleet_state(sid, auth.get('fleet_epoch'), auth.get('fleet_version'))
+    else:
+        await send_fleet_state(sid)
+    logger.info(f"Client connected: {sid} ({user['id'] if user else 'anonymous'})")
 
 @sio.event
 async def disconnect(sid):
+    metrics.SOCKET_CLIENTS.dec()
+    viewports.unsubscribe(sid)
     logger.info(f"Client disconnected: {sid}")
 
 @sio.event
 async def join_room(sid, data):
     """Join a specific room for targeted updates"""
     room = data.get('room')
+    if room == FLEET_ROOM:
+        await join_fleet(sid, data)
+        return
+    if isinstance(room, str) and room.startswith(PRIVATE_ROOM_PREFIXES):
+        logger.warning(f"Client {sid} tried to join private room {room}")
+        return
     if room:
         await sio.enter_room(sid, room)
         logger.info(f"Client {sid} joined room {room}")
 
+async def join_fleet(sid: str, data: Any):
+    """Follow every vehicle again, resuming from the client's `epoch` and `version` if it sent them"""
+    data = data if isinstance(data, dict) else {}
+    viewports.unsubscribe(sid)
+    await sio.enter_room(sid, FLEET_ROOM)
+    await send_fleet_state(sid, data.get('epoch'), data.get('version'))
+
 @sio.event
 async def leave_room(sid, data):
     """Leave a room"""
@@ -1324,3 +3114,24 @@ async def leave_room(sid, data):
     if room:
         await sio.leave_room(sid, room)
         logger.info(f"Client {sid} left room {room}")
+
+@sio.event
+async def subscribe_viewport(sid, data):
+    """Only get vehicles inside a map bounding box ({south, west, north, east}); moving the map resubscribes
+
+    The socket gets a `viewport_snapshot` of the vehicles inside the box, then
+    `vehicle_enter`, `vehicle_location` and `vehicle_leave` as they move.
+    """
+    bounds = parse_viewport(data)
+    if bounds is None:
+        logger.warning(f"Client {sid} sent an invalid viewport: {data!r}")
+        return
+    vehicles = viewports.subscribe(sid, *bounds)
+    await sio.leave_room(sid, FLEET_ROOM)
+    await emit('viewport_snapshot', {"vehicles": vehicles}, to=sid, ignore_queue=True)
+
+@sio.event
+async def unsubscribe_viewport(sid, data=None):
+    """Go back to receiving every vehicle's positions"""
+    if sid in viewports:
+        await join_fleet(sid, data)
@@ -0,0 +1,424 @@
+"""Socket.IO client managers for running the backend on several workers.
+
+``AsyncServer`` keeps rooms and sessions in process memory, so an emit only
+reaches clients connected to the worker that made it. The pub/sub managers
+here forward every emit, room change and disconnect to the other workers
+through a broker:
+
+- ``BatchedRedisManager``: Redis or any Redis-protocol server (Valkey,
+  KeyDB, ...), via python-socketio's ``AsyncRedisManager``
+- ``MongoPubSubManager``: a capped collection tailed by every worker
+- ``MemoryPubSubManager``: an in-process ``MemoryBroker`` shared by several
+  servers in one process, for tests and benchmarks
+
+Local clients are always served directly; messages for other workers are
+coalesced for ``batch_window_s`` (or until ``batch_max`` are pending) and
+published as one broker message, so a burst of GPS fixes costs one publish
+per window instead of one per fix. ``LocalManager`` is the single-worker
+default and exposes the same extra API, including ``run_everywhere`` for
+work that depends on per-worker client state (e.g. map viewports) and so
+has to happen on every worker rather than as an emit.
+
+Every manager delivers to its own clients through ``QueuedManager``'s
+bounded per-client outboxes, so clients on weak connections get the newest
+vehicle positions instead of a growing backlog of stale ones.
+"""
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import socketio
+from engineio import packet as eio_packet
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+from socketio import packet
+from socketio.async_manager import AsyncManager
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+import metrics
+
+# Events whose pending frames a newer one replaces, by the payload field that identifies them
+COALESCE_KEYS = {"vehicle_location": "vehicle_id", "eta_update": "booking_id"}
+
+
+class Outbox:
+    """One client's pending frames: coalescing key or sequence number -> [packets, enqueued_at]"""
+    __slots__ = ("sid", "namespace", "entries", "task", "delivered", "dropped", "lag")
+
+    def __init__(self, sid: str, namespace: str):
+        self.sid = sid
+        self.namespace = namespace
+        self.entries: OrderedDict = OrderedDict()
+        self.task: Optional[asyncio.Task] = None
+        self.delivered = 0
+        self.dropped = 0
+        self.lag = 0.0
+
+
+class QueuedManager(AsyncManager):
+    """Per-client outbound queues with latest-wins coalescing
+
+    Each client gets frames from its own outbox through one writer task,
+    which hands engine.io a frame only once the previous one has been taken
+    by the transport, so a slow client's backlog waits here rather than in
+    engine.io's unbounded queue. Events listed in ``coalesce_keys`` replace
+    a pending frame with the same key (e.g. the same vehicle), and
+    the oldest of them is dropped once ``queue_depth`` frames are pending;
+    all other events are never dropped. A client whose transport takes
+    nothing for ``slow_client_s``, or whose undroppable backlog passes
+    ``max_backlog``, is disconnected.
+    """
+
+    def __init__(self, queue_depth: int = 64, slow_client_s: float = 30.0, max_backlog: int = 1024,
+                 coalesce_keys: Optional[Dict[str, str]] = None):
+        super().__init__()
+        self.queue_depth = queue_depth
+        self.slow_client_s = slow_client_s
+        self.max_backlog = max_backlog
+        self.coalesce_keys = dict(COALESCE_KEYS if coalesce_keys is None else coalesce_keys)
+        self.outboxes: Dict[str, Outbox] = {}
+        self._sequence = itertools.count()
+        self._disconnects = set()
+        self.handlers: Dict[str, Callable[[Dict], Awaitable]] = {}
+
+    async def emit(self, event, data, namespace, room=None, skip_sid=None, callback=None, to=None, **kwargs):
+        room = to or room
+        if callback is not None:
+            return await super().emit(event, data, namespace, room=room, skip_sid=skip_sid, callback=callback)
+        if namespace not in self.rooms:
+            return
+        field = self.coalesce_keys.get(event)
+        key = (event, data.get(field)) if field and isinstance(data, dict) and data.get(field) is not None else None
+        if isinstance(data, tuple):
+            data = list(data)
+        elif data is not None:
+            data = [data]
+        else:
+            data = []
+        # Encoded once and shared by every recipient, as AsyncManager.emit does
+        encoded = self.server.packet_class(packet.EVENT, namespace=namespace, data=[event] + data).encode()
+        if not isinstance(encoded, list):
+            encoded = [encoded]
+        packets = [eio_packet.Packet(eio_packet.MESSAGE, p) for p in encoded]
+        skip = skip_sid if isinstance(skip_sid, list) else [skip_sid]
+        for sid, eio_sid in self.get_participants(namespace, room):
+            if sid not in skip:
+                self._enqueue(sid, eio_sid, namespace, key, packets)
+
+    def _enqueue(self, sid: str, eio_sid: str, namespace: str, key, packets: List):
+        outbox = self.outboxes.get(eio_sid)
+        if outbox is None:
+            outbox = self.outboxes[eio_sid] = Outbox(sid, namespace)
+        entries = outbox.entries
+        if key is not None and key in entries:
+            # Goes to the back of the line, keeping its age, so a client gets
+            # frames in the order they were emitted (fleet deltas in version order)
+            entries[key][0] = packets
+            entries.move_to_end(key)
+            outbox.dropped += 1
+            metrics.SOCKET_FRAMES_DROPPED.inc(("coalesced",))
+        else:
+            if key is None:
+                key = next(self._sequence)
+            elif len(entries) >= self.queue_depth:
+                oldest = next((pending for pending in entries if isinstance(pending, tuple)), None)
+                if oldest is not None:
+                    del entries[oldest]
+                    outbox.dropped += 1
+                    metrics.SOCKET_FRAMES_DROPPED.inc(("overflow",))
+            entries[key] = [packets, time.monotonic()]
+            if len(entries) > self.max_backlog:
+                self._disconnect_slow(eio_sid, outbox, "backlog")
+                return
+        if outbox.task is None:
+            outbox.task = asyncio.ensure_future(self._drain(eio_sid, outbox))
+
+    async def _drain(self, eio_sid: str, outbox: Outbox):
+        entries = outbox.entries
+        try:
+            while entries:
+                _, (packets, enqueued_at) = entries.popitem(last=False)
+                for eio_pkt in packets:
+                    await self.server._send_eio_packet(eio_sid, eio_pkt)
+                socket = self.server.eio.sockets.get(eio_sid)
+                if socket is not None:
+                    await asyncio.wait_for(socket.queue.join(), self.slow_client_s)
+                outbox.lag = time.monotonic() - enqueued_at
+                outbox.delivered += 1
+                metrics.SOCKET_CLIENT_LAG.observe(outbox.lag)
+        except asyncio.TimeoutError:
+            self._disconnect_slow(eio_sid, outbox, "stalled")
+        finally:
+            outbox.task = None
+
+    def _disconnect_slow(self, eio_sid: str, outbox: Outbox, reason: str):
+        if self.outboxes.pop(eio_sid, None) is None:
+            return
+        outbox.entries.clear()
+        metrics.SOCKET_SLOW_DISCONNECTS.inc((reason,))
+        logging.warning(f"Disconnecting slow Socket.IO client {outbox.sid} ({reason})")
+        task = asyncio.ensure_future(self.server.disconnect(outbox.sid, namespace=outbox.namespace, ignore_queue=True))
+        self._disconnects.add(task)
+        task.add_done_callback(self._disconnects.discard)
+
+    async def disconnect(self, sid, namespace, **kwargs):
+        eio_sid = self.eio_sid_from_sid(sid, namespace)
+        outbox = self.outboxes.pop(eio_sid, None) if eio_sid else None
+        if outbox is not None and outbox.task is not None and outbox.task is not asyncio.current_task():
+            outbox.task.cancel()
+        return await super().disconnect(sid, namespace, **kwargs)
+
+    def client_stats(self) -> List[Dict]:
+        """Per-client queue depth, lag (age of the oldest pending frame, else the last one's) and counts"""
+        now = time.monotonic()
+        stats = []
+        for outbox in self.outboxes.values():
+            oldest = next(iter(outbox.entries.values()), None)
+            stats.append({
+                "sid": outbox.sid,
+                "depth": len(outbox.entries),
+                "lag_s": round(now - oldest[1] if oldest else outbox.lag, 4),
+                "delivered": outbox.delivered,
+                "dropped": outbox.dropped
+            })
+        return stats
+
+    def pending_frames(self) -> int:
+        return sum(len(outbox.entries) for outbox in self.outboxes.values())
+
+    async def enter_room_members(self, namespace: str, source_room: str, room: str):
+        """Add every client of `source_room` to `room`"""
+        for sid, eio_sid in list(self.get_participants(namespace, source_room)):
+            await AsyncManager.enter_room(self, sid, namespace, room, eio_sid=eio_sid)
+
+    def add_handler(self, name: str, handler: Callable[[Dict], Awaitable]):
+        """Register a coroutine that `run_everywhere(name, data)` runs on every worker"""
+        self.handlers[name] = handler
+
+    async def run_everywhere(self, name: str, data: Dict):
+        """Run the `name` handler with `data` here and on every other worker"""
+        await self.handlers[name](data)
+
+    async def close(self):
+        for outbox in self.outboxes.values():
+            if outbox.task is not None:
+                outbox.task.cancel()
+        self.outboxes.clear()
+
+
+class LocalManager(QueuedManager):
+    """Rooms and sessions in this process only (single worker)"""
+
+
+class BatchedPublishMixin:
+    """Coalesces cross-worker messages into one broker publish per window
+
+    Mixed in ahead of an ``AsyncPubSubManager`` subclass, whose ``_publish``
+    and ``_listen`` then carry {"method": "batch", "messages": [...]}.
+    """
+
+    def _init_batching(self, batch_window_s: float, batch_max: int):
+        self.batch_window_s = batch_window_s
+        self.batch_max = batch_max
+        self._pending: List[Dict] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._publish_lock = asyncio.Lock()
+        self.published_batches = 0
+        self.published_messages = 0
+
+    async def _publish(self, data):
+        self._pending.append(data)
+        if self.batch_window_s <= 0 or len(self._pending) >= self.batch_max:
+            await self._flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.batch_window_s)
+        self._flush_task = None
+        await self._flush()
+
+    async def _flush(self):
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        # Flushes take the lock in the order they drained the buffer, so batches stay ordered
+        async with self._publish_lock:
+            await super()._publish({"method": "batch", "messages": batch, "host_id": self.host_id})
+        self.published_batches += 1
+        self.published_messages += len(batch)
+
+    async def _listen(self):
+        async for message in super()._listen():
+            data = message
+            if not isinstance(data, dict):
+                try:
+                    data = self.json.loads(message)
+                except ValueError:
+                    continue
+            if data.get('method') != 'batch':
+                yield data
+                continue
+            if data.get('host_id') == self.host_id:
+                continue
+            for item in data['messages']:
+                if item.get('method') == 'enter_room_members':
+                    await QueuedManager.enter_room_members(self, item['namespace'], item['source_room'], item['room'])
+                elif item.get('method') == 'run':
+                    # A failing handler must not end this generator, which would stop the listener
+                    try:
+                        await QueuedManager.run_everywhere(self, item['name'], item['data'])
+                    except Exception:
+                        logging.exception(f"Handler {item['name']!r} failed for a message from another worker")
+                else:
+                    yield item
+
+    async def enter_room_members(self, namespace: str, source_room: str, room: str):
+        await super().enter_room_members(namespace, source_room, room)
+        await self._publish({"method": "enter_room_members", "namespace": namespace,
+                             "source_room": source_room, "room": room, "host_id": self.host_id})
+
+    async def run_everywhere(self, name: str, data: Dict):
+        await super().run_everywhere(name, data)
+        await self._publish({"method": "run", "name": name, "data": data, "host_id": self.host_id})
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self._flush()
+        thread = getattr(self, 'thread', None)
+        if thread is not None:
+            thread.cancel()
+        await super().close()
+
+
+class BatchedRedisManager(BatchedPublishMixin, socketio.AsyncRedisManager, QueuedManager):
+    """Fan-out through Redis pub/sub (redis://, rediss://, valkey://, ...)"""
+    name = 'batchedredis'
+
+    def __init__(self, url: str, channel: str = 'socketio', batch_window_s: float = 0.002,
+                 batch_max: int = 256, **kwargs):
+        super().__init__(url, channel=channel, **kwargs)
+        self._init_batching(batch_window_s, batch_max)
+
+
+class _MongoTransport(AsyncPubSubManager, QueuedManager):
+    """Publishes to and tails a capped collection"""
+
+    def __init__(self, url: str, db_name: str, collection: str = 'socketio_messages',
+                 size_bytes: int = 16 * 1024 * 1024, retry_s: float = 0.2, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self.db_name = db_name
+        self.collection_name = collection
+        self.size_bytes = size_bytes
+        self.retry_s = retry_s
+        self._collection = None
+
+    async def _get_collection(self):
+        if self._collection is None:
+            database = AsyncIOMotorClient(self.url)[self.db_name]
+            try:
+                await database.create_collection(self.collection_name, capped=True, size=self.size_bytes)
+            except CollectionInvalid:
+                pass  # another worker created it
+            self._collection = database[self.collection_name]
+        return self._collection
+
+    async def _publish(self, data):
+        collection = await self._get_collection()
+        # Stored as a JSON string: emit payloads may have keys BSON rejects
+        await collection.insert_one({"channel": self.channel, "message": self.json.dumps(data)})
+
+    async def _listen(self):
+        collection = await self._get_collection()
+        newest = await collection.find_one({}, sort=[("$natural", -1)])
+        last_id = newest['_id'] if newest else None
+        while True:
+            # Capped collections keep insertion order but _ids from different
+            # workers aren't monotonic, so resume by skipping up to the last
+            # message seen rather than filtering on _id
+            skipping = last_id is not None and await collection.find_one({"_id": last_id}) is not None
+            cursor = collection.find({"channel": self.channel}, cursor_type=CursorType.TAILABLE_AWAIT)
+            while cursor.alive:
+                async for doc in cursor:
+                    if skipping:
+                        skipping = doc['_id'] != last_id
+                        continue
+                    last_id = doc['_id']
+                    yield doc['message']
+            # Cursor died (empty collection or position overwritten): tail again
+            await asyncio.sleep(self.retry_s)
+
+
+class MongoPubSubManager(BatchedPublishMixin, _MongoTransport):
+    """Fan-out through a capped MongoDB collection that every worker tails"""
+    name = 'mongopubsub'
+
+    def __init__(self, url: str, db_name: str, batch_window_s: float = 0.002, batch_max: int = 256, **kwargs):
+        super().__init__(url, db_name, **kwargs)
+        self._init_batching(batch_window_s, batch_max)
+
+
+class MemoryBroker:
+    """In-process pub/sub: every subscriber gets every message on its channel"""
+
+    def __init__(self):
+        self.subscribers: Dict[str, List[asyncio.Queue]] = {}
+        self.published = 0
+
+    def subscribe(self, channel: str) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self.subscribers.setdefault(channel, []).append(queue)
+        return queue
+
+    def publish(self, channel: str, message: str):
+        self.published += 1
+        for queue in self.subscribers.get(channel, ()):
+            queue.put_nowait(message)
+
+
+class _MemoryTransport(AsyncPubSubManager, QueuedManager):
+    """Publishes JSON strings through a MemoryBroker"""
+
+    def __init__(self, broker: MemoryBroker, **kwargs):
+        super().__init__(**kwargs)
+        self.broker = broker
+        self.queue = broker.subscribe(self.channel)
+
+    async def _publish(self, data):
+        self.broker.publish(self.channel, self.json.dumps(data))
+
+    async def _listen(self):
+        while True:
+            yield await self.queue.get()
+
+
+class MemoryPubSubManager(BatchedPublishMixin, _MemoryTransport):
+    """Fan-out between servers in one process, for tests and benchmarks"""
+    name = 'memorypubsub'
+
+    def __init__(self, broker: MemoryBroker, batch_window_s: float = 0.002, batch_max: int = 256, **kwargs):
+        super().__init__(broker, **kwargs)
+        self._init_batching(batch_window_s, batch_max)
+
+
+def client_manager_from_url(url: str, mongo_url: str, db_name: str, batch_window_s: float,
+                            queue_depth: int = 64, slow_client_s: float = 30.0):
+    """Client manager for SOCKETIO_MESSAGE_QUEUE: empty, "mongo", a mongodb:// URL or a Redis URL"""
+    if not url:
+        manager = LocalManager()
+    elif url == 'mongo':
+        manager = MongoPubSubManager(mongo_url, db_name, batch_window_s=batch_window_s)
+    elif url.startswith(('mongodb://', 'mongodb+srv://')):
+        manager = MongoPubSubManager(url, db_name, batch_window_s=batch_window_s)
+    else:
+        manager = BatchedRedisManager(url, batch_window_s=batch_window_s)
+    manager.queue_depth = queue_depth
+    manager.slow_client_s = slow_client_s
+    return manager
@@ -0,0 +1,650 @@
+"""Storage backends for the campus backend.
+
+Routes talk to a ``Storage`` through attribute access (``db.vehicles``) and
+use the Motor collection API subset listed on ``MemoryCollection``.
+``MongoStorage`` wraps Motor; ``MemoryStorage`` is an in-process async
+implementation of the same subset with dict-based hash indexes, so the whole
+API can run without MongoDB in unit tests and micro-benchmarks.
+"""
+import itertools
+import math
+import re
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.results import DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+
+class Storage:
+    """A database handle: `storage.<collection>` / `storage[name]` return collections"""
+
+    def __getitem__(self, name: str):
+        return getattr(self, name)
+
+    async def close(self):
+        pass
+
+
+class MongoStorage(Storage):
+    """MongoDB through Motor; the client connects lazily on first use"""
+
+    def __init__(self, mongo_url: str, db_name: str, **client_kwargs):
+        self.client = AsyncIOMotorClient(mongo_url, **client_kwargs)
+        self.database = self.client[db_name]
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.database[name]
+
+    def __getitem__(self, name: str):
+        return self.database[name]
+
+    async def close(self):
+        self.client.close()
+
+
+class MemoryStorage(Storage):
+    """In-process storage for tests and benchmarks"""
+
+    def __init__(self):
+        self._collections: Dict[str, "MemoryCollection"] = {}
+
+    def __getattr__(self, name: str) -> "MemoryCollection":
+        if name.startswith('_'):
+            raise AttributeError(name)
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = MemoryCollection(name)
+        return collection
+
+    def __getitem__(self, name: str) -> "MemoryCollection":
+        return getattr(self, name)
+
+    def list_collection_names(self) -> List[str]:
+        return list(self._collections)
+
+
+# ============ QUERY EVALUATION ============
+
+_MISSING = object()
+
+
+def _get_path(doc: Dict, path: str) -> Any:
+    value = doc
+    for part in path.split('.'):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        else:
+            return _MISSING
+    return value
+
+
+def _set_path(doc: Dict, path: str, value: Any):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        child = doc.get(part)
+        if not isinstance(child, dict):
+            child = doc[part] = {}
+        doc = child
+    doc[parts[-1]] = value
+
+
+def _unset_path(doc: Dict, path: str):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+def _clone(value: Any) -> Any:
+    """Copy nested dicts/lists so stored documents never alias caller objects"""
+    if isinstance(value, dict):
+        return {key: _clone(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_clone(item) for item in value]
+    return value
+
+
+def _sort_key(value: Any) -> Tuple:
+    # BSON ordering for the types the app stores: null < numbers < strings < objects < bool
+    if value is _MISSING or value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (5, value)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, str(value))
+
+
+def _compare(value: Any, operand: Any, op) -> bool:
+    if value is _MISSING or value is None or operand is None:
+        return False
+    if isinstance(value, (int, float)) != isinstance(operand, (int, float)):
+        return False
+    try:
+        return op(value, operand)
+    except TypeError:
+        return False
+
+
+def _values_equal(value: Any, expected: Any) -> bool:
+    if expected is None:
+        return value is _MISSING or value is None
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value is not _MISSING and value == expected
+
+
+def _match_operators(value: Any, condition: Dict) -> bool:
+    for op, operand in condition.items():
+        if op == '$eq':
+            if not _values_equal(value, operand):
+                return False
+        elif op == '$ne':
+            if _values_equal(value, operand):
+                return False
+        elif op == '$in':
+            if not any(_values_equal(value, item) for item in operand):
+                return False
+        elif op == '$nin':
+            if any(_values_equal(value, item) for item in operand):
+                return False
+        elif op == '$gt':
+            if not _compare(value, operand, lambda a, b: a > b):
+                return False
+        elif op == '$gte':
+            if not _compare(value, operand, lambda a, b: a >= b):
+                return False
+        elif op == '$lt':
+            if not _compare(value, operand, lambda a, b: a < b):
+                return False
+        elif op == '$lte':
+            if not _compare(value, operand, lambda a, b: a <= b):
+                return False
+        elif op == '$exists':
+            if (value is not _MISSING) != bool(operand):
+                return False
+        elif op == '$regex':
+            flags = re.IGNORECASE if 'i' in condition.get('$options', '') else 0
+            if not isinstance(value, str) or not re.search(operand, value, flags):
+                return False
+        elif op == '$options':
+            continue
+        else:
+            raise NotImplementedError(f"MemoryStorage does not support query operator {op}")
+    return True
+
+
+def matches(doc: Dict, query: Dict) -> bool:
+    """Evaluate a MongoDB filter document against a stored document"""
+    for key, condition in query.items():
+        if key == '$or':
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif key == '$and':
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        elif key == '$nor':
+            if any(matches(doc, sub) for sub in condition):
+                return False
+        else:
+            value = _get_path(doc, key)
+            if isinstance(condition, dict) and condition and next(iter(condition)).startswith('$'):
+                if not _match_operators(value, condition):
+                    return False
+            elif not _values_equal(value, condition):
+                return False
+    return True
+
+
+def project(doc: Dict, projection: Optional[Dict]) -> Dict:
+    """Apply an inclusion or exclusion projection to a copy of `doc`"""
+    if not projection:
+        return _clone(doc)
+    include = {key for key, flag in projection.items() if flag and key != '_id'}
+    if include:
+        result = {}
+        if projection.get('_id', 1) and '_id' in doc:
+            result['_id'] = doc['_id']
+        for path in include:
+            value = _get_path(doc, path)
+            if value is not _MISSING:
+                _set_path(result, path, _clone(value))
+        return result
+    result = _clone(doc)
+    for key, flag in projection.items():
+        if not flag:
+            _unset_path(result, key)
+    return result
+
+
+def _assign(doc: Dict, path: str, value: Any) -> bool:
+    if _get_path(doc, path) == value:
+        return False
+    _set_path(doc, path, value)
+    return True
+
+
+def apply_update(doc: Dict, update: Dict, inserting: bool = False) -> bool:
+    """Apply update operators in place; returns whether the document changed"""
+    changed = False
+    for op, fields in update.items():
+        if op == '$set' or (op == '$setOnInsert' and inserting):
+            for path, value in fields.items():
+                changed |= _assign(doc, path, _clone(value))
+        elif op == '$setOnInsert':
+            continue
+        elif op == '$unset':
+            for path in fields:
+                if _get_path(doc, path) is not _MISSING:
+                    _unset_path(doc, path)
+                    changed = True
+        elif op == '$inc':
+            for path, amount in fields.items():
+                current = _get_path(doc, path)
+                _set_path(doc, path, (0 if current is _MISSING or current is None else current) + amount)
+                changed |= amount != 0
+        elif op in ('$max', '$min'):
+            for path, value in fields.items():
+                current = _get_path(doc, path)
+                if current is _MISSING or current is None or \
+                        (op == '$max' and _sort_key(value) > _sort_key(current)) or \
+                        (op == '$min' and _sort_key(value) < _sort_key(current)):
+                    changed |= _assign(doc, path, value)
+        elif op == '$push':
+            for path, value in fields.items():
+                current = _get_path(doc, path)
+                items = list(current) if isinstance(current, list) else []
+                if isinstance(value, dict) and '$each' in value:
+                    items.extend(_clone(value['$each']))
+                    if '$slice' in value:
+                        limit = value['$slice']
+                        items = items[limit:] if limit < 0 else items[:limit]
+                else:
+                    items.append(_clone(value))
+                _set_path(doc, path, items)
+                changed = True
+        elif op == '$pull':
+            for path, value in fields.items():
+                current = _get_path(doc, path)
+                if isinstance(current, list) and value in current:
+                    _set_path(doc, path, [item for item in current if item != value])
+                    changed = True
+        else:
+            raise NotImplementedError(f"MemoryStorage does not support update operator {op}")
+    return changed
+
+
+def _upsert_seed(query: Dict) -> Dict:
+    """Equality fields of a filter become the initial fields of an upserted document"""
+    seed = {}
+    for key, condition in query.items():
+        if key.startswith('$'):
+            continue
+        if isinstance(condition, dict) and condition and next(iter(condition)).startswith('$'):
+            if '$eq' in condition:
+                _set_path(seed, key, _clone(condition['$eq']))
+            continue
+        _set_path(seed, key, _clone(condition))
+    return seed
+
+
+def _normalize_sort(key_or_list, direction=None) -> List[Tuple[str, int]]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction if direction is not None else 1)]
+    return [(key, dir_) for key, dir_ in key_or_list]
+
+
+def _hashable(value: Any):
+    if isinstance(value, (dict, list)):
+        return None
+    return value
+
+
+# ============ AGGREGATION ============
+
+# Sphere radius MongoDB uses for $geoNear on GeoJSON points
+EARTH_RADIUS_M = 6378100
+
+
+def _point_coordinates(value: Any) -> Optional[Tuple[float, float]]:
+    """(lng, lat) of a GeoJSON point or legacy [lng, lat] pair"""
+    if isinstance(value, dict) and value.get('type') == 'Point':
+        value = value.get('coordinates')
+    if isinstance(value, (list, tuple)) and len(value) == 2:
+        return float(value[0]), float(value[1])
+    return None
+
+
+def spherical_distance_m(lng1: float, lat1: float, lng2: float, lat2: float) -> float:
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng / 2) ** 2
+    return EARTH_RADIUS_M * 2 * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _geo_near(collection: "MemoryCollection", spec: Dict) -> List[Dict]:
+    key = spec.get('key')
+    if key is None:
+        if len(collection._geo_fields) != 1:
+            raise ValueError("$geoNear requires exactly one 2dsphere index or an explicit key")
+        key = next(iter(collection._geo_fields))
+    near = _point_coordinates(spec['near'])
+    max_distance = spec.get('maxDistance', math.inf)
+    min_distance = spec.get('minDistance', 0)
+    results = []
+    for doc in collection._find_raw(spec.get('query') or {}):
+        point = _point_coordinates(_get_path(doc, key))
+        if point is None:
+            continue
+        distance = spherical_distance_m(near[0], near[1], point[0], point[1])
+        if min_distance <= distance <= max_distance:
+            result = _clone(doc)
+            _set_path(result, spec['distanceField'], distance)
+            results.append(result)
+    results.sort(key=lambda doc: _get_path(doc, spec['distanceField']))
+    return results
+
+
+def run_pipeline(collection: "MemoryCollection", pipeline: List[Dict]) -> List[Dict]:
+    """Evaluate the aggregation stages the app uses: $geoNear, $match, $sort, $skip, $limit, $project"""
+    docs: Optional[List[Dict]] = None
+    for position, stage in enumerate(pipeline):
+        (name, spec), = stage.items()
+        if name == '$geoNear':
+            if position != 0:
+                raise ValueError("$geoNear is only valid as the first stage in a pipeline")
+            docs = _geo_near(collection, spec)
+            continue
+        if docs is None:
+            docs = [_clone(doc) for doc in collection._docs.values()]
+        if name == '$match':
+            docs = [doc for doc in docs if matches(doc, spec)]
+        elif name == '$sort':
+            for key, direction in reversed(list(spec.items())):
+                docs.sort(key=lambda doc: _sort_key(_get_path(doc, key)), reverse=direction < 0)
+        elif name == '$skip':
+            docs = docs[spec:]
+        elif name == '$limit':
+            docs = docs[:spec]
+        elif name == '$project':
+            docs = [project(doc, spec) for doc in docs]
+        else:
+            raise NotImplementedError(f"MemoryStorage does not support aggregation stage {name}")
+    if docs is None:
+        docs = [_clone(doc) for doc in collection._docs.values()]
+    return docs
+
+
+class MemoryCommandCursor:
+    """Materialized aggregation result with the Motor command cursor API"""
+
+    def __init__(self, docs: List[Dict]):
+        self._docs = docs
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict]:
+        return self._docs[:length] if length else list(self._docs)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._docs:
+            yield doc
+
+
+# ============ COLLECTION ============
+
+class MemoryCursor:
+    """Lazy cursor supporting sort/skip/limit/to_list and async iteration"""
+
+    def __init__(self, collection: "MemoryCollection", query: Dict, projection: Optional[Dict]):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=None) -> "MemoryCursor":
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, count: int) -> "MemoryCursor":
+        self._skip = count
+        return self
+
+    def limit(self, count: int) -> "MemoryCursor":
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int) -> "MemoryCursor":
+        return self
+
+    def _documents(self) -> List[Dict]:
+        docs = self._collection._find_raw(self._query)
+        for key, direction in reversed(self._sort):
+            docs.sort(key=lambda doc: _sort_key(_get_path(doc, key)), reverse=direction < 0)
+        end = self._skip + self._limit if self._limit else None
+        return [project(doc, self._projection) for doc in docs[self._skip:end]]
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict]:
+        docs = self._documents()
+        return docs[:length] if length else docs
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._documents():
+            yield doc
+
+
+class MemoryCollection:
+    """Async collection over a dict of documents with hash indexes on equality fields
+
+    Indexes cover scalar values; documents holding a list or sub-document in
+    an indexed field are only found by non-indexed queries. Supported: find_one, find (cursor), insert_one, insert_many, update_one,
+    update_many, delete_one, delete_many, count_documents, find_one_and_update,
+    find_one_and_delete, aggregate and create_index. Every collection indexes `id`.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._docs: Dict[int, Dict] = {}
+        self._keys = itertools.count()
+        # field -> value -> document keys
+        self._indexes: Dict[str, Dict[Any, Set[int]]] = {}
+        # fields with a 2dsphere index, the default $geoNear key
+        self._geo_fields: Set[str] = set()
+        self.create_index_sync('id')
+
+    # ---- indexing ----
+
+    def create_index_sync(self, field: str):
+        if field in self._indexes:
+            return
+        index: Dict[Any, Set[int]] = {}
+        for key, doc in self._docs.items():
+            value = _hashable(_get_path(doc, field))
+            index.setdefault(value, set()).add(key)
+        self._indexes[field] = index
+
+    async def create_index(self, keys, **kwargs) -> str:
+        fields = _normalize_sort(keys, 1)
+        # Only single-field ascending/descending indexes change lookups here
+        if len(fields) == 1 and fields[0][1] in (1, -1):
+            self.create_index_sync(fields[0][0])
+        self._geo_fields.update(field for field, kind in fields if kind == '2dsphere')
+        return "_".join(f"{field}_{direction}" for field, direction in fields)
+
+    def _index_doc(self, key: int, doc: Dict):
+        for field, index in self._indexes.items():
+            value = _hashable(_get_path(doc, field))
+            index.setdefault(value, set()).add(key)
+
+    def _unindex_doc(self, key: int, doc: Dict):
+        for field, index in self._indexes.items():
+            value = _hashable(_get_path(doc, field))
+            bucket = index.get(value)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del index[value]
+
+    def _candidates(self, query: Dict) -> Iterable[int]:
+        """Narrow the scan with an index when the filter has an indexed equality/$in"""
+        best: Optional[Set[int]] = None
+        for field, condition in query.items():
+            index = self._indexes.get(field)
+            if index is None:
+                continue
+            if isinstance(condition, dict):
+                if set(condition) == {'$in'}:
+                    keys = set()
+                    for value in condition['$in']:
+                        if value is None or _hashable(value) is None:
+                            break
+                        keys |= index.get(value, set())
+                    else:
+                        if best is None or len(keys) < len(best):
+                            best = keys
+                continue
+            if condition is None or _hashable(condition) is None:
+                continue
+            keys = index.get(condition, set())
+            if best is None or len(keys) < len(best):
+                best = keys
+        if best is None:
+            return list(self._docs)
+        return sorted(best)
+
+    def _find_keys(self, query: Dict, limit: int = 0) -> List[int]:
+        found = []
+        for key in self._candidates(query):
+            doc = self._docs.get(key)
+            if doc is not None and matches(doc, query):
+                found.append(key)
+                if limit and len(found) >= limit:
+                    break
+        return found
+
+    def _find_raw(self, query: Dict) -> List[Dict]:
+        return [self._docs[key] for key in self._find_keys(query)]
+
+    def _first_key(self, query: Dict, sort=None) -> Optional[int]:
+        if sort:
+            keys = self._find_keys(query)
+            for field, direction in reversed(_normalize_sort(sort)):
+                keys.sort(key=lambda k: _sort_key(_get_path(self._docs[k], field)), reverse=direction < 0)
+            return keys[0] if keys else None
+        keys = self._find_keys(query, limit=1)
+        return keys[0] if keys else None
+
+    def _insert(self, doc: Dict) -> Any:
+        if '_id' not in doc:
+            doc['_id'] = ObjectId()
+        key = next(self._keys)
+        stored = _clone(doc)
+        self._docs[key] = stored
+        self._index_doc(key, stored)
+        return doc['_id']
+
+    def _update_key(self, key: int, update: Dict) -> bool:
+        doc = self._docs[key]
+        self._unindex_doc(key, doc)
+        changed = apply_update(doc, update)
+        self._index_doc(key, doc)
+        return changed
+
+    def _upsert(self, query: Dict, update: Dict) -> Any:
+        doc = _upsert_seed(query)
+        apply_update(doc, update, inserting=True)
+        return self._insert(doc)
+
+    # ---- public API (Motor-compatible subset) ----
+
+    async def find_one(self, query: Optional[Dict] = None, projection: Optional[Dict] = None,
+                       sort=None) -> Optional[Dict]:
+        key = self._first_key(query or {}, sort)
+        return project(self._docs[key], projection) if key is not None else None
+
+    def find(self, query: Optional[Dict] = None, projection: Optional[Dict] = None) -> MemoryCursor:
+        return MemoryCursor(self, query or {}, projection)
+
+    async def count_documents(self, query: Dict) -> int:
+        if not query:
+            return len(self._docs)
+        return len(self._find_keys(query))
+
+    async def insert_one(self, doc: Dict) -> InsertOneResult:
+        return InsertOneResult(self._insert(doc), True)
+
+    async def insert_many(self, docs: Iterable[Dict], ordered: bool = True) -> InsertManyResult:
+        return InsertManyResult([self._insert(doc) for doc in docs], True)
+
+    async def update_one(self, query: Dict, update: Dict, upsert: bool = False) -> UpdateResult:
+        key = self._first_key(query)
+        if key is None:
+            if upsert:
+                upserted_id = self._upsert(query, update)
+                return UpdateResult({'n': 1, 'nModified': 0, 'upserted': upserted_id}, True)
+            return UpdateResult({'n': 0, 'nModified': 0}, True)
+        changed = self._update_key(key, update)
+        return UpdateResult({'n': 1, 'nModified': int(changed)}, True)
+
+    async def update_many(self, query: Dict, update: Dict, upsert: bool = False) -> UpdateResult:
+        keys = self._find_keys(query)
+        if not keys and upsert:
+            upserted_id = self._upsert(query, update)
+            return UpdateResult({'n': 1, 'nModified': 0, 'upserted': upserted_id}, True)
+        modified = sum(1 for key in keys if self._update_key(key, update))
+        return UpdateResult({'n': len(keys), 'nModified': modified}, True)
+
+    async def delete_one(self, query: Dict) -> DeleteResult:
+        key = self._first_key(query)
+        if key is None:
+            return DeleteResult({'n': 0}, True)
+        self._unindex_doc(key, self._docs.pop(key))
+        return DeleteResult({'n': 1}, True)
+
+    async def delete_many(self, query: Dict) -> DeleteResult:
+        keys = self._find_keys(query)
+        for key in keys:
+            self._unindex_doc(key, self._docs.pop(key))
+        return DeleteResult({'n': len(keys)}, True)
+
+    async def find_one_and_update(self, query: Dict, update: Dict, projection: Optional[Dict] = None,
+                                  sort=None, upsert: bool = False,
+                                  return_document: bool = ReturnDocument.BEFORE) -> Optional[Dict]:
+        key = self._first_key(query, sort)
+        if key is None:
+            if not upsert:
+                return None
+            inserted_id = self._upsert(query, update)
+            if return_document != ReturnDocument.AFTER:
+                return None
+            key = self._first_key({'_id': inserted_id})
+            return project(self._docs[key], projection)
+        before = project(self._docs[key], projection) if return_document != ReturnDocument.AFTER else None
+        self._update_key(key, update)
+        return before if before is not None else project(self._docs[key], projection)
+
+    def aggregate(self, pipeline: List[Dict]) -> MemoryCommandCursor:
+        return MemoryCommandCursor(run_pipeline(self, pipeline))
+
+    async def find_one_and_delete(self, query: Dict, projection: Optional[Dict] = None,
+                                  sort=None) -> Optional[Dict]:
+        key = self._first_key(query, sort)
+        if key is None:
+            return None
+        doc = self._docs.pop(key)
+        self._unindex_doc(key, doc)
+        return project(doc, projection)
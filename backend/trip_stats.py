@@ -0,0 +1,73 @@
+"""Per-trip statistics accumulated one GPS fix at a time.
+
+Each active trip keeps a small accumulator that folds every fix in with
+constant work: the haversine distance from the previous fix, and the time
+since it, attributed to idling, moving and overspeeding by the speed the
+previous fix reported (the vehicle is assumed to hold it until the next
+fix). Summaries are read straight from the running totals, so a trip never
+needs its GPS history rescanned.
+"""
+from typing import Dict, Optional
+
+from dispatch import haversine_km
+
+
+class TripAccumulator:
+    """Running totals for one trip and the last fix they were taken up to"""
+    __slots__ = ("trip_id", "speed_limit", "idle_kmh", "max_gap_s", "distance_km", "max_speed", "tracked_s",
+                 "idle_s", "overspeed_s", "last_lat", "last_lng", "last_speed", "last_ts", "dirty")
+
+    def __init__(self, trip_id: str, speed_limit: float, idle_kmh: float = 3.0, max_gap_s: float = 120.0):
+        self.trip_id = trip_id
+        self.speed_limit = speed_limit
+        self.idle_kmh = idle_kmh
+        # Silences longer than this (tracker off, tunnel) count distance but only this much time
+        self.max_gap_s = max_gap_s
+        self.distance_km = 0.0
+        self.max_speed = 0.0
+        self.tracked_s = 0.0
+        self.idle_s = 0.0
+        self.overspeed_s = 0.0
+        self.last_lat: Optional[float] = None
+        self.last_lng: Optional[float] = None
+        self.last_speed = 0.0
+        self.last_ts: Optional[float] = None
+        self.dirty = False
+
+    def add(self, lat: float, lng: float, speed: float, ts: float) -> bool:
+        """Fold in a fix taken at `ts` (epoch seconds); fixes older than the last one are ignored"""
+        if self.last_ts is not None:
+            if ts < self.last_ts:
+                return False
+            self.distance_km += haversine_km(self.last_lat, self.last_lng, lat, lng)
+            elapsed = min(ts - self.last_ts, self.max_gap_s)
+            self.tracked_s += elapsed
+            if self.last_speed < self.idle_kmh:
+                self.idle_s += elapsed
+            elif self.last_speed > self.speed_limit:
+                self.overspeed_s += elapsed
+        if speed > self.max_speed:
+            self.max_speed = speed
+        self.last_lat, self.last_lng, self.last_speed, self.last_ts = lat, lng, speed, ts
+        self.dirty = True
+        return True
+
+    def summary(self) -> Dict[str, float]:
+        """Fields for the trip document; `tracked_s` lets a restarted worker carry on the average"""
+        avg = self.distance_km / (self.tracked_s / 3600) if self.tracked_s else 0.0
+        return {
+            "distance_km": round(self.distance_km, 3),
+            "max_speed_kmh": round(self.max_speed, 1),
+            "avg_speed_kmh": round(avg, 1),
+            "idle_s": round(self.idle_s, 1),
+            "overspeed_s": round(self.overspeed_s, 1),
+            "tracked_s": round(self.tracked_s, 1)
+        }
+
+    def restore(self, trip: Dict):
+        """Continue from totals a previous worker flushed into the trip document"""
+        self.distance_km = trip.get('distance_km') or 0.0
+        self.max_speed = trip.get('max_speed_kmh') or 0.0
+        self.idle_s = trip.get('idle_s') or 0.0
+        self.overspeed_s = trip.get('overspeed_s') or 0.0
+        self.tracked_s = trip.get('tracked_s') or 0.0
@@ -0,0 +1,157 @@
+"""Map viewport subscriptions for live vehicle positions.
+
+A client zoomed into part of the campus map subscribes with a bounding box
+and then only hears about vehicles inside it. Subscriptions are indexed in a
+uniform lat/lng grid: each viewport is registered in every cell it overlaps,
+so a fix only looks at the viewports registered in its own cell. Viewports
+spanning more than ``max_cells`` cells (a zoomed-out map) are kept in a
+separate list and checked one by one instead of being spread over thousands
+of cells.
+
+The index also remembers which viewports currently show each vehicle, which
+turns a fix into three sets of clients: the ones the vehicle just entered,
+the ones it moved within and the ones it just left. Work per fix is
+proportional to the viewports in its cell plus the ones that showed the
+vehicle before, not to the number of subscribers.
+"""
+import math
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from dispatch import GridIndex
+
+
+class Viewport:
+    """One client's bounding box and the grid cells it is registered in (None when wide)"""
+    __slots__ = ("south", "west", "north", "east", "cells")
+
+    def __init__(self, south: float, west: float, north: float, east: float,
+                 cells: Optional[List[Tuple[int, int]]]):
+        self.south = south
+        self.west = west
+        self.north = north
+        self.east = east
+        self.cells = cells
+
+    def contains(self, lat: float, lng: float) -> bool:
+        return self.south <= lat <= self.north and self.west <= lng <= self.east
+
+
+class ViewportChange(NamedTuple):
+    """Subscribers a vehicle entered, moved within and left on one fix"""
+    entered: Set[str]
+    moved: Set[str]
+    left: Set[str]
+
+
+class ViewportIndex:
+    """Viewport subscriptions by grid cell and the vehicles each one currently shows"""
+
+    def __init__(self, cell_deg: float = 0.01, max_cells: int = 4096):
+        self.cell_deg = cell_deg
+        self.max_cells = max_cells
+        self.viewports: Dict[str, Viewport] = {}
+        self.cells: Dict[Tuple[int, int], Set[str]] = {}
+        self.wide: Set[str] = set()
+        # Latest position and location payload of every vehicle, for snapshots on subscribe
+        self.vehicles = GridIndex(cell_deg)
+        self.payloads: Dict[str, Dict] = {}
+        self.shown_in: Dict[str, Set[str]] = {}  # vehicle -> subscribers showing it
+        self.showing: Dict[str, Set[str]] = {}  # subscriber -> vehicles it shows
+
+    def __len__(self) -> int:
+        return len(self.viewports)
+
+    def __contains__(self, subscriber: str) -> bool:
+        return subscriber in self.viewports
+
+    def _row_col(self, lat: float, lng: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lng / self.cell_deg))
+
+    def subscribe(self, subscriber: str, south: float, west: float, north: float, east: float) -> List[Dict]:
+        """Set `subscriber`'s viewport (replacing any previous one) and return the vehicles inside it"""
+        self.unsubscribe(subscriber)
+        low, high = self._row_col(south, west), self._row_col(north, east)
+        rows, cols = range(low[0], high[0] + 1), range(low[1], high[1] + 1)
+        if len(rows) * len(cols) > self.max_cells:
+            cells = None
+            self.wide.add(subscriber)
+        else:
+            cells = [(row, col) for row in rows for col in cols]
+            for cell in cells:
+                self.cells.setdefault(cell, set()).add(subscriber)
+        viewport = self.viewports[subscriber] = Viewport(south, west, north, east, cells)
+
+        if cells is None or len(cells) > len(self.vehicles):
+            candidates = self.vehicles.points
+        else:
+            candidates = [vehicle for cell in cells for vehicle in self.vehicles.cells.get(cell, ())]
+        shown = set()
+        for vehicle in candidates:
+            lat, lng, _ = self.vehicles.points[vehicle]
+            if viewport.contains(lat, lng):
+                shown.add(vehicle)
+                self.shown_in.setdefault(vehicle, set()).add(subscriber)
+        self.showing[subscriber] = shown
+        return [self.payloads[vehicle] for vehicle in shown]
+
+    def unsubscribe(self, subscriber: str) -> bool:
+        viewport = self.viewports.pop(subscriber, None)
+        if viewport is None:
+            return False
+        if viewport.cells is None:
+            self.wide.discard(subscriber)
+        else:
+            for cell in viewport.cells:
+                members = self.cells[cell]
+                members.discard(subscriber)
+                if not members:
+                    del self.cells[cell]
+        for vehicle in self.showing.pop(subscriber, ()):
+            self._hide(vehicle, subscriber)
+        return True
+
+    def _hide(self, vehicle: str, subscriber: str):
+        subscribers = self.shown_in.get(vehicle)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.shown_in[vehicle]
+
+    def move(self, vehicle: str, lat: float, lng: float, payload: Dict) -> ViewportChange:
+        """Record a fix and work out which subscribers it concerns"""
+        self.vehicles.upsert(vehicle, lat, lng)
+        self.payloads[vehicle] = payload
+        inside = {subscriber for subscriber in self.cells.get(self._row_col(lat, lng), ())
+                  if self.viewports[subscriber].contains(lat, lng)}
+        for subscriber in self.wide:
+            if self.viewports[subscriber].contains(lat, lng):
+                inside.add(subscriber)
+        before = self.shown_in.get(vehicle, set())
+        change = ViewportChange(inside - before, inside & before, before - inside)
+        for subscriber in change.entered:
+            self.showing[subscriber].add(vehicle)
+        for subscriber in change.left:
+            self.showing[subscriber].discard(vehicle)
+        if inside:
+            self.shown_in[vehicle] = inside
+        else:
+            self.shown_in.pop(vehicle, None)
+        return change
+
+    def remove(self, vehicle: str) -> Set[str]:
+        """Forget a vehicle that left the map; returns the subscribers that were showing it"""
+        self.vehicles.remove(vehicle)
+        self.payloads.pop(vehicle, None)
+        subscribers = self.shown_in.pop(vehicle, set())
+        for subscriber in subscribers:
+            self.showing[subscriber].discard(vehicle)
+        return subscribers
+
+    def clear(self):
+        self.viewports.clear()
+        self.cells.clear()
+        self.wide.clear()
+        self.vehicles = GridIndex(self.cell_deg)
+        self.payloads.clear()
+        self.shown_in.clear()
+        self.showing.clear()
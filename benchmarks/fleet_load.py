@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+GCE Campus Transportation System - Fleet load benchmark
+
+Starts the backend locally (uvicorn subprocess) against a local MongoDB or
+the in-memory storage backend and drives it with a simulated fleet:
+  - N vehicles posting fixes to /api/gps/receive at M Hz
+  - K students polling /api/public/buses
+  - D drivers polling /api/driver/pending-bookings
+  - S Socket.IO subscribers receiving vehicle_location emits
+
+Reports throughput, p50/p95/p99 latency per endpoint, emit delivery lag and
+server CPU per GPS fix, and writes everything as JSON so runs can be compared
+over time:
+
+    python benchmarks/fleet_load.py --vehicles 50 --hz 1 --students 200 \\
+        --drivers 10 --subscribers 20 --duration 60 --output bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import socketio
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT_DIR / "backend"
+
+# Campus centre used to scatter simulated vehicles
+CAMPUS_LAT = 20.2961
+CAMPUS_LNG = 85.8245
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples: List[float], errors: int, duration_s: float) -> Dict:
+    """Latency summary in milliseconds for one endpoint or stream"""
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "errors": errors,
+        "throughput_per_s": round(len(ordered) / duration_s, 2) if duration_s else None,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3) if ordered else None,
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3) if ordered else None,
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3) if ordered else None,
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else None
+    }
+
+
+def process_cpu_seconds(pid: int) -> Optional[float]:
+    """User+system CPU time of a process from /proc (Linux only)"""
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    ticks = os.sysconf(os.sysconf_names["SC_CLK_TCK"])
+    return (int(fields[11]) + int(fields[12])) / ticks
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Recorder:
+    """Collects latency samples and error counts per operation"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def add(self, name: str, seconds: float):
+        self.samples.setdefault(name, []).append(seconds)
+
+    def error(self, name: str):
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    def report(self, duration_s: float) -> Dict:
+        names = set(self.samples) | set(self.errors)
+        return {
+            name: summarize(self.samples.get(name, []), self.errors.get(name, 0), duration_s)
+            for name in sorted(names)
+        }
+
+
+class ManagedProcess:
+    """Subprocess wrapper that is terminated on exit"""
+
+    def __init__(self, args: List[str], env: Dict[str, str], cwd: Path, log_path: Path):
+        self.log = open(log_path, "w")
+        self.proc = subprocess.Popen(args, env=env, cwd=cwd, stdout=self.log, stderr=subprocess.STDOUT)
+
+    @property
+    def pid(self) -> int:
+        return self.proc.pid
+
+    def stop(self):
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        self.log.close()
+
+
+def start_mongod(workdir: Path) -> (ManagedProcess, str):
+    """Spawn a throwaway mongod on a free port"""
+    binary = shutil.which("mongod")
+    if not binary:
+        sys.exit("mongod not found on PATH; pass --mongo-url instead of --spawn-mongod")
+    port = free_port()
+    dbpath = workdir / "mongo-data"
+    dbpath.mkdir()
+    proc = ManagedProcess(
+        [binary, "--dbpath", str(dbpath), "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+        dict(os.environ), workdir, workdir / "mongod.log"
+    )
+    url = f"mongodb://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return proc, url
+        except OSError:
+            time.sleep(0.2)
+    proc.stop()
+    sys.exit("mongod did not start within 30s")
+
+
+def start_server(workdir: Path, env_overrides: Dict[str, str]) -> (ManagedProcess, str):
+    """Start the backend under uvicorn and wait until it answers"""
+    port = free_port()
+    env = dict(os.environ)
+    env.update(env_overrides)
+    proc = ManagedProcess(
+        [sys.executable, "-m", "uvicorn", "server:socket_app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        env, BACKEND_DIR, workdir / "server.log"
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/metrics", timeout=1).status_code == 200:
+                return proc, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    proc.stop()
+    sys.exit(f"backend did not start within 30s, see {workdir / 'server.log'}")
+
+
+class FleetBenchmark:
+    def __init__(self, base_url: str, args: argparse.Namespace):
+        self.base_url = base_url
+        self.args = args
+        self.recorder = Recorder()
+        self.http = httpx.AsyncClient(
+            base_url=f"{base_url}/api",
+            timeout=30,
+            limits=httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+        )
+        self.imeis: List[str] = []
+        self.driver_tokens: List[str] = []
+        self.emit_lags: List[float] = []
+        self.emits_received = 0
+        self.fixes_sent = 0
+        self.stop_at = 0.0
+
+    async def post(self, path: str, body: Dict, token: Optional[str] = None) -> Dict:
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        response = await self.http.post(path, json=body, headers=headers)
+        response.raise_for_status()
+        return response.json()
+
+    async def setup(self):
+        """Create vehicles and drivers, and start a trip on every bus"""
+        admin = await self.post("/auth/login", {"email": "admin@gceits.com", "password": "Admin@12345"})
+        admin_token = admin["access_token"]
+        run_id = uuid.uuid4().hex[:8]
+
+        for index in range(self.args.vehicles):
+            imei = f"BENCH{run_id}{index:05d}"
+            vehicle = await self.post("/admin/vehicles", {
+                "vehicle_number": f"BENCH-{run_id}-{index}",
+                "gps_imei": imei,
+                "barcode": f"BC{run_id}{index}",
+                "vehicle_type": "bus"
+            }, admin_token)
+            self.imeis.append(imei)
+
+            if index < self.args.trips:
+                driver = await self.post("/auth/signup", {
+                    "name": f"Bench Driver {index}",
+                    "phone": f"9{run_id[:4]}{index:05d}",
+                    "password": "bench-pass",
+                    "role": "driver",
+                    "driver_type": "bus"
+                })
+                token = driver["access_token"]
+                await self.post(f"/driver/assign-vehicle/{vehicle['id']}", {}, token)
+                await self.post("/driver/start-trip", {"vehicle_id": vehicle["id"]}, token)
+                self.driver_tokens.append(token)
+
+        for index in range(max(0, self.args.drivers - len(self.driver_tokens))):
+            driver = await self.post("/auth/signup", {
+                "name": f"Bench Ambulance Driver {index}",
+                "phone": f"8{run_id[:4]}{index:05d}",
+                "password": "bench-pass",
+                "role": "driver",
+                "driver_type": "ambulance"
+            })
+            self.driver_tokens.append(driver["access_token"])
+
+    async def timed(self, name: str, method: str, path: str, **kwargs) -> bool:
+        start = time.perf_counter()
+        try:
+            response = await self.http.request(method, path, **kwargs)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        if ok:
+            self.recorder.add(name, time.perf_counter() - start)
+        else:
+            self.recorder.error(name)
+        return ok
+
+    async def pause(self, seconds: float):
+        """Sleep, but never past the end of the load phase so it isn't padded with idle time"""
+        await asyncio.sleep(max(0.0, min(seconds, self.stop_at - time.monotonic())))
+
+    async def vehicle_loop(self, imei: str):
+        interval = 1.0 / self.args.hz
+        lat = CAMPUS_LAT + random.uniform(-0.01, 0.01)
+        lng = CAMPUS_LNG + random.uniform(-0.01, 0.01)
+        await self.pause(random.uniform(0, interval))
+        while time.monotonic() < self.stop_at:
+            lat += random.uniform(-0.0002, 0.0002)
+            lng += random.uniform(-0.0002, 0.0002)
+            sent = await self.timed("gps_receive", "POST", "/gps/receive", json={
+                "imei": imei,
+                "latitude": lat,
+                "longitude": lng,
+                "speed": random.uniform(0, 45),
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            })
+            if sent:
+                self.fixes_sent += 1
+            await self.pause(interval)
+
+    async def poll_loop(self, name: str, path: str, period_s: float, token: Optional[str] = None):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        await self.pause(random.uniform(0, period_s))
+        while time.monotonic() < self.stop_at:
+            await self.timed(name, "GET", path, headers=headers)
+            await self.pause(period_s)
+
+    async def subscriber(self, ready: asyncio.Event, connected: List[int]):
+        client = socketio.AsyncClient(reconnection=False)
+
+        @client.on("vehicle_location")
+        async def on_location(data):
+            self.emits_received += 1
+            stamp = (data.get("location") or {}).get("timestamp")
+            if stamp:
+                sent_at = datetime.fromisoformat(stamp)
+                self.emit_lags.append((datetime.now(timezone.utc) - sent_at).total_seconds())
+
+        try:
+            await client.connect(self.base_url, transports=["websocket"])
+            connected[0] += 1
+        except socketio.exceptions.ConnectionError:
+            self.recorder.error("socket_connect")
+            return
+        await ready.wait()
+        await client.disconnect()
+
+    async def run(self) -> Dict:
+        args = self.args
+        await self.setup()
+
+        done = asyncio.Event()
+        connected = [0]
+        subscribers = [asyncio.create_task(self.subscriber(done, connected)) for _ in range(args.subscribers)]
+        await asyncio.sleep(1)
+
+        cpu_before = process_cpu_seconds(args.server_pid) if args.server_pid else None
+        started = time.monotonic()
+        self.stop_at = started + args.duration
+        workers = [self.vehicle_loop(imei) for imei in self.imeis]
+        workers += [self.poll_loop("public_buses", "/public/buses", args.student_poll_s) for _ in range(args.students)]
+        workers += [
+            self.poll_loop("driver_pending_bookings", "/driver/pending-bookings", args.driver_poll_s,
+                           self.driver_tokens[index % len(self.driver_tokens)])
+            for index in range(args.drivers) if self.driver_tokens
+        ]
+        await asyncio.gather(*workers)
+        elapsed = time.monotonic() - started
+        cpu_after = process_cpu_seconds(args.server_pid) if args.server_pid else None
+
+        # Give in-flight emits a moment to land before closing subscribers
+        await asyncio.sleep(1)
+        done.set()
+        await asyncio.gather(*subscribers)
+        await self.http.aclose()
+
+        server_cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+        lag = summarize(self.emit_lags, 0, elapsed)
+        lag["subscribers_connected"] = connected[0]
+        lag["expected_deliveries"] = self.fixes_sent * connected[0]
+        return {
+            "endpoints": self.recorder.report(elapsed),
+            "emit_delivery_lag": lag,
+            "gps_fixes_sent": self.fixes_sent,
+            "duration_s": round(elapsed, 3),
+            "server_cpu_s": round(server_cpu, 3) if server_cpu is not None else None,
+            "server_cpu_ms_per_fix": round(server_cpu * 1000 / self.fixes_sent, 4)
+            if server_cpu is not None and self.fixes_sent else None
+        }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Fleet-scale load benchmark for the campus backend")
+    parser.add_argument("--vehicles", type=int, default=20, help="simulated GPS trackers (N)")
+    parser.add_argument("--hz", type=float, default=1.0, help="fixes per second per vehicle (M)")
+    parser.add_argument("--trips", type=int, default=None,
+                        help="buses with an active trip (default: all vehicles)")
+    parser.add_argument("--students", type=int, default=50, help="students polling /public/buses (K)")
+    parser.add_argument("--student-poll-s", type=float, default=5.0)
+    parser.add_argument("--drivers", type=int, default=5, help="drivers polling /driver/pending-bookings")
+    parser.add_argument("--driver-poll-s", type=float, default=5.0)
+    parser.add_argument("--subscribers", type=int, default=10, help="Socket.IO subscribers (S)")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured load phase in seconds")
+    parser.add_argument("--max-connections", type=int, default=200)
+    parser.add_argument("--storage", choices=["memory", "mongo"], default="memory",
+                        help="storage backend for the spawned server (memory needs no mongod)")
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://127.0.0.1:27017"))
+    parser.add_argument("--spawn-mongod", action="store_true", help="start a throwaway mongod for the run")
+    parser.add_argument("--base-url", help="benchmark an already running backend instead of starting one")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args(argv)
+    if args.trips is None:
+        args.trips = args.vehicles
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = Path(tempfile.mkdtemp(prefix="fleet-bench-"))
+    processes = []
+    storage = "external"
+    try:
+        if args.base_url:
+            base_url = args.base_url
+            args.server_pid = None
+        else:
+            mongo_url = args.mongo_url
+            if args.storage == "mongo" and args.spawn_mongod:
+                mongod, mongo_url = start_mongod(workdir)
+                processes.append(mongod)
+            storage = args.storage
+            server, base_url = start_server(workdir, {
+                "STORAGE_BACKEND": args.storage,
+                "MONGO_URL": mongo_url,
+                "DB_NAME": f"fleet_bench_{uuid.uuid4().hex[:8]}"
+            })
+            processes.append(server)
+            args.server_pid = server.pid
+
+        results = asyncio.run(FleetBenchmark(base_url, args).run())
+    finally:
+        for proc in reversed(processes):
+            proc.stop()
+
+    report = {
+        "benchmark": "fleet_load",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": sys.version.split()[0],
+        "storage": storage,
+        "parameters": {
+            key: value for key, value in vars(args).items()
+            if key not in ("base_url", "output", "server_pid", "mongo_url")
+        },
+        "results": results
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
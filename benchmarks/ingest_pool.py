@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+GCE Campus Transportation System - IMEI-partitioned GPS ingest benchmark
+
+Runs the server's GPS fix handler (vehicle lookup, ordering, location
+update, trip statistics, fleet state and broadcast) on in-memory storage,
+first inline in this process and then behind an IngestPool of N worker
+processes, each holding the same simulated fleet. Every fix is for a
+different second, so all of them take the full live path. Reports fixes
+per second and the speedup over inline handling for each worker count:
+
+    python benchmarks/ingest_pool.py                                  # inline, then 1/2/4 workers
+    python benchmarks/ingest_pool.py --workers 1,2,4,8 --vehicles 500 --fixes-per-vehicle 40
+    python benchmarks/ingest_pool.py --output ingest.json
+
+Speedup is bounded by the cores available (reported as cpu_count) and by
+this process, which only hashes, batches and pickles fixes; with fewer
+cores than workers the numbers show the pool's overhead instead.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from pathlib import Path
+from typing import Dict, List
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ["GPS_INGEST_WORKERS"] = "0"
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "gce_campus_bench")
+
+import server  # noqa: E402
+from ingest_pool import IngestPool  # noqa: E402
+
+# Campus centre used to scatter simulated vehicles
+CAMPUS_LAT = 20.2961
+CAMPUS_LNG = 85.8245
+
+
+def imei_of(n: int) -> str:
+    return f"BENCH-{n:05d}"
+
+
+async def seed_fleet(vehicles: int):
+    now = datetime.now(timezone.utc).isoformat()
+    for n in range(vehicles):
+        lat, lng = CAMPUS_LAT + (n % 50) * 0.001, CAMPUS_LNG + (n // 50) * 0.001
+        await server.db.vehicles.insert_one({
+            "id": f"bench-{n}", "vehicle_number": f"BUS-{n}", "gps_imei": imei_of(n), "barcode": f"BC-{n}",
+            "vehicle_type": "bus", "assigned_to": None, "is_out_of_station": False,
+            "current_location": {"lat": lat, "lng": lng, "speed": 0, "timestamp": now},
+            "current_point": server.geo_point(lat, lng), "created_at": now
+        })
+
+
+async def bench_worker(vehicles: int):
+    """Ingest worker factory: the server's handler on this process's own copy of the fleet"""
+    logging.disable(logging.WARNING)
+    await seed_fleet(vehicles)
+    return await server.gps_shard_handler()
+
+
+def make_fixes(vehicles: int, per_vehicle: int) -> List[Dict]:
+    """Round-robin over the fleet, one second apart per vehicle, all in the past"""
+    start = datetime.now(timezone.utc) - timedelta(days=1)
+    fixes = []
+    for k in range(per_vehicle):
+        timestamp = (start + timedelta(seconds=k)).isoformat()
+        for n in range(vehicles):
+            fixes.append({
+                "imei": imei_of(n), "latitude": CAMPUS_LAT + (n % 50) * 0.001 + k * 0.0001,
+                "longitude": CAMPUS_LNG + (n // 50) * 0.001, "speed": 10 + (n + k) % 25,
+                "timestamp": timestamp, "sequence": k
+            })
+    return fixes
+
+
+async def run_inline(args: argparse.Namespace, fixes: List[Dict]) -> Dict:
+    server.create_app()
+    handle = await bench_worker(args.vehicles)
+    start = time.perf_counter()
+    statuses = [(await handle(fix))[1]["status"] for fix in fixes]
+    elapsed = time.perf_counter() - start
+    await server.sio.manager.close()
+    return result_row(0, fixes, statuses, elapsed)
+
+
+async def run_pool(workers: int, args: argparse.Namespace, fixes: List[Dict]) -> Dict:
+    pool = IngestPool(workers, partial(bench_worker, args.vehicles), batch_max=args.batch_max)
+    pool.start()
+    # Workers spawn and import the server first; one round-trip each before timing
+    await asyncio.gather(*(pool.submit(imei_of(n), {"imei": "warm-up", "latitude": 0, "longitude": 0, "speed": 0})
+                           for n in range(args.vehicles)))
+    start = time.perf_counter()
+    results = await asyncio.gather(*(pool.submit(fix["imei"], fix) for fix in fixes))
+    elapsed = time.perf_counter() - start
+    await pool.close()
+    return result_row(workers, fixes, [body["status"] for _, body in results], elapsed)
+
+
+def result_row(workers: int, fixes: List[Dict], statuses: List[str], elapsed: float) -> Dict:
+    return {
+        "workers": workers,
+        "fixes": len(fixes),
+        "live": statuses.count("live"),
+        "elapsed_s": round(elapsed, 3),
+        "fixes_per_s": round(len(fixes) / elapsed, 1)
+    }
+
+
+def print_report(rows: List[Dict]):
+    inline = rows[0]["fixes_per_s"]
+    print(f"cpu_count={os.cpu_count()}")
+    print(f"{'workers':>8}{'fixes/s':>10}{'speedup':>9}{'per worker':>12}{'live':>14}")
+    for row in rows:
+        speedup = row["fixes_per_s"] / inline
+        label = row["workers"] or "inline"
+        per_worker = f"{speedup / row['workers']:.2f}" if row["workers"] else "-"
+        print(f"{label:>8}{row['fixes_per_s']:>10.0f}{speedup:>8.2f}x{per_worker:>12}"
+              f"{row['live']:>7}/{row['fixes']}")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="GPS ingest inline vs. across IMEI-partitioned worker processes")
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts")
+    parser.add_argument("--vehicles", type=int, default=200)
+    parser.add_argument("--fixes-per-vehicle", type=int, default=25)
+    parser.add_argument("--batch-max", type=int, default=256, help="fixes per pipe message")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.disable(logging.WARNING)
+    fixes = make_fixes(args.vehicles, args.fixes_per_vehicle)
+    rows = [asyncio.run(run_inline(args, fixes))]
+    rows += [asyncio.run(run_pool(int(count), args, fixes)) for count in args.workers.split(",")]
+    for row in rows:
+        row["speedup"] = round(row["fixes_per_s"] / rows[0]["fixes_per_s"], 2)
+    print_report(rows)
+    if args.output:
+        report = {
+            "benchmark": "ingest_pool",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "cpu_count": os.cpu_count(),
+            "config": {key: value for key, value in vars(args).items() if key != "output"},
+            "results": rows
+        }
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+GCE Campus Transportation System - Micro-benchmarks for hot paths
+
+Times the computational hot spots in-process (no network, no MongoDB):
+pure helpers, token handling, Pydantic validation/serialization and the
+receive_gps_data / get_active_buses handlers running on MemoryStorage.
+
+    python benchmarks/micro.py                      # run and compare with the stored baseline
+    python benchmarks/micro.py --save-baseline      # record a new baseline
+    python benchmarks/micro.py --only gps --json out.json
+
+Each case is auto-calibrated to ~--target-ms per repeat; the reported figure
+is the best of --repeats runs in nanoseconds per operation.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "gce_campus_bench")
+
+import server  # noqa: E402
+from position_table import PositionTable  # noqa: E402
+from storage import MemoryStorage  # noqa: E402
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines" / "micro.json"
+
+# Changes within this band are reported as noise
+NOISE_PCT = 5.0
+
+
+# ============ CASES ============
+
+def sample_booking() -> Dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "student_registration_id": "REG2024001",
+        "student_name": "Asha",
+        "phone": "9000000001",
+        "place": "Hostel 3",
+        "place_details": "Room 214",
+        "user_location": {"lat": 20.2961, "lng": 85.8245},
+        "status": "accepted",
+        "otp": "123456",
+        "driver_id": str(uuid.uuid4()),
+        "driver_name": "Ravi",
+        "vehicle_id": str(uuid.uuid4()),
+        "vehicle_number": "OD-02-AMB-1",
+        "eta_minutes": 4.5,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+
+
+def sample_vehicle() -> Dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "vehicle_number": "OD-02-BUS-7",
+        "gps_imei": "356938035643809",
+        "barcode": "BC-7",
+        "vehicle_type": "bus",
+        "assigned_to": str(uuid.uuid4()),
+        "assigned_driver_name": "Ravi",
+        "is_out_of_station": False,
+        "current_location": {"lat": 20.2961, "lng": 85.8245, "speed": 32.0,
+                             "timestamp": datetime.now(timezone.utc).isoformat()},
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+
+
+async def seed_fleet(buses: int) -> List[str]:
+    """Bind a fresh MemoryStorage and create buses with drivers and active trips"""
+    server.create_app(MemoryStorage())
+    imeis = []
+    for index in range(buses):
+        driver_id = str(uuid.uuid4())
+        vehicle = sample_vehicle()
+        vehicle.update({
+            "gps_imei": f"IMEI{index:06d}",
+            "vehicle_number": f"OD-02-BUS-{index}",
+            "assigned_to": driver_id
+        })
+        await server.db.users.insert_one({
+            "id": driver_id, "name": f"Driver {index}", "phone": f"90000{index:05d}",
+            "role": "driver", "driver_type": "bus", "created_at": vehicle["created_at"]
+        })
+        await server.db.vehicles.insert_one(vehicle)
+        await server.db.trips.insert_one({
+            "id": str(uuid.uuid4()), "vehicle_id": vehicle["id"], "vehicle_number": vehicle["vehicle_number"],
+            "driver_id": driver_id, "driver_name": f"Driver {index}", "vehicle_type": "bus",
+            "start_time": vehicle["created_at"], "end_time": None, "is_active": True
+        })
+        imeis.append(vehicle["gps_imei"])
+    return imeis
+
+
+def build_cases(loop: asyncio.AbstractEventLoop) -> Dict[str, Callable[[int], None]]:
+    """Each case runs its operation `n` times"""
+    token = server.create_token(str(uuid.uuid4()), "student")
+    gps_payload = {"imei": "IMEI000000", "latitude": 20.2961, "longitude": 85.8245,
+                   "speed": 32.5, "timestamp": "2026-01-01T10:00:00+00:00"}
+    booking = sample_booking()
+    vehicle = sample_vehicle()
+    booking_model = server.BookingResponse(**booking)
+    vehicle_model = server.VehicleResponse(**vehicle)
+
+    def calculate_distance(n):
+        fn = server.calculate_distance
+        for _ in range(n):
+            fn(20.2961, 85.8245, 20.3012, 85.8199)
+
+    def calculate_eta(n):
+        fn = server.calculate_eta
+        for _ in range(n):
+            fn(1.25, 40)
+
+    def create_token(n):
+        for _ in range(n):
+            server.create_token("user-id", "driver")
+
+    def decode_token(n):
+        for _ in range(n):
+            server.decode_token(token)
+
+    def gps_input_validation(n):
+        validate = server.GPSDataInput.model_validate
+        for _ in range(n):
+            validate(gps_payload)
+
+    def booking_response_serialization(n):
+        for _ in range(n):
+            server.BookingResponse(**booking).model_dump()
+
+    def booking_response_json(n):
+        for _ in range(n):
+            booking_model.model_dump_json()
+
+    def vehicle_response_serialization(n):
+        for _ in range(n):
+            server.VehicleResponse(**vehicle).model_dump()
+
+    def vehicle_response_json(n):
+        for _ in range(n):
+            vehicle_model.model_dump_json()
+
+    imeis = loop.run_until_complete(seed_fleet(20))
+
+    def receive_gps_data(n):
+        async def run():
+            for index in range(n):
+                await server.receive_gps_data(server.GPSDataInput(
+                    imei=imeis[index % len(imeis)], latitude=20.2961, longitude=85.8245, speed=32.5
+                ))
+        loop.run_until_complete(run())
+
+    def get_active_buses(n):
+        async def run():
+            for _ in range(n):
+                await server.get_active_buses()
+        loop.run_until_complete(run())
+
+    # One process writes the shared position table, the case reads it like any other worker
+    table_path = str(Path(tempfile.mkdtemp()) / "positions")
+    writer = PositionTable(table_path, 1024)
+    writer.open()
+    writer.claim()
+    vehicle_ids = [str(uuid.uuid4()) for _ in range(1000)]
+    writer.rebuild((vehicle_id, 20.2961, 85.8245, 32.5, time.time(), "live") for vehicle_id in vehicle_ids)
+    reader = PositionTable(table_path, 1024)
+    reader.open()
+
+    def position_table_get(n):
+        get = reader.get
+        for index in range(n):
+            get(vehicle_ids[index % 1000])
+
+    return {
+        "calculate_distance": calculate_distance,
+        "calculate_eta": calculate_eta,
+        "create_token": create_token,
+        "decode_token": decode_token,
+        "gps_input_validation": gps_input_validation,
+        "booking_response_serialization": booking_response_serialization,
+        "booking_response_json": booking_response_json,
+        "vehicle_response_serialization": vehicle_response_serialization,
+        "vehicle_response_json": vehicle_response_json,
+        "handler_receive_gps_data": receive_gps_data,
+        "handler_get_active_buses": get_active_buses,
+        "position_table_get": position_table_get
+    }
+
+
+# ============ RUNNER ============
+
+def measure(case: Callable[[int], None], target_s: float, repeats: int) -> Dict:
+    """Calibrate iterations to ~target_s, then keep the best of `repeats` runs"""
+    iterations = 1
+    while True:
+        start = time.perf_counter()
+        case(iterations)
+        elapsed = time.perf_counter() - start
+        if elapsed >= target_s / 4 or iterations >= 10_000_000:
+            break
+        iterations *= 4 if elapsed < target_s / 40 else 2
+    iterations = max(1, int(iterations * target_s / max(elapsed, 1e-9)))
+
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        case(iterations)
+        timings.append((time.perf_counter() - start) / iterations * 1e9)
+    timings.sort()
+    return {
+        "ns_per_op": round(timings[0], 1),
+        "median_ns_per_op": round(timings[len(timings) // 2], 1),
+        "iterations": iterations,
+        "repeats": repeats
+    }
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict]) -> List[Dict]:
+    rows = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        row = {"case": name, "ns_per_op": result["ns_per_op"], "baseline_ns_per_op": None,
+               "change_pct": None, "verdict": "new"}
+        if base:
+            change = (result["ns_per_op"] - base["ns_per_op"]) / base["ns_per_op"] * 100
+            row.update({
+                "baseline_ns_per_op": base["ns_per_op"],
+                "change_pct": round(change, 1),
+                "verdict": "same" if abs(change) <= NOISE_PCT else ("slower" if change > 0 else "faster")
+            })
+        rows.append(row)
+    return rows
+
+
+def print_report(rows: List[Dict]):
+    print(f"{'case':<34}{'baseline ns/op':>16}{'current ns/op':>16}{'change':>10}  verdict")
+    for row in rows:
+        baseline = f"{row['baseline_ns_per_op']:.1f}" if row["baseline_ns_per_op"] is not None else "-"
+        change = f"{row['change_pct']:+.1f}%" if row["change_pct"] is not None else "-"
+        print(f"{row['case']:<34}{baseline:>16}{row['ns_per_op']:>16.1f}{change:>10}  {row['verdict']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for backend hot paths")
+    parser.add_argument("--only", help="run cases whose name contains this substring")
+    parser.add_argument("--target-ms", type=float, default=200.0, help="time per repeat")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    parser.add_argument("--save-baseline", action="store_true", help="overwrite the baseline with this run")
+    parser.add_argument("--json", help="write results and comparison as JSON to this file")
+    parser.add_argument("--fail-on-regression", type=float, metavar="PCT",
+                        help="exit 1 if any case is slower than baseline by more than PCT percent")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.WARNING)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    cases = build_cases(loop)
+    if args.only:
+        cases = {name: case for name, case in cases.items() if args.only in name}
+
+    results = {name: measure(case, args.target_ms / 1000, args.repeats) for name, case in cases.items()}
+    loop.close()
+
+    baseline_path = Path(args.baseline)
+    baseline = json.loads(baseline_path.read_text())["results"] if baseline_path.exists() else {}
+    rows = compare(results, baseline)
+    print_report(rows)
+
+    report = {
+        "benchmark": "micro",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results
+    }
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"Baseline written to {baseline_path}")
+    if args.json:
+        Path(args.json).write_text(json.dumps({**report, "comparison": rows}, indent=2) + "\n")
+
+    if args.fail_on_regression is not None and any(
+        row["change_pct"] is not None and row["change_pct"] > args.fail_on_regression for row in rows
+    ):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+GCE Campus Transportation System - Socket.IO multi-worker fan-out benchmark
+
+Runs N Socket.IO servers ("workers") in one process, each with its own client
+manager connected to a shared broker and C fake clients in the same room,
+then emits vehicle_location events round-robin from every worker. Reports
+delivery lag (emit to hand-off to the client's transport) for local and
+cross-worker deliveries, delivered frames per second and broker publishes
+per emit and frames coalesced in client outboxes, for each worker count:
+
+    python benchmarks/socket_fanout.py                                  # in-process broker, 1/2/4/8 workers
+    python benchmarks/socket_fanout.py --batch-window-ms 0              # one publish per emit, for comparison
+    python benchmarks/socket_fanout.py --queue redis://localhost:6379/0 --output fanout.json
+    python benchmarks/socket_fanout.py --queue mongodb://localhost:27017 --db-name fanout_bench
+
+All workers share one event loop and CPU core, so the numbers compare
+manager and batching overhead across worker counts rather than showing
+multi-core scaling.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import socketio
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+
+from socket_managers import BatchedRedisManager, MemoryBroker, MemoryPubSubManager, MongoPubSubManager  # noqa: E402
+
+ROOM = "map"
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples: List[float]) -> Dict:
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3) if ordered else None,
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3) if ordered else None,
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else None
+    }
+
+
+class Worker:
+    """One server with its manager and fake clients that timestamp deliveries"""
+
+    def __init__(self, index: int, manager, clients: int, local_lags: List[float], remote_lags: List[float]):
+        self.index = index
+        self.manager = manager
+        self.sio = socketio.AsyncServer(async_mode='asgi', client_manager=manager)
+        self.sio._send_eio_packet = self.deliver
+        self.sio.manager_initialized = True
+        self.clients = clients
+        self.local_lags = local_lags
+        self.remote_lags = remote_lags
+        self.delivered = 0
+
+    async def start(self):
+        self.manager.initialize()
+        for n in range(self.clients):
+            eio_sid = f"w{self.index}-c{n}"
+            sid = await self.manager.connect(eio_sid, '/')
+            await self.manager.enter_room(sid, '/', ROOM, eio_sid=eio_sid)
+
+    def dropped(self) -> int:
+        return sum(outbox.dropped for outbox in self.manager.outboxes.values())
+
+    async def deliver(self, eio_sid, packet):
+        now = time.perf_counter()
+        _, data = json.loads(packet.data[1:])
+        (self.local_lags if data["worker"] == self.index else self.remote_lags).append(now - data["sent"])
+        self.delivered += 1
+
+
+def make_manager(args: argparse.Namespace, broker: MemoryBroker, channel: str):
+    window = args.batch_window_ms / 1000
+    if args.queue == "memory":
+        return MemoryPubSubManager(broker, channel=channel, batch_window_s=window)
+    if args.queue.startswith(("mongodb://", "mongodb+srv://")):
+        return MongoPubSubManager(args.queue, args.db_name, channel=channel, batch_window_s=window)
+    return BatchedRedisManager(args.queue, channel=channel, batch_window_s=window)
+
+
+async def run_workers(count: int, args: argparse.Namespace) -> Dict:
+    broker = MemoryBroker()
+    channel = f"fanout-bench-{uuid.uuid4().hex[:8]}"
+    local_lags, remote_lags = [], []
+    workers = [Worker(index, make_manager(args, broker, channel), args.clients_per_worker, local_lags, remote_lags)
+               for index in range(count)]
+    for worker in workers:
+        await worker.start()
+    await asyncio.sleep(args.settle_s)  # let subscribers attach before publishing
+
+    expected = args.emits * count * args.clients_per_worker
+    interval = 1 / args.rate if args.rate else 0
+    start = time.perf_counter()
+    for n in range(args.emits):
+        worker = workers[n % count]
+        await worker.sio.emit("vehicle_location", {"vehicle_id": f"v{n % 200}", "worker": worker.index,
+                                                   "sent": time.perf_counter()}, room=ROOM)
+        if interval:
+            delay = start + (n + 1) * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif n % 100 == 99:
+            await asyncio.sleep(0)
+    # Every frame is either delivered or replaced by a newer position in its client's outbox
+    settled = lambda: sum(worker.delivered + worker.dropped() for worker in workers)
+    deadline = time.perf_counter() + args.timeout_s
+    while settled() < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - start
+
+    delivered = sum(worker.delivered for worker in workers)
+    dropped = sum(worker.dropped() for worker in workers)
+    published = sum(getattr(worker.manager, "published_batches", 0) for worker in workers)
+    for worker in workers:
+        await worker.manager.close()
+    return {
+        "workers": count,
+        "emits": args.emits,
+        "delivered": delivered,
+        "coalesced": dropped,
+        "expected": expected,
+        "elapsed_s": round(elapsed, 3),
+        "emits_per_s": round(args.emits / elapsed, 1),
+        "frames_per_s": round(delivered / elapsed, 1),
+        "broker_publishes": published,
+        "publishes_per_emit": round(published / args.emits, 3),
+        "local_lag": summarize(local_lags),
+        "remote_lag": summarize(remote_lags)
+    }
+
+
+def print_report(rows: List[Dict]):
+    print(f"{'workers':>7}{'emits/s':>10}{'frames/s':>11}{'pub/emit':>10}"
+          f"{'local p50':>11}{'remote p50':>12}{'remote p99':>12}{'coalesced':>11}{'delivered':>12}")
+    for row in rows:
+        remote = row["remote_lag"]
+        fmt = lambda value: f"{value:.2f}ms" if value is not None else "-"
+        print(f"{row['workers']:>7}{row['emits_per_s']:>10.0f}{row['frames_per_s']:>11.0f}"
+              f"{row['publishes_per_emit']:>10.3f}{fmt(row['local_lag']['p50_ms']):>11}"
+              f"{fmt(remote['p50_ms']):>12}{fmt(remote['p99_ms']):>12}{row['coalesced']:>11}"
+              f"{row['delivered']:>7}/{row['expected']}")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Socket.IO fan-out across workers through a message queue")
+    parser.add_argument("--workers", default="1,2,4,8", help="comma-separated worker counts")
+    parser.add_argument("--clients-per-worker", type=int, default=50)
+    parser.add_argument("--emits", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=1000.0, help="emits per second across all workers; 0 = flat out")
+    parser.add_argument("--batch-window-ms", type=float, default=2.0, help="0 publishes every message on its own")
+    parser.add_argument("--queue", default="memory", help='"memory", a redis:// / valkey:// URL or a mongodb:// URL')
+    parser.add_argument("--db-name", default="gce_campus_bench", help="database for the mongodb:// queue")
+    parser.add_argument("--settle-s", type=float, default=0.2)
+    parser.add_argument("--timeout-s", type=float, default=30.0)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.disable(logging.WARNING)
+    rows = [asyncio.run(run_workers(int(count), args)) for count in args.workers.split(",")]
+    print_report(rows)
+    if args.output:
+        report = {
+            "benchmark": "socket_fanout",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "config": {key: value for key, value in vars(args).items() if key != "output"},
+            "results": rows
+        }
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
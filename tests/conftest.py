@@ -0,0 +1,42 @@
+import os
+import sys
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import httpx
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+# Run the API against the in-memory storage backend; never touch MongoDB
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "gce_campus_test")
+
+import server  # noqa: E402
+from storage import MemoryStorage  # noqa: E402
+
+
+@asynccontextmanager
+async def running_app(storage=None):
+    """A fresh app on its own MemoryStorage with lifespan (admin seed) applied"""
+    application = server.create_app(storage or MemoryStorage())
+    async with application.router.lifespan_context(application):
+        transport = httpx.ASGITransport(app=application)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            yield client
+
+
+@pytest.fixture
+def app_client():
+    return running_app
+
+
+async def admin_token(client) -> str:
+    response = await client.post("/api/auth/login", json={"email": "admin@gceits.com", "password": "Admin@12345"})
+    return response.json()["access_token"]
+
+
+def auth(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
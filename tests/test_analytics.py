@@ -0,0 +1,100 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import server
+from tests.conftest import admin_token, auth, running_app
+
+
+async def create_bus_driver(number: int) -> str:
+    driver_id = f"driver-{number}"
+    await server.db.users.insert_one({
+        "id": driver_id, "name": f"Driver {number}", "phone": f"80000{number:05d}",
+        "role": "driver", "driver_type": "bus", "created_at": "2026-01-01T00:00:00+00:00"
+    })
+    await server.db.vehicles.insert_one({
+        "id": f"bus-{number}", "vehicle_number": f"BUS-{number}", "gps_imei": f"BUS-IMEI-{number}",
+        "barcode": f"BUS-BC-{number}", "vehicle_type": "bus", "assigned_to": driver_id,
+        "assigned_driver_name": f"Driver {number}", "is_out_of_station": False,
+        "current_location": None, "created_at": "2026-01-01T00:00:00+00:00"
+    })
+    return server.create_token(driver_id, "driver")
+
+
+async def drive(client, number: int, speeds):
+    """Run one trip heading north 0.01 degrees (about 1.1 km) per fix"""
+    headers = auth(await create_bus_driver(number))
+    trip = (await client.post("/api/driver/start-trip", headers=headers, json={"vehicle_id": f"bus-{number}"})).json()
+    for step, speed in enumerate(speeds):
+        await client.post("/api/gps/receive", json={
+            "imei": f"BUS-IMEI-{number}", "latitude": 20.30 + step * 0.01, "longitude": 85.82, "speed": speed
+        })
+    await client.post(f"/api/driver/end-trip/{trip['id']}", headers=headers)
+    return trip["id"]
+
+
+def snapshot(rows):
+    return sorted((row["id"], row.get("count"), row.get("max_speed"), row.get("trips"),
+                   round(row.get("duration_s", 0), 1), round(row.get("distance_km", 0), 3)) for row in rows)
+
+
+def test_rollups_track_offences_and_trips_and_rebuild_matches():
+    async def scenario():
+        async with running_app() as client:
+            headers = auth(await admin_token(client))
+            for gate, name in (("GATE-1", "Main gate"), ("GATE-2", "Library")):
+                await client.post("/api/admin/rfid-devices", headers=headers,
+                                  json={"rfid_id": gate, "location_name": name})
+            await client.post("/api/admin/rfid-sections", headers=headers,
+                              json={"from_rfid": "GATE-1", "to_rfid": "GATE-2", "distance_m": 500})
+
+            trip_id = await drive(client, 1, [30, 55, 62, 20])
+            await drive(client, 2, [45, 30])
+            # 500 m in 36 s (50 km/h), then back in 30 s (60 km/h)
+            start = datetime.now(timezone.utc) - timedelta(seconds=70)
+            for gate, offset in (("GATE-1", 0), ("GATE-2", 36), ("GATE-1", 66)):
+                await client.post("/api/rfid/scan", json={
+                    "rfid_device_id": gate, "student_registration_id": "REG7", "student_name": "Asha",
+                    "phone": "9000000007", "timestamp": (start + timedelta(seconds=offset)).isoformat()
+                })
+
+            trip = await server.db.trips.find_one({"id": trip_id})
+            assert 3.2 < trip["distance_km"] < 3.4
+            assert trip["duration_s"] >= 0
+
+            response = await client.get("/api/admin/analytics/offences", headers=headers)
+            body = response.json()
+            assert body["period"] == "month"
+            assert body["bucket"] == datetime.now(timezone.utc).strftime("%Y-%m")
+            assert [(row["label"], row["count"], row["max_speed"]) for row in body["rows"]] == \
+                [("Driver 1", 2, 62), ("Driver 2", 1, 45)]
+
+            response = await client.get("/api/admin/analytics/offences", headers=headers,
+                                        params={"dimension": "student", "period": "day"})
+            assert [(row["key"], row["count"], row["max_speed"]) for row in response.json()["rows"]] == \
+                [("REG7", 2, 60)]
+
+            response = await client.get("/api/admin/analytics/trips", headers=headers)
+            rows = {row["label"]: row for row in response.json()["rows"]}
+            assert rows["BUS-1"]["trips"] == 1
+            assert 3.2 < rows["BUS-1"]["distance_km"] < 3.4
+            assert 1.0 < rows["BUS-2"]["distance_km"] < 1.2
+            assert "trip_hours" in rows["BUS-1"]
+
+            response = await client.get("/api/admin/analytics/trips", headers=headers,
+                                        params={"period": "month", "bucket": "2026-1"})
+            assert response.status_code == 400
+
+            incremental = (
+                snapshot(await server.db.offence_rollups.find({}, {"_id": 0}).to_list(None)),
+                snapshot(await server.db.trip_rollups.find({}, {"_id": 0}).to_list(None))
+            )
+            response = await client.post("/api/admin/analytics/rebuild", headers=headers)
+            assert response.json()["rebuilt"] == {"offence_rollups": len(incremental[0]),
+                                                  "trip_rollups": len(incremental[1])}
+            rebuilt = (
+                snapshot(await server.db.offence_rollups.find({}, {"_id": 0}).to_list(None)),
+                snapshot(await server.db.trip_rollups.find({}, {"_id": 0}).to_list(None))
+            )
+            assert rebuilt == incremental
+
+    asyncio.run(scenario())
@@ -0,0 +1,77 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+import server
+from tests.conftest import admin_token, auth, running_app
+
+
+def days_ago(days: int) -> str:
+    return (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+
+
+async def seed():
+    for n, (status, age) in enumerate([
+        ("completed", 90), ("cancelled", 60), ("completed", 45), ("pending", 90), ("completed", 2)
+    ]):
+        await server.db.bookings.insert_one({
+            "id": f"b{n}", "student_registration_id": "REG1", "phone": "9000000001", "place": "hostel",
+            "user_location": {"lat": 20.3, "lng": 85.8}, "status": status, "created_at": days_ago(age)
+        })
+    for n, (active, age) in enumerate([(False, 50), (False, 40), (True, 40), (False, 1)]):
+        await server.db.trips.insert_one({
+            "id": f"t{n}", "vehicle_id": "v1", "vehicle_number": "BUS-1", "driver_id": "d1", "driver_name": "D",
+            "vehicle_type": "bus", "start_time": days_ago(age + 1),
+            "end_time": None if active else days_ago(age), "is_active": active
+        })
+    for n, (paid, age) in enumerate([(True, 100), (False, 100), (True, 3)]):
+        await server.db.offences.insert_one({
+            "id": f"o{n}", "offence_type": "bus_overspeed", "vehicle_number": "BUS-1",
+            "speed": 50, "speed_limit": 40, "timestamp": days_ago(age), "is_paid": paid
+        })
+
+
+def test_archival_moves_finished_documents_and_history_reads_both_tiers(monkeypatch):
+    monkeypatch.setattr(server, "ARCHIVE_BATCH_SIZE", 2)
+
+    async def scenario():
+        async with running_app() as client:
+            await seed()
+            headers = auth(await admin_token(client))
+            before = (await client.get("/api/admin/stats", headers=headers)).json()
+
+            response = await client.post("/api/admin/archive/run", headers=headers)
+            assert response.json()["archived"] == {"bookings": 3, "trips": 2, "offences": 1}
+            assert sorted(d["id"] for d in await server.db.bookings.find({}).to_list(None)) == ["b3", "b4"]
+            assert sorted(d["id"] for d in await server.db.trips.find({}).to_list(None)) == ["t2", "t3"]
+            assert sorted(d["id"] for d in await server.db.offences.find({}).to_list(None)) == ["o1", "o2"]
+            # Idempotent: nothing left to move
+            assert (await client.post("/api/admin/archive/run", headers=headers)).json()["archived"] == \
+                {"bookings": 0, "trips": 0, "offences": 0}
+
+            bookings = (await client.get("/api/admin/bookings", headers=headers)).json()["bookings"]
+            assert [b["id"] for b in bookings] == ["b4", "b2", "b1", "b3", "b0"]
+            pending = (await client.get("/api/admin/bookings", params={"status": "pending"}, headers=headers)).json()
+            assert [b["id"] for b in pending["bookings"]] == ["b3"]
+            assert (await client.get("/api/public/booking/b0")).json()["status"] == "completed"
+
+            trips = (await client.get("/api/admin/trips", headers=headers)).json()["trips"]
+            assert [t["id"] for t in trips] == ["t3", "t2", "t1", "t0"]
+            offences = (await client.get("/api/admin/offences", headers=headers)).json()["offences"]
+            assert {o["id"] for o in offences} == {"o0", "o1", "o2"}
+
+            # Export streams both tiers in time order
+            response = await client.get("/api/admin/export/trips", params={"format": "ndjson"}, headers=headers)
+            rows = [json.loads(line) for line in response.text.splitlines()]
+            assert [row["id"] for row in rows] == ["t0", "t1", "t2", "t3"]
+
+            # Counters see archived offences too
+            await server.reconcile_stats()
+            after = (await client.get("/api/admin/stats", headers=headers)).json()
+            assert after["total_offences"] == before["total_offences"] == 3
+            assert after["unpaid_offences"] == 1
+
+            assert (await client.delete("/api/admin/offences/o0", headers=headers)).status_code == 200
+            assert await server.db.offences_archive.count_documents({}) == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,204 @@
+import asyncio
+import inspect
+import uuid
+from datetime import datetime, timezone
+
+import server
+from storage import MemoryStorage
+from tests.conftest import admin_token, auth, running_app
+
+
+class InterleavingStorage(MemoryStorage):
+    """MemoryStorage that yields to the event loop before every operation
+
+    Forces concurrent requests to interleave between round trips the way
+    they would against a real database.
+    """
+
+    def __getattr__(self, name):
+        collection = super().__getattr__(name)
+        return _YieldingCollection(collection)
+
+
+class _YieldingCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not inspect.iscoroutinefunction(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            await asyncio.sleep(0)
+            return await attr(*args, **kwargs)
+        return call
+
+
+async def create_driver_with_ambulance(index: int) -> str:
+    """Insert a driver and an assigned ambulance directly, returning the driver's token"""
+    now = datetime.now(timezone.utc).isoformat()
+    driver_id = str(uuid.uuid4())
+    await server.db.users.insert_one({
+        "id": driver_id, "name": f"Driver {index}", "phone": f"70000{index:05d}",
+        "role": "driver", "driver_type": "ambulance", "created_at": now
+    })
+    await server.db.vehicles.insert_one({
+        "id": str(uuid.uuid4()), "vehicle_number": f"AMB-{index}", "gps_imei": f"AMB-IMEI-{index}",
+        "barcode": f"AMB-BC-{index}", "vehicle_type": "ambulance", "assigned_to": driver_id,
+        "assigned_driver_name": f"Driver {index}", "is_out_of_station": False,
+        "current_location": {"lat": 20.29, "lng": 85.82, "speed": 0, "timestamp": now},
+        "created_at": now
+    })
+    return server.create_token(driver_id, "driver")
+
+
+async def book(client) -> dict:
+    signup = await client.post("/api/auth/signup", json={
+        "name": "Student", "phone": "9000000001", "password": "pw", "registration_id": "REG1"
+    })
+    response = await client.post("/api/public/ambulance/book", headers=auth(signup.json()["access_token"]), json={
+        "student_registration_id": "REG1", "phone": "9000000001", "place": "hostel",
+        "user_location": {"lat": 20.30, "lng": 85.83}
+    })
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_fifty_simultaneous_accepts_have_exactly_one_winner():
+    async def scenario():
+        async with running_app(InterleavingStorage()) as client:
+            booking = await book(client)
+            tokens = [await create_driver_with_ambulance(index) for index in range(50)]
+
+            responses = await asyncio.gather(*[
+                client.post(f"/api/driver/accept-booking/{booking['id']}", headers=auth(token))
+                for token in tokens
+            ])
+
+            winners = [response for response in responses if response.status_code == 200]
+            assert len(winners) == 1
+            assert all(r.status_code == 400 for r in responses if r.status_code != 200)
+
+            stored = await server.db.bookings.find_one({"id": booking["id"]}, {"_id": 0})
+            assert stored["status"] == "accepted"
+            assert stored["driver_id"] == winners[0].json()["booking"]["driver_id"]
+            assert stored["eta_minutes"] is not None
+
+            stats = (await client.get("/api/admin/stats", headers=auth(await admin_token(client)))).json()
+            assert stats["pending_bookings"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_booking_follows_state_machine():
+    async def scenario():
+        async with running_app() as client:
+            booking = await book(client)
+            driver = auth(await create_driver_with_ambulance(1))
+            other = auth(await create_driver_with_ambulance(2))
+
+            accepted = await client.post(f"/api/driver/accept-booking/{booking['id']}", headers=driver)
+            otp = accepted.json()["otp"]
+
+            # Ride cannot complete before the OTP starts it
+            response = await client.post(f"/api/driver/complete-booking/{booking['id']}", headers=driver)
+            assert response.status_code == 400
+
+            response = await client.post("/api/driver/verify-otp", headers=other,
+                                         json={"booking_id": booking["id"], "otp": otp})
+            assert response.status_code == 403
+
+            response = await client.post("/api/driver/verify-otp", headers=driver,
+                                         json={"booking_id": booking["id"], "otp": "000000" if otp != "000000" else "111111"})
+            assert response.status_code == 400
+            assert response.json()["detail"] == "Invalid OTP"
+
+            response = await client.post("/api/driver/verify-otp", headers=driver,
+                                         json={"booking_id": booking["id"], "otp": otp})
+            assert response.status_code == 200
+
+            response = await client.post(f"/api/driver/complete-booking/{booking['id']}", headers=driver)
+            assert response.status_code == 200
+
+            # Terminal state: neither abort nor a second accept may change it
+            response = await client.post(f"/api/driver/abort-booking/{booking['id']}", headers=driver)
+            assert response.status_code == 400
+            response = await client.post(f"/api/driver/accept-booking/{booking['id']}", headers=other)
+            assert response.status_code == 400
+
+            response = await client.post("/api/driver/abort-booking/missing", headers=driver)
+            assert response.status_code == 404
+
+            stored = await server.db.bookings.find_one({"id": booking["id"]})
+            assert stored["status"] == "completed"
+
+    asyncio.run(scenario())
+
+
+class CountingStorage(MemoryStorage):
+    """MemoryStorage recording the filter of every booking write"""
+
+    def __init__(self):
+        super().__init__()
+        self.booking_writes = []
+
+    def __getattr__(self, name):
+        collection = super().__getattr__(name)
+        if name != "bookings":
+            return collection
+        return _CountingCollection(collection, self.booking_writes)
+
+
+class _CountingCollection:
+    def __init__(self, collection, writes):
+        self._collection = collection
+        self._writes = writes
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in ("update_one", "update_many", "find_one_and_update"):
+            return attr
+
+        async def call(*args, **kwargs):
+            self._writes.append(name)
+            return await attr(*args, **kwargs)
+        return call
+
+
+def test_accept_stores_eta_in_the_same_update():
+    async def scenario():
+        storage = CountingStorage()
+        async with running_app(storage) as client:
+            booking = await book(client)
+            driver = auth(await create_driver_with_ambulance(1))
+
+            storage.booking_writes.clear()
+            accepted = await client.post(f"/api/driver/accept-booking/{booking['id']}", headers=driver)
+            assert accepted.status_code == 200
+            assert storage.booking_writes == ["find_one_and_update"]
+
+            eta = accepted.json()["booking"]["eta_minutes"]
+            assert eta is not None and eta > 0
+            stored = await server.db.bookings.find_one({"id": booking["id"]})
+            assert stored["eta_minutes"] == eta
+
+    asyncio.run(scenario())
+
+
+def test_driver_can_abort_mid_ride():
+    async def scenario():
+        async with running_app() as client:
+            booking = await book(client)
+            driver = auth(await create_driver_with_ambulance(1))
+            otp = (await client.post(f"/api/driver/accept-booking/{booking['id']}", headers=driver)).json()["otp"]
+            response = await client.post("/api/driver/verify-otp", headers=driver,
+                                         json={"booking_id": booking["id"], "otp": otp})
+            assert response.status_code == 200
+
+            response = await client.post(f"/api/driver/abort-booking/{booking['id']}", headers=driver)
+            assert response.status_code == 200
+            stored = await server.db.bookings.find_one({"id": booking["id"]})
+            assert stored["status"] == "cancelled"
+
+    asyncio.run(scenario())
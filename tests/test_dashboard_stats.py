@@ -0,0 +1,83 @@
+import asyncio
+
+import server
+from tests.conftest import admin_token, auth, running_app
+
+
+async def stats(client, headers) -> dict:
+    return (await client.get("/api/admin/stats", headers=headers)).json()
+
+
+async def signup(client, name: str, phone: str, **fields) -> dict:
+    response = await client.post("/api/auth/signup", json={"name": name, "phone": phone, "password": "pw", **fields})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_write_paths_move_the_counters_and_mark_paid_is_idempotent():
+    async def scenario():
+        async with running_app() as client:
+            admin = auth(await admin_token(client))
+            student = await signup(client, "Student", "9000000001", registration_id="REG1")
+            driver = await signup(client, "Driver", "8000000001", role="driver", driver_type="bus")
+            bus = (await client.post("/api/admin/vehicles", headers=admin, json={
+                "vehicle_number": "OD-02-1234", "gps_imei": "IMEI-1", "barcode": "BC-1", "vehicle_type": "bus"
+            })).json()
+            response = await client.post(f"/api/driver/assign-vehicle/{bus['id']}", headers=auth(driver["access_token"]))
+            assert response.status_code == 200
+
+            response = await client.post("/api/gps/receive", json={
+                "imei": "IMEI-1", "latitude": 20.29, "longitude": 85.82, "speed": server.CAMPUS_SPEED_LIMIT + 20
+            })
+            assert response.status_code == 200
+
+            assert await stats(client, admin) == {
+                "total_students": 1, "total_drivers": 1, "total_buses": 1, "total_ambulances": 0,
+                "active_trips": 0, "pending_bookings": 0, "total_offences": 1, "unpaid_offences": 1
+            }
+
+            offence = await server.db.offences.find_one({"vehicle_id": bus["id"]})
+            response = await client.patch(f"/api/admin/offences/{offence['id']}/mark-paid", headers=admin)
+            assert response.status_code == 200
+            assert (await stats(client, admin))["unpaid_offences"] == 0
+
+            # A retried request succeeds without moving the counter again
+            response = await client.patch(f"/api/admin/offences/{offence['id']}/mark-paid", headers=admin)
+            assert response.status_code == 200
+            assert response.json()["message"] == "Offence already marked as paid"
+            assert (await stats(client, admin))["unpaid_offences"] == 0
+            response = await client.patch("/api/admin/offences/missing/mark-paid", headers=admin)
+            assert response.status_code == 404
+
+            response = await client.delete(f"/api/admin/students/{student['user']['id']}", headers=admin)
+            assert response.status_code == 200
+            counters = await stats(client, admin)
+            assert counters["total_students"] == 0 and counters["total_offences"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_reconcile_corrects_drifted_counters():
+    async def scenario():
+        async with running_app() as client:
+            admin = auth(await admin_token(client))
+            await signup(client, "Student", "9000000001", registration_id="REG1")
+            await signup(client, "Student 2", "9000000002", registration_id="REG2")
+            await client.post("/api/admin/vehicles", headers=admin, json={
+                "vehicle_number": "AMB-1", "gps_imei": "IMEI-A", "barcode": "BC-A", "vehicle_type": "ambulance"
+            })
+            expected = await stats(client, admin)
+            assert expected["total_students"] == 2 and expected["total_ambulances"] == 1
+
+            # Lost increments, e.g. a worker dying between the write and its $inc
+            await server.db.stats.update_one({"id": server.STATS_DOC_ID},
+                                             {"$set": {"total_students": 7, "total_ambulances": 0}})
+            assert (await stats(client, admin))["total_students"] == 7
+
+            counts = await server.reconcile_stats()
+            assert counts["total_students"] == 2
+            assert await stats(client, admin) == expected
+            doc = await server.db.stats.find_one({"id": server.STATS_DOC_ID})
+            assert doc["reconciled_at"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,409 @@
+import asyncio
+import gc
+import random
+import time
+
+import server
+from dispatch import DispatchEngine, GridIndex, haversine_km
+from owner_lock import OwnerLock
+from tests.conftest import admin_token, auth, running_app
+from tests.test_booking_transitions import book, create_driver_with_ambulance
+
+CAMPUS = (20.2961, 85.8245)
+
+
+def make_engine(timeout: float = 20.0) -> DispatchEngine:
+    engine = DispatchEngine(eta_minutes=lambda km: km / 60 * 60, offer_timeout_s=timeout)
+    engine.offered = []
+    engine.on_offer = engine.offered.append
+    return engine
+
+
+def add_ambulance(engine: DispatchEngine, name: str, lat: float, lng: float):
+    engine.set_available(name, name.upper(), f"driver-{name}", name, lat, lng)
+
+
+def test_grid_nearest_matches_brute_force():
+    rng = random.Random(7)
+    index = GridIndex(cell_deg=0.005)
+    points = {}
+    for n in range(200):
+        lat, lng = CAMPUS[0] + rng.uniform(-0.1, 0.1), CAMPUS[1] + rng.uniform(-0.1, 0.1)
+        index.upsert(f"v{n}", lat, lng)
+        points[f"v{n}"] = (lat, lng)
+    # Moves and removals keep the index consistent
+    for n in range(0, 200, 3):
+        lat, lng = CAMPUS[0] + rng.uniform(-0.2, 0.2), CAMPUS[1] + rng.uniform(-0.2, 0.2)
+        index.upsert(f"v{n}", lat, lng)
+        points[f"v{n}"] = (lat, lng)
+    for n in range(1, 200, 5):
+        index.remove(f"v{n}")
+        del points[f"v{n}"]
+
+    for _ in range(100):
+        lat, lng = CAMPUS[0] + rng.uniform(-0.3, 0.3), CAMPUS[1] + rng.uniform(-0.3, 0.3)
+        expected = min(points, key=lambda key: haversine_km(lat, lng, *points[key]))
+        assert index.nearest(lat, lng)[0] == expected
+        allowed = lambda key: key != expected
+        second = min((k for k in points if k != expected), key=lambda key: haversine_km(lat, lng, *points[key]))
+        assert index.nearest(lat, lng, allowed)[0] == second
+
+
+def test_offers_nearest_then_cascades_on_decline():
+    async def scenario():
+        engine = make_engine()
+        exhausted = []
+        engine.on_exhausted = exhausted.append
+        add_ambulance(engine, "near", CAMPUS[0] + 0.001, CAMPUS[1])
+        add_ambulance(engine, "mid", CAMPUS[0] + 0.01, CAMPUS[1])
+        add_ambulance(engine, "far", CAMPUS[0] + 0.05, CAMPUS[1])
+
+        offer = engine.submit("b1", *CAMPUS, "normal", "2026-01-01T00:00:00")
+        assert offer.vehicle_id == "near"
+        assert engine.decline("b1", "driver-mid") is False
+
+        assert engine.decline("b1", "driver-near") is True
+        assert engine.offers["b1"].vehicle_id == "mid"
+        engine.decline("b1", "driver-mid")
+        assert engine.offers["b1"].vehicle_id == "far"
+        engine.decline("b1", "driver-far")
+        # Everyone declined: another round starts rather than leaving it pending forever
+        assert [booking.booking_id for booking in exhausted] == ["b1"]
+        assert engine.offers["b1"].vehicle_id == "near"
+        assert engine.offers["b1"].attempt == 4
+        assert engine.bookings["b1"].declined == set()
+        assert [o.vehicle_id for o in engine.offered] == ["near", "mid", "far", "near"]
+        engine.reset()
+
+    asyncio.run(scenario())
+
+
+def test_booking_waits_for_an_ambulance_that_has_not_declined():
+    async def scenario():
+        engine = make_engine()
+        exhausted = []
+        engine.on_exhausted = exhausted.append
+        add_ambulance(engine, "near", CAMPUS[0] + 0.001, CAMPUS[1])
+        add_ambulance(engine, "far", CAMPUS[0] + 0.02, CAMPUS[1])
+
+        engine.submit("b1", *CAMPUS, "normal", "2026-01-01T00:00:00")
+        engine.submit("b2", CAMPUS[0] + 0.02, CAMPUS[1], "normal", "2026-01-01T00:00:01")
+        assert engine.offers["b2"].vehicle_id == "far"
+
+        # "far" is still on offer for b2, so b1 waits for it instead of going back to "near"
+        engine.decline("b1", "driver-near")
+        assert "b1" not in engine.offers
+        assert exhausted == []
+        engine.decline("b2", "driver-far")
+        assert engine.offers["b1"].vehicle_id == "far"
+        assert engine.offers["b2"].vehicle_id == "near"
+        engine.reset()
+
+    asyncio.run(scenario())
+
+
+def test_offer_times_out_to_next_candidate():
+    async def scenario():
+        engine = make_engine(timeout=0.05)
+        expired = []
+        engine.on_expire = expired.append
+        add_ambulance(engine, "near", CAMPUS[0] + 0.001, CAMPUS[1])
+        add_ambulance(engine, "far", CAMPUS[0] + 0.02, CAMPUS[1])
+
+        engine.submit("b1", *CAMPUS, "normal", "2026-01-01T00:00:00")
+        await asyncio.sleep(0.08)
+        assert [o.vehicle_id for o in expired] == ["near"]
+        assert engine.offers["b1"].vehicle_id == "far"
+        assert engine.offers["b1"].attempt == 2
+        engine.reset()
+
+    asyncio.run(scenario())
+
+
+def test_bookings_declined_all_round_are_open_and_withdrawals_reported():
+    async def scenario():
+        engine = make_engine()
+        withdrawn = []
+        engine.on_withdraw = withdrawn.append
+        add_ambulance(engine, "near", CAMPUS[0] + 0.001, CAMPUS[1])
+        add_ambulance(engine, "far", CAMPUS[0] + 0.02, CAMPUS[1])
+
+        engine.submit("b1", *CAMPUS, "normal", "2026-01-01T00:00:00")
+        assert not engine.bookings["b1"].exhausted
+        engine.decline("b1", "driver-near")
+        engine.decline("b1", "driver-far")
+        # Second round: the offer goes back to "near", but "far" may now take it too
+        assert engine.offers["b1"].vehicle_id == "near" and engine.bookings["b1"].exhausted
+
+        engine.assigned("b1", "far")
+        assert [(o.booking_id, o.driver_id) for o in withdrawn] == [("b1", "driver-near")]
+        engine.submit("b2", *CAMPUS, "normal", "2026-01-01T00:01:00")
+        engine.assigned("b2", "near")
+        # The accepting driver's own offer is not reported as withdrawn
+        assert len(withdrawn) == 1
+        engine.reset()
+
+    asyncio.run(scenario())
+
+
+def test_priority_then_age_gets_the_closest_ambulance():
+    async def scenario():
+        engine = make_engine()
+        engine.submit("old-normal", *CAMPUS, "normal", "2026-01-01T00:00:00")
+        engine.submit("new-normal", *CAMPUS, "normal", "2026-01-01T00:05:00")
+        engine.submit("critical", *CAMPUS, "critical", "2026-01-01T00:10:00")
+        assert engine.offers == {}
+
+        add_ambulance(engine, "near", CAMPUS[0] + 0.001, CAMPUS[1])
+        assert engine.offers["critical"].vehicle_id == "near"
+        add_ambulance(engine, "far", CAMPUS[0] + 0.03, CAMPUS[1])
+        assert engine.offers["old-normal"].vehicle_id == "far"
+
+        # The reserved ambulance accepts; the freed one goes to the next booking
+        engine.assigned("critical", "near")
+        engine.decline("old-normal", "driver-far")
+        assert engine.offers["new-normal"].vehicle_id == "far"
+        assert "near" in engine.busy
+        engine.reset()
+
+    asyncio.run(scenario())
+
+
+def test_dispatch_decisions_stay_in_low_milliseconds():
+    async def scenario():
+        rng = random.Random(3)
+        engine = make_engine()
+        timings = []
+        engine.on_decision = timings.append
+        for n in range(60):
+            add_ambulance(engine, f"a{n}", CAMPUS[0] + rng.uniform(-0.05, 0.05), CAMPUS[1] + rng.uniform(-0.05, 0.05))
+        # Collector pauses aren't dispatch cost
+        gc.disable()
+        try:
+            for n in range(100):
+                engine.submit(f"b{n}", CAMPUS[0] + rng.uniform(-0.05, 0.05), CAMPUS[1] + rng.uniform(-0.05, 0.05),
+                              rng.choice(["critical", "high", "normal"]), f"2026-01-01T00:{n // 60:02d}:{n % 60:02d}")
+            for n in range(100):
+                offer = engine.offers.get(f"b{n}")
+                if offer:
+                    engine.decline(offer.booking_id, offer.driver_id)
+        finally:
+            gc.enable()
+        assert len(engine.offers) == 60
+        # Percentiles rather than the max: one preempted pass on a busy test machine isn't a regression
+        timings.sort()
+        assert timings[len(timings) // 2] < 0.001
+        assert timings[int(len(timings) * 0.95)] < 0.005
+        engine.reset()
+
+    asyncio.run(scenario())
+
+
+def test_booking_is_offered_to_nearest_driver_and_cascades():
+    async def scenario():
+        async with running_app() as client:
+            near = auth(await create_driver_with_ambulance(1))
+            far = auth(await create_driver_with_ambulance(2))
+            await server.db.vehicles.update_one(
+                {"vehicle_number": "AMB-2"},
+                {"$set": {"current_location": {"lat": 20.35, "lng": 85.90, "speed": 0, "timestamp": "now"}}}
+            )
+            for number in ("AMB-1", "AMB-2"):
+                vehicle = await server.db.vehicles.find_one({"vehicle_number": number})
+                await server.refresh_ambulance(vehicle["id"])
+
+            booking = await book(client)
+            assert (await client.get("/api/driver/offer", headers=far)).json()["offer"] is None
+            offer = (await client.get("/api/driver/offer", headers=near)).json()
+            assert offer["booking"]["id"] == booking["id"]
+            assert offer["offer"]["vehicle_number"] == "AMB-1"
+
+            response = await client.post(f"/api/driver/decline-booking/{booking['id']}", headers=near)
+            assert response.status_code == 200
+            response = await client.post(f"/api/driver/decline-booking/{booking['id']}", headers=near)
+            assert response.status_code == 400
+            assert (await client.get("/api/driver/offer", headers=far)).json()["offer"]["vehicle_number"] == "AMB-2"
+
+            response = await client.post(f"/api/driver/accept-booking/{booking['id']}", headers=far)
+            assert response.status_code == 200
+            assert (await client.get("/api/driver/offer", headers=far)).json()["offer"] is None
+            assert server.dispatcher.bookings == {}
+
+            second = await client.post("/api/public/ambulance/book", headers=far, json={
+                "student_registration_id": "REG1", "phone": "9000000001", "place": "library",
+                "user_location": {"lat": 20.35, "lng": 85.90}, "priority": "critical"
+            })
+            # AMB-2 is on a ride, so the only idle ambulance gets it despite being farther away
+            assert second.json()["priority"] == "critical"
+            assert (await client.get("/api/driver/offer", headers=near)).json()["offer"]["booking_id"] == second.json()["id"]
+
+            response = await client.post("/api/public/ambulance/book", headers=far, json={
+                "student_registration_id": "REG1", "phone": "9000000001", "place": "library",
+                "user_location": {"lat": 20.35, "lng": 85.90}, "priority": "urgent!"
+            })
+            assert response.status_code == 400
+
+    asyncio.run(scenario())
+
+
+def test_fully_declined_booking_is_offered_again_and_announced(monkeypatch):
+    emitted = []
+    emit = server.emit
+
+    async def recording_emit(event, data, **kwargs):
+        emitted.append((event, data, kwargs.get("room")))
+        await emit(event, data, **kwargs)
+
+    monkeypatch.setattr(server, "emit", recording_emit)
+
+    async def scenario():
+        async with running_app() as client:
+            driver = auth(await create_driver_with_ambulance(1))
+            vehicle = await server.db.vehicles.find_one({"vehicle_number": "AMB-1"})
+            await server.refresh_ambulance(vehicle["id"])
+
+            booking = await book(client)
+            assert (await client.get("/api/driver/offer", headers=driver)).json()["offer"]["attempt"] == 1
+            response = await client.post(f"/api/driver/decline-booking/{booking['id']}", headers=driver)
+            assert response.status_code == 200
+            await asyncio.sleep(0.01)
+
+            # The only ambulance declined: it is offered again and every driver hears it is waiting
+            offer = (await client.get("/api/driver/offer", headers=driver)).json()["offer"]
+            assert offer["booking_id"] == booking["id"] and offer["attempt"] == 2
+            assert ("booking_pending", {"booking_id": booking["id"], "place": "hostel", "priority": "normal",
+                                        "created_at": booking["created_at"]}, server.DRIVERS_ROOM) in emitted
+
+    asyncio.run(scenario())
+
+
+def test_crewed_ambulance_joins_dispatch_with_its_first_fix():
+    async def fix(client, sequence: int):
+        response = await client.post("/api/gps/receive", json={
+            "imei": "AMB-IMEI-1", "latitude": 20.291, "longitude": 85.821, "speed": 0, "sequence": sequence})
+        assert response.json()["status"] == "live"
+
+    async def scenario():
+        async with running_app() as client:
+            driver = auth(await create_driver_with_ambulance(1))
+            vehicle = await server.db.vehicles.find_one({"vehicle_number": "AMB-1"})
+            # Workers without the dispatch lock, GPS ingest workers among them, leave ambulances alone
+            server.dispatch_owner = False
+            await fix(client, 1)
+            assert vehicle["id"] not in server.dispatcher.ambulances
+            server.dispatch_owner = True
+            await fix(client, 2)
+            assert server.dispatcher.ambulances[vehicle["id"]].lat == 20.291
+
+            booking = await book(client)
+            assert (await client.get("/api/driver/offer", headers=driver)).json()["offer"]["booking_id"] == booking["id"]
+
+    asyncio.run(scenario())
+
+
+def test_other_drivers_cannot_take_a_booking_on_offer(monkeypatch):
+    emitted = []
+    emit = server.emit
+
+    async def recording_emit(event, data, **kwargs):
+        emitted.append((event, data, kwargs.get("room")))
+        await emit(event, data, **kwargs)
+
+    monkeypatch.setattr(server, "emit", recording_emit)
+
+    async def scenario():
+        async with running_app() as client:
+            near = auth(await create_driver_with_ambulance(1))
+            far = auth(await create_driver_with_ambulance(2))
+            await server.db.vehicles.update_one(
+                {"vehicle_number": "AMB-2"},
+                {"$set": {"current_location": {"lat": 20.35, "lng": 85.90, "speed": 0, "timestamp": "now"}}}
+            )
+            for number in ("AMB-1", "AMB-2"):
+                vehicle = await server.db.vehicles.find_one({"vehicle_number": number})
+                await server.refresh_ambulance(vehicle["id"])
+
+            booking = await book(client)
+            response = await client.post(f"/api/driver/accept-booking/{booking['id']}", headers=far)
+            assert response.status_code == 403
+            assert response.json()["detail"] == "This booking is offered to another driver"
+
+            # Both declined: the booking goes round again and whoever accepts first gets it
+            for driver in (near, far):
+                response = await client.post(f"/api/driver/decline-booking/{booking['id']}", headers=driver)
+                assert response.status_code == 200
+            offer = server.dispatcher.offers[booking["id"]]
+            assert offer.vehicle_number == "AMB-1"
+            response = await client.post(f"/api/driver/accept-booking/{booking['id']}", headers=far)
+            assert response.status_code == 200
+            await asyncio.sleep(0.01)
+            assert ("booking_offer_expired", {"booking_id": booking["id"]},
+                    server.USER_ROOM.format(offer.driver_id)) in emitted
+
+    asyncio.run(scenario())
+
+
+def test_deleted_drivers_ambulance_leaves_dispatch():
+    async def scenario():
+        async with running_app() as client:
+            await create_driver_with_ambulance(1)
+            vehicle = await server.db.vehicles.find_one({"vehicle_number": "AMB-1"})
+            await server.refresh_ambulance(vehicle["id"])
+            assert vehicle["id"] in server.dispatcher.ambulances
+
+            response = await client.delete(f"/api/admin/drivers/{vehicle['assigned_to']}",
+                                           headers=auth(await admin_token(client)))
+            assert response.status_code == 200
+            assert vehicle["id"] not in server.dispatcher.ambulances
+            await book(client)
+            assert server.dispatcher.offers == {}
+
+    asyncio.run(scenario())
+
+
+def test_one_worker_holds_the_dispatch_lock(tmp_path):
+    path = str(tmp_path / "dispatch.lock")
+    first, second = OwnerLock(path), OwnerLock(path)
+    assert first.claim() and first.claim()
+    assert not second.claim()
+    first.release()
+    assert second.claim()
+    second.release()
+    assert not OwnerLock("").claim()
+
+
+def test_workers_without_the_dispatch_lock_use_the_owners_board():
+    async def scenario():
+        async with running_app() as client:
+            assert server.dispatch_owner
+            # A second worker can't take dispatch over while this one runs it
+            assert not OwnerLock(server.DISPATCH_LOCK_PATH).claim()
+
+            near = auth(await create_driver_with_ambulance(1))
+            far = auth(await create_driver_with_ambulance(2))
+            # This worker now plays one without the lock (shutdown releases it either way)
+            server.dispatch_owner = False
+            booking = await book(client)
+            # Bookings, answers and ambulance changes are left to the dispatching worker
+            assert server.dispatcher.bookings == {} and server.dispatcher.ambulances == {}
+
+            near_id = (await server.db.vehicles.find_one({"vehicle_number": "AMB-1"}))["assigned_to"]
+            entry = {"booking_id": booking["id"], "vehicle_id": "v1", "vehicle_number": "AMB-1", "driver_id": near_id,
+                     "driver_name": "Driver 1", "distance_km": 1.2, "eta_minutes": 1.2, "attempt": 1,
+                     "expires_at": time.time() + 20, "open": False}
+            await server.offer_posted(entry)
+            assert (await client.get("/api/driver/offer", headers=near)).json()["offer"] == entry
+            response = await client.post(f"/api/driver/accept-booking/{booking['id']}", headers=far)
+            assert response.status_code == 403
+            response = await client.post(f"/api/driver/decline-booking/{booking['id']}", headers=far)
+            assert response.status_code == 400
+
+            # A newer offer is not ended by the previous one's end
+            await server.offer_posted({**entry, "attempt": 2, "open": True})
+            await server.offer_ended({"booking_id": booking["id"], "attempt": 1})
+            response = await client.post(f"/api/driver/accept-booking/{booking['id']}", headers=far)
+            assert response.status_code == 200
+            await server.offer_ended({"booking_id": booking["id"], "attempt": None})
+            assert server.offer_board == {}
+
+    asyncio.run(scenario())
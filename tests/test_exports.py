@@ -0,0 +1,119 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timezone
+
+import server
+from tests.conftest import admin_token, auth, running_app
+
+
+def at(day: int, hour: int = 12) -> str:
+    return datetime(2026, 3, day, hour, tzinfo=timezone.utc).isoformat()
+
+
+async def seed():
+    """Offences and bookings split over the hot and archive tiers, interleaved in time"""
+    for n, (tier, day, offence_type, paid) in enumerate([
+        ("offences_archive", 1, "bus_overspeed", True), ("offences", 2, "student_speed", False),
+        ("offences_archive", 3, "student_speed", True), ("offences", 4, "bus_overspeed", True),
+        ("offences", 5, "bus_overspeed", False)
+    ]):
+        await server.db[tier].insert_one({
+            "id": f"o{n}", "offence_type": offence_type, "vehicle_number": "BUS-1", "speed": 50 + n,
+            "speed_limit": 40, "location": {"lat": 20.3, "lng": 85.8}, "timestamp": at(day), "is_paid": paid,
+            "internal_note": "not exported"
+        })
+    for n, (tier, day, status) in enumerate([
+        ("bookings_archive", 1, "completed"), ("bookings", 2, "pending"), ("bookings", 3, "completed"),
+        ("bookings_archive", 4, "cancelled")
+    ]):
+        await server.db[tier].insert_one({
+            "id": f"b{n}", "student_registration_id": "REG1", "phone": "9000000001", "place": "hostel",
+            "user_location": {"lat": 20.3, "lng": 85.8}, "status": status, "created_at": at(day), "otp": "123456"
+        })
+
+
+def test_csv_export_streams_both_tiers_in_time_order(monkeypatch):
+    # Small chunks, so rows are spread over many streamed pieces
+    monkeypatch.setattr(server, "EXPORT_CHUNK_BYTES", 64)
+
+    async def scenario():
+        async with running_app() as client:
+            await seed()
+            headers = auth(await admin_token(client))
+            response = await client.get("/api/admin/export/offences", headers=headers)
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("text/csv")
+            today = datetime.now(timezone.utc).strftime("%Y%m%d")
+            assert response.headers["content-disposition"] == f'attachment; filename="offences-{today}.csv"'
+
+            rows = list(csv.reader(io.StringIO(response.text)))
+            columns = server.EXPORT_SPECS["offences"]["columns"]
+            assert rows[0] == columns
+            records = [dict(zip(columns, row)) for row in rows[1:]]
+            assert [record["id"] for record in records] == ["o0", "o1", "o2", "o3", "o4"]
+            assert records[0]["speed"] == "50" and records[0]["is_paid"] == "True"
+            assert json.loads(records[1]["location"]) == {"lat": 20.3, "lng": 85.8}
+            # Missing fields are empty cells, unlisted fields are left out
+            assert records[0]["driver_name"] == ""
+            assert "not exported" not in response.text
+
+            # start inclusive, end exclusive, date-only bounds are UTC midnight
+            response = await client.get("/api/admin/export/offences", headers=headers, params={
+                "start": at(2), "end": "2026-03-05", "type": "bus_overspeed"
+            })
+            assert [row[0] for row in csv.reader(io.StringIO(response.text))][1:] == ["o3"]
+
+    asyncio.run(scenario())
+
+
+def test_gzipped_ndjson_export_decompresses_to_the_rows():
+    async def scenario():
+        async with running_app() as client:
+            await seed()
+            headers = auth(await admin_token(client))
+            response = await client.get("/api/admin/export/bookings", headers=headers,
+                                        params={"format": "ndjson", "gzip": "true"})
+            assert response.status_code == 200
+            assert response.headers["content-type"] == "application/gzip"
+            assert response.headers["content-disposition"].endswith('.ndjson.gz"')
+
+            lines = gzip.decompress(response.content).decode().splitlines()
+            rows = [json.loads(line) for line in lines]
+            assert [row["id"] for row in rows] == ["b0", "b1", "b2", "b3"]
+            assert list(rows[0]) == server.EXPORT_SPECS["bookings"]["columns"]
+            assert rows[0]["user_location"] == {"lat": 20.3, "lng": 85.8}
+            assert rows[0]["driver_id"] is None
+            assert all("otp" not in row for row in rows)
+
+            # Filtering on a status that is never archived still finds the hot rows
+            response = await client.get("/api/admin/export/bookings", headers=headers,
+                                        params={"format": "ndjson", "type": "pending"})
+            assert response.headers["content-type"] == "application/x-ndjson"
+            assert [json.loads(line)["id"] for line in response.text.splitlines()] == ["b1"]
+            response = await client.get("/api/admin/export/bookings", headers=headers,
+                                        params={"format": "ndjson", "type": "cancelled"})
+            assert [json.loads(line)["id"] for line in response.text.splitlines()] == ["b3"]
+
+    asyncio.run(scenario())
+
+
+def test_export_rejects_bad_requests():
+    async def scenario():
+        async with running_app() as client:
+            headers = auth(await admin_token(client))
+            assert (await client.get("/api/admin/export/users", headers=headers)).status_code == 404
+            response = await client.get("/api/admin/export/trips", headers=headers, params={"start": "yesterday"})
+            assert response.status_code == 400
+            response = await client.get("/api/admin/export/trips", headers=headers, params={"format": "xlsx"})
+            assert response.status_code == 422
+
+            signup = await client.post("/api/auth/signup", json={
+                "name": "Student", "phone": "9000000001", "password": "pw", "registration_id": "REG1"
+            })
+            response = await client.get("/api/admin/export/trips", headers=auth(signup.json()["access_token"]))
+            assert response.status_code == 403
+
+    asyncio.run(scenario())
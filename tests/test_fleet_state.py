@@ -0,0 +1,97 @@
+import asyncio
+from collections import deque
+
+import server
+from fleet_state import FleetState
+from tests.conftest import admin_token, auth, running_app
+from tests.test_socket_rooms import SocketHarness
+from tests.test_viewports import add_bus
+
+
+def test_deltas_replay_only_what_a_client_missed():
+    fleet = FleetState(history=4)
+    assert fleet.upsert("bus-1", {"vehicle_id": "bus-1", "lat": 1}) == {"vehicle_id": "bus-1", "lat": 1, "version": 1}
+    fleet.upsert("bus-2", {"vehicle_id": "bus-2", "lat": 2})
+    fleet.upsert("bus-1", {"vehicle_id": "bus-1", "lat": 3})
+    assert fleet.remove("bus-9") is None
+    assert fleet.remove("bus-2") == {"vehicle_id": "bus-2", "version": 4}
+    assert fleet.snapshot() == {"epoch": fleet.epoch, "version": 4,
+                                "vehicles": [{"vehicle_id": "bus-1", "lat": 3, "version": 3}]}
+
+    assert fleet.deltas_since(fleet.epoch, 4) == []
+    assert fleet.deltas_since(fleet.epoch, 2) == [
+        ["vehicle_location", {"vehicle_id": "bus-1", "lat": 3, "version": 3}],
+        ["vehicle_removed", {"vehicle_id": "bus-2", "version": 4}]]
+    assert len(fleet.deltas_since(fleet.epoch, 0)) == 4
+    # Gaps the ring buffer no longer covers, versions from the future or another epoch need a snapshot
+    fleet.upsert("bus-3", {"vehicle_id": "bus-3"})
+    assert fleet.deltas_since(fleet.epoch, 0) is None
+    assert len(fleet.deltas_since(fleet.epoch, 1)) == 4
+    assert fleet.deltas_since(fleet.epoch, 6) is None
+    assert fleet.deltas_since("another-epoch", 5) is None
+    assert fleet.deltas_since(fleet.epoch, None) is None
+
+    epoch = fleet.epoch
+    fleet.reset()
+    assert fleet.epoch != epoch and fleet.version == 0 and len(fleet) == 0
+
+
+def test_reconnecting_sockets_get_the_deltas_they_missed(monkeypatch):
+    async def scenario():
+        sockets = SocketHarness(monkeypatch)
+        async with running_app() as client:
+            parked = await add_bus(1, 20.285, 85.815)
+            moving = await add_bus(2, 20.300, 85.830)
+            await server.load_fleet()
+
+            async def fix(imei: str, lat: float, lng: float):
+                await client.post("/api/gps/receive", json={"imei": imei, "latitude": lat, "longitude": lng,
+                                                            "speed": 20})
+                await sockets.settle()
+
+            phone = await sockets.connect()
+            await sockets.settle()
+            (event, snapshot), = sockets.events(phone)
+            assert event == "fleet_snapshot" and snapshot["version"] == 2
+            assert {vehicle["vehicle_id"] for vehicle in snapshot["vehicles"]} == {parked, moving}
+
+            await fix("BUS-IMEI-2", 20.301, 85.831)
+            assert sockets.events(phone)[-1][1]["version"] == 3
+            await sockets.disconnect(phone)
+
+            # Missed while away: one more fix and a vehicle taken off the map
+            await fix("BUS-IMEI-2", 20.302, 85.832)
+            headers = auth(await admin_token(client))
+            await client.delete(f"/api/admin/vehicles/{parked}", headers=headers)
+            phone = await sockets.connect(auth_fields={"fleet_epoch": snapshot["epoch"], "fleet_version": 3})
+            await sockets.settle()
+            (event, resumed), = sockets.events(phone)
+            assert event == "fleet_deltas"
+            assert (resumed["from_version"], resumed["version"]) == (3, 5)
+            assert [(name, data["vehicle_id"], data["version"]) for name, data in resumed["deltas"]] == [
+                ("vehicle_location", moving, 4), ("vehicle_removed", parked, 5)]
+            assert resumed["deltas"][0][1]["location"]["lat"] == 20.302
+
+            # Too far behind for the ring buffer, or from before a restart: a fresh snapshot
+            monkeypatch.setattr(server.fleet, "history", deque(server.fleet.history, maxlen=1))
+            stale = await sockets.connect(auth_fields={"fleet_epoch": snapshot["epoch"], "fleet_version": 3})
+            await server.load_fleet()
+            restarted = await sockets.connect(auth_fields={"fleet_epoch": snapshot["epoch"], "fleet_version": 5})
+            await sockets.settle()
+            assert sockets.event_names(stale) == sockets.event_names(restarted) == ["fleet_snapshot"]
+            assert [vehicle["vehicle_id"] for vehicle in sockets.events(restarted)[0][1]["vehicles"]] == [moving]
+
+            # Leaving a viewport rejoins the fleet with whatever was missed meanwhile
+            await sockets.message(phone, "subscribe_viewport", {"south": 20.28, "west": 85.81,
+                                                                "north": 20.29, "east": 85.82})
+            await sockets.message(phone, "join_room", {"room": "fleet", "epoch": server.fleet.epoch,
+                                                       "version": server.fleet.version})
+            await sockets.settle()
+            assert phone not in server.viewports and sockets.in_room(phone, "fleet")
+            assert sockets.events(phone)[-1] == ["fleet_deltas", {
+                "epoch": server.fleet.epoch, "from_version": 1, "version": 1, "deltas": []}]
+
+            for sid in (phone, stale, restarted):
+                await sockets.disconnect(sid)
+
+    asyncio.run(scenario())
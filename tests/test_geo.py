@@ -0,0 +1,99 @@
+import asyncio
+
+import manage
+import server
+from storage import MemoryStorage
+from tests.conftest import running_app
+
+CAMPUS = (20.2961, 85.8245)
+
+
+async def add_vehicle(number: str, vehicle_type: str, lat: float, lng: float, with_point: bool = True):
+    vehicle = {
+        "id": number, "vehicle_number": number, "gps_imei": f"IMEI-{number}", "barcode": f"BC-{number}",
+        "vehicle_type": vehicle_type, "assigned_to": None, "is_out_of_station": False,
+        "current_location": {"lat": lat, "lng": lng, "speed": 0, "timestamp": "2026-01-01T00:00:00+00:00"},
+        "created_at": "2026-01-01T00:00:00+00:00"
+    }
+    if with_point:
+        vehicle["current_point"] = server.geo_point(lat, lng)
+    await server.db.vehicles.insert_one(vehicle)
+
+
+def test_geo_near_orders_by_distance_and_applies_filters():
+    async def scenario():
+        storage = MemoryStorage()
+        await storage.vehicles.create_index([("current_point", "2dsphere")])
+        for number, offset in (("far", 0.02), ("near", 0.001), ("mid", 0.01)):
+            await storage.vehicles.insert_one({
+                "id": number, "kind": "bus" if number != "mid" else "ambulance",
+                "current_point": server.geo_point(CAMPUS[0] + offset, CAMPUS[1])
+            })
+        await storage.vehicles.insert_one({"id": "nowhere", "kind": "bus"})
+
+        docs = await storage.vehicles.aggregate([
+            {"$geoNear": {"near": server.geo_point(*CAMPUS), "distanceField": "d", "spherical": True}}
+        ]).to_list(None)
+        assert [doc["id"] for doc in docs] == ["near", "mid", "far"]
+        # 0.001 degrees of latitude is about 111 m
+        assert 105 < docs[0]["d"] < 117
+
+        docs = await storage.vehicles.aggregate([
+            {"$geoNear": {"near": server.geo_point(*CAMPUS), "distanceField": "d",
+                          "maxDistance": 1500, "query": {"kind": "bus"}}},
+            {"$project": {"_id": 0, "id": 1, "d": 1}}
+        ]).to_list(None)
+        assert [doc["id"] for doc in docs] == ["near"]
+
+    asyncio.run(scenario())
+
+
+def test_nearby_endpoint_and_gps_updates_points():
+    async def scenario():
+        async with running_app() as client:
+            await add_vehicle("BUS-1", "bus", CAMPUS[0] + 0.005, CAMPUS[1])
+            await add_vehicle("AMB-1", "ambulance", CAMPUS[0] + 0.002, CAMPUS[1])
+            await add_vehicle("BUS-2", "bus", CAMPUS[0] + 0.3, CAMPUS[1])
+
+            response = await client.get("/api/public/vehicles/nearby",
+                                        params={"lat": CAMPUS[0], "lng": CAMPUS[1], "radius": 2000})
+            vehicles = response.json()["vehicles"]
+            assert [v["vehicle_number"] for v in vehicles] == ["AMB-1", "BUS-1"]
+            assert 0.2 < vehicles[0]["distance_km"] < 0.25
+            assert set(vehicles[0]) == {"id", "vehicle_number", "vehicle_type", "current_location", "status",
+                                        "distance_km", "eta_minutes"}
+            assert vehicles[0]["status"] == "live"
+
+            response = await client.get("/api/public/vehicles/nearby",
+                                        params={"lat": CAMPUS[0], "lng": CAMPUS[1], "type": "bus"})
+            assert [v["vehicle_number"] for v in response.json()["vehicles"]] == ["BUS-1"]
+
+            response = await client.get("/api/public/vehicles/nearby",
+                                        params={"lat": CAMPUS[0], "lng": CAMPUS[1], "type": "truck"})
+            assert response.status_code == 400
+
+            # A GPS fix moves the indexed point along with current_location
+            await client.post("/api/gps/receive", json={
+                "imei": "IMEI-BUS-2", "latitude": CAMPUS[0], "longitude": CAMPUS[1] + 0.0001, "speed": 10
+            })
+            response = await client.get("/api/public/vehicles/nearby",
+                                        params={"lat": CAMPUS[0], "lng": CAMPUS[1], "radius": 500})
+            assert [v["vehicle_number"] for v in response.json()["vehicles"]] == ["BUS-2", "AMB-1"]
+
+    asyncio.run(scenario())
+
+
+def test_migrate_geo_backfills_points():
+    async def scenario():
+        async with running_app():
+            await add_vehicle("OLD-1", "bus", CAMPUS[0], CAMPUS[1], with_point=False)
+            await add_vehicle("NEW-1", "bus", CAMPUS[0], CAMPUS[1])
+            await server.db.vehicles.insert_one({"id": "PARKED", "vehicle_type": "bus", "current_location": None})
+
+            assert await manage.migrate_geo() == 1
+            assert await manage.migrate_geo() == 0
+            vehicle = await server.db.vehicles.find_one({"id": "OLD-1"})
+            assert vehicle["current_point"] == {"type": "Point", "coordinates": [CAMPUS[1], CAMPUS[0]]}
+            assert "current_point" not in await server.db.vehicles.find_one({"id": "PARKED"})
+
+    asyncio.run(scenario())
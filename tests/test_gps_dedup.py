@@ -0,0 +1,66 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import metrics
+import server
+from storage import matches
+from tests.conftest import admin_token, auth, running_app
+from tests.test_analytics import create_bus_driver
+from tests.test_socket_rooms import SocketHarness
+
+
+def test_live_fix_filter_only_matches_older_positions():
+    fix = {"ts": 100.0, "seq": 7}
+    query = server.live_fix_filter("bus-1", fix)
+    assert matches({"id": "bus-1"}, query)
+    assert matches({"id": "bus-1", "last_fix": {"ts": 99.0, "seq": 50}}, query)
+    assert matches({"id": "bus-1", "last_fix": {"ts": 100.0, "seq": 6}}, query)
+    assert not matches({"id": "bus-1", "last_fix": {"ts": 100.0, "seq": 7}}, query)
+    assert not matches({"id": "bus-1", "last_fix": {"ts": 101.0, "seq": -1}}, query)
+    assert server.fix_order({"ts": 100.0, "seq": -1}, None) == 1
+    assert server.fix_order(fix, {"ts": 100.0, "seq": 7}) == 0
+    assert server.fix_order(fix, {"ts": 100.5, "seq": 1}) == -1
+
+
+def test_retransmitted_fixes_never_regress_the_live_position(monkeypatch):
+    async def scenario():
+        sockets = SocketHarness(monkeypatch)
+        async with running_app() as client:
+            await create_bus_driver(1)
+            phone = await sockets.connect()
+            start = datetime.now(timezone.utc) - timedelta(minutes=5)
+            outcomes = {outcome: metrics.GPS_FIX_OUTCOMES.values.get((outcome,), 0)
+                        for outcome in ("live", "late", "duplicate")}
+
+            async def fix(seconds: int, lat: float, speed: float = 20, sequence: int = None):
+                response = await client.post("/api/gps/receive", json={
+                    "imei": "BUS-IMEI-1", "latitude": lat, "longitude": 85.82, "speed": speed,
+                    "timestamp": (start + timedelta(seconds=seconds)).isoformat(), "sequence": sequence})
+                await sockets.settle()
+                return response.json()["status"]
+
+            assert await fix(10, 20.31, sequence=1) == "live"
+            assert await fix(10, 20.31, sequence=1) == "duplicate"
+            assert await fix(10, 20.311, sequence=2) == "live"  # same second, next message
+            # A dropout's backlog arrives after the tracker already reported a newer position
+            assert await fix(5, 20.30, speed=70, sequence=0) == "late"
+            assert await fix(5, 20.30, speed=70, sequence=0) == "duplicate"
+            assert await fix(20, 20.32, sequence=3) == "live"
+
+            vehicle = await server.db.vehicles.find_one({"id": "bus-1"})
+            assert vehicle["current_location"]["lat"] == 20.32
+            assert vehicle["last_fix"]["seq"] == 3
+            history = await server.db.gps_history.find({"vehicle_id": "bus-1"}, {"_id": 0}).to_list(10)
+            assert [(entry["location"]["lat"], entry["sequence"]) for entry in history] == [(20.30, 0)]
+            # The late fix's 70 km/h is history, not a fresh offence, and never reached the map
+            headers = auth(await admin_token(client))
+            assert (await client.get("/api/admin/offences", headers=headers)).json()["offences"] == []
+            assert [data["location"]["lat"] for event, data in sockets.events(phone)
+                    if event == "vehicle_location"] == [20.31, 20.311, 20.32]
+
+            counts = {outcome: metrics.GPS_FIX_OUTCOMES.values[(outcome,)] - before
+                      for outcome, before in outcomes.items()}
+            assert counts == {"live": 3, "late": 1, "duplicate": 2}
+            await sockets.disconnect(phone)
+
+    asyncio.run(scenario())
@@ -0,0 +1,89 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import server
+from heartbeats import HeartbeatMonitor, TimerWheel
+from tests.conftest import admin_token, auth, running_app
+from tests.test_analytics import create_bus_driver
+from tests.test_socket_rooms import SocketHarness
+
+
+def test_timer_wheel_only_hands_out_due_keys():
+    wheel = TimerWheel(tick_s=1.0, slots=8, now=100.0)
+    wheel.schedule("a", 102.5)
+    wheel.schedule("b", 103.0)
+    wheel.schedule("c", 111.0)  # same bucket as "b", one turn later
+    wheel.schedule("late", 50.0)  # already due: swept with the current tick
+    assert wheel.advance(100.9) == []
+    assert wheel.advance(101.0) == ["late"]
+    wheel.schedule("a", 104.2)  # re-armed before it came due
+    assert wheel.advance(103.5) == []
+    assert wheel.advance(104.0) == ["b"]
+    assert wheel.advance(105.0) == ["a"]
+    assert len(wheel) == 1
+    # A long pause sweeps each bucket once
+    assert wheel.advance(1000.0) == ["c"]
+    assert len(wheel) == 0 and wheel.current == 1000
+
+
+def test_silent_vehicles_go_stale_then_offline_and_recover():
+    monitor = HeartbeatMonitor(stale_after_s=60, offline_after_s=300, now=0.0)
+    assert not monitor.beat("bus-1", 0.0)
+    monitor.beat("bus-2", 0.0)
+    monitor.beat("bus-2", 50.0)
+    assert monitor.advance(59.0) == []
+    assert monitor.advance(61.0) == [("bus-1", "stale")]
+    assert monitor.advance(111.0) == [("bus-2", "stale")]
+    assert monitor.beat("bus-2", 200.0)
+    assert monitor.advance(301.0) == [("bus-2", "stale"), ("bus-1", "offline")]
+    assert monitor.advance(10_000.0) == [("bus-2", "offline")]
+    assert monitor.advance(20_000.0) == []
+
+    monitor.forget("bus-1")
+    assert monitor.status_of("bus-1") is None and len(monitor) == 1
+    # Picking vehicles back up after a restart
+    assert monitor.track("bus-3", 19_990.0, 20_000.0) == "live"
+    assert monitor.track("bus-4", 19_900.0, 20_000.0) == "stale"
+    assert monitor.track("bus-5", 10_000.0, 20_000.0) == "offline"
+    assert monitor.advance(20_201.0) == [("bus-3", "stale"), ("bus-4", "offline")]
+
+
+def test_status_changes_reach_clients_and_vehicle_listings(monkeypatch):
+    async def scenario():
+        sockets = SocketHarness(monkeypatch)
+        async with running_app() as client:
+            driver = auth(await create_bus_driver(1))
+            await client.post("/api/driver/start-trip", headers=driver, json={"vehicle_id": "bus-1"})
+            await client.post("/api/gps/receive", json={"imei": "BUS-IMEI-1", "latitude": 20.30,
+                                                        "longitude": 85.82, "speed": 20})
+            phone = await sockets.connect()
+            bus, = (await client.get("/api/public/buses")).json()["buses"]
+            assert bus["tracker_status"] == "live"
+
+            assert await server.apply_tracker_statuses(server.heartbeats.advance(time.time() + 61)) == 1
+            await sockets.settle()
+            assert sockets.events(phone)[-1][0] == "vehicle_status"
+            assert sockets.events(phone)[-1][1]["status"] == "stale"
+            bus, = (await client.get("/api/public/buses")).json()["buses"]
+            assert bus["tracker_status"] == "stale"
+            admin = auth(await admin_token(client))
+            vehicle, = (await client.get("/api/admin/vehicles", headers=admin)).json()["vehicles"]
+            assert vehicle["tracker_status"] == "stale"
+            assert server.fleet.vehicles["bus-1"]["status"] == "stale"
+
+            await client.post("/api/gps/receive", json={"imei": "BUS-IMEI-1", "latitude": 20.31,
+                                                        "longitude": 85.82, "speed": 20})
+            await sockets.settle()
+            assert sockets.events(phone)[-1][1]["status"] == "live"
+            assert (await server.db.vehicles.find_one({"id": "bus-1"}))["tracker_status"] == "live"
+
+            # A worker starting up while the tracker has been quiet for ten minutes
+            old = (datetime.now(timezone.utc) - timedelta(minutes=10)).isoformat()
+            await server.db.vehicles.update_one({"id": "bus-1"}, {"$set": {"current_location.timestamp": old}})
+            await server.load_fleet()
+            assert server.heartbeats.status_of("bus-1") == "offline"
+            assert (await server.db.vehicles.find_one({"id": "bus-1"}))["tracker_status"] == "offline"
+            await sockets.disconnect(phone)
+
+    asyncio.run(scenario())
@@ -0,0 +1,125 @@
+import asyncio
+import os
+import random
+import time
+from collections import Counter
+
+import pytest
+
+import server
+from ingest_pool import IngestPool, IngestWorkerError, shard_of
+from tests.conftest import running_app
+from tests.test_viewports import add_bus
+
+
+def test_imeis_spread_evenly_and_stay_put():
+    imeis = [f"35{n:013d}" for n in range(4000)]
+    counts = Counter(shard_of(imei, 4) for imei in imeis)
+    assert sorted(counts) == [0, 1, 2, 3]
+    assert min(counts.values()) > 900
+    assert [shard_of(imei, 4) for imei in imeis[:5]] == [shard_of(imei, 4) for imei in imeis[:5]]
+
+
+def recording_worker():
+    """Handler answering with this worker's pid and every `n` it has seen for the IMEI so far"""
+    seen = {}
+
+    async def handle(payload):
+        if payload.get("fail"):
+            raise ValueError("bad fix")
+        await asyncio.sleep(random.random() / 1000)
+        seen.setdefault(payload["imei"], []).append(payload["n"])
+        return {"pid": os.getpid(), "seen": list(seen[payload["imei"]])}
+
+    return handle
+
+
+def test_each_imei_is_handled_by_one_worker_in_order():
+    async def scenario():
+        pool = IngestPool(3, recording_worker, batch_max=16, window=2)
+        pool.start()
+        try:
+            imeis = [f"IMEI-{n}" for n in range(20)]
+            submitted = [(imei, n, pool.submit(imei, {"imei": imei, "n": n})) for n in range(10) for imei in imeis]
+            results = await asyncio.gather(*(future for _, _, future in submitted))
+            pids = {}
+            for (imei, n, _), result in zip(submitted, results):
+                assert result["seen"] == list(range(n + 1))
+                assert pids.setdefault(imei, result["pid"]) == result["pid"]
+            assert len(set(pids.values())) == 3
+            assert len(pool) == 0
+
+            with pytest.raises(IngestWorkerError, match="ValueError: bad fix"):
+                await pool.submit("IMEI-0", {"fail": True})
+        finally:
+            await pool.close()
+        assert not any(process.is_alive() for process in pool.processes)
+
+    asyncio.run(scenario())
+
+
+def test_dead_workers_are_replaced():
+    async def scenario():
+        pool = IngestPool(2, recording_worker, respawn_delay_s=0.2)
+        pool.start()
+        try:
+            first = await pool.submit("IMEI-0", {"imei": "IMEI-0", "n": 0})
+            shard = shard_of("IMEI-0", 2)
+            pool.processes[shard].kill()
+            deadline = time.monotonic() + 30
+            while pool.respawns == 0 and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+            assert pool.respawns == 1
+            # The replacement starts with fresh state in a new process
+            second = await pool.submit("IMEI-0", {"imei": "IMEI-0", "n": 1})
+            assert second["pid"] != first["pid"] and second["seen"] == [1]
+        finally:
+            await pool.close()
+
+    asyncio.run(scenario())
+
+
+async def gps_worker_with_a_bus():
+    """The server's ingest worker, on its own in-memory storage holding one bus"""
+    await add_bus(1, 20.285, 85.815)
+    return await server.gps_shard_handler()
+
+
+def test_gps_fixes_go_through_the_imeis_worker():
+    async def scenario():
+        async with running_app() as client:
+            server.ingest_pool = IngestPool(2, gps_worker_with_a_bus)
+            server.ingest_pool.start()
+
+            async def fix(imei: str):
+                return await client.post("/api/gps/receive", json={
+                    "imei": imei, "latitude": 20.286, "longitude": 85.816, "speed": 12,
+                    "timestamp": "2025-01-06T08:00:00+00:00", "sequence": 7})
+
+            response = await fix("BUS-IMEI-1")
+            assert response.status_code == 200 and response.json()["status"] == "live"
+            # The worker remembers the fix; this process's storage never saw the bus
+            assert (await fix("BUS-IMEI-1")).json()["status"] == "duplicate"
+            assert await server.db.vehicles.find_one({"gps_imei": "BUS-IMEI-1"}) is None
+            response = await fix("BUS-IMEI-2")
+            assert response.status_code == 404
+            assert response.json()["detail"] == "Vehicle not found for this IMEI"
+        assert server.ingest_pool is None
+
+    asyncio.run(scenario())
+
+
+def test_fixes_for_a_lost_worker_are_refused_for_retry(monkeypatch):
+    class LostPool:
+        def submit(self, imei, payload):
+            raise IngestWorkerError("ingest worker 0 is gone")
+
+    async def scenario():
+        async with running_app() as client:
+            monkeypatch.setattr(server, "ingest_pool", LostPool())
+            response = await client.post("/api/gps/receive", json={
+                "imei": "BUS-IMEI-1", "latitude": 20.286, "longitude": 85.816, "speed": 12})
+            assert response.status_code == 503
+            monkeypatch.setattr(server, "ingest_pool", None)
+
+    asyncio.run(scenario())
@@ -0,0 +1,61 @@
+import asyncio
+
+import metrics
+import server
+from tests.conftest import running_app
+from tests.test_socket_rooms import SocketHarness, student_token
+
+
+def sample(text: str, series: str) -> float:
+    """The value of one exposition line, e.g. 'socketio_emits_total{event="probe"}'"""
+    for line in text.splitlines():
+        if line.startswith(series + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def test_metrics_exposes_request_counts_and_latency():
+    async def scenario():
+        async with running_app() as client:
+            for _ in range(3):
+                assert (await client.get("/api/public/buses")).status_code == 200
+            assert (await client.get("/api/no-such-route")).status_code == 404
+
+            response = await client.get("/metrics")
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+            text = response.text
+            assert "# TYPE http_requests_total counter" in text
+            assert "# TYPE http_request_duration_seconds histogram" in text
+            assert sample(text, 'http_requests_total{router="public",route="/api/public/buses",'
+                                'method="GET",status="200"}') >= 3
+            assert sample(text, 'http_requests_total{router="unmatched",route="unmatched",'
+                                'method="GET",status="404"}') >= 1
+            assert sample(text, 'http_request_duration_seconds_count{router="public",'
+                                'route="/api/public/buses",method="GET"}') >= 3
+
+    asyncio.run(scenario())
+
+
+def test_emit_bytes_are_the_encoded_frame_size(monkeypatch):
+    sockets = SocketHarness(monkeypatch)
+
+    async def scenario():
+        async with running_app() as client:
+            eio_sid = await sockets.connect(await student_token(client, "9000000002", "REG2"))
+            sid = server.sio.manager.sid_from_eio_sid(eio_sid, "/")
+            emits = metrics.SOCKET_EMITS.values.get(("probe",), 0)
+            sent = metrics.SOCKET_EMIT_BYTES.values.get(("probe",), 0)
+
+            await server.emit("probe", {"text": "héllo", "n": [1, 2, 3]}, to=sid)
+            await sockets.settle()
+
+            frames = [packet for packet in sockets.sent[eio_sid] if '"probe"' in packet]
+            assert len(frames) == 1
+            assert metrics.SOCKET_EMITS.values[("probe",)] - emits == 1
+            assert metrics.SOCKET_EMIT_BYTES.values[("probe",)] - sent == len(frames[0])
+
+            text = (await client.get("/metrics")).text
+            assert sample(text, 'socketio_emit_bytes_total{event="probe"}') == metrics.SOCKET_EMIT_BYTES.values[("probe",)]
+
+    asyncio.run(scenario())
@@ -0,0 +1,130 @@
+import asyncio
+import multiprocessing
+import struct
+import time
+
+import server
+from position_table import HEADER, OFFLINE, PositionTable, SLOT, status_of
+from tests.conftest import admin_token, auth, running_app
+from tests.test_analytics import create_bus_driver
+
+
+def open_table(path, capacity: int = 16) -> PositionTable:
+    table = PositionTable(str(path), capacity)
+    table.open()
+    return table
+
+
+def test_one_writer_and_lock_free_readers(tmp_path):
+    path = tmp_path / "positions"
+    writer, reader = open_table(path), open_table(path)
+    assert reader.get("bus-1") is None  # nothing written yet
+    assert writer.claim() and not reader.claim()
+
+    writer.rebuild([("bus-1", 20.30, 85.82, 12.0, 1000.0, "live")])
+    assert reader.get("bus-1") == (20.30, 85.82, 12.0, 1000.0, 1)
+    # Vehicles added later are found on first lookup
+    writer.put("bus-2", 20.31, 85.83, 0.0, 1001.0)
+    writer.put("bus-1", 20.32, 85.84, 30.0, 1002.0)
+    assert reader.get("bus-2")[:2] == (20.31, 85.83)
+    assert reader.get("bus-1")[:4] == (20.32, 85.84, 30.0, 1002.0)
+
+    writer.set_status("bus-2", OFFLINE)
+    assert status_of(reader.get("bus-2")[4]) == "offline"
+    writer.remove("bus-2")
+    assert reader.get("bus-2") is None and reader.get("bus-3") is None
+    assert not writer.put("x" * 41, 0, 0, 0, 0)
+
+    # The writer goes away: the next claimant keeps the slots and refreshes them
+    writer.close()
+    assert reader.claim()
+    reader.rebuild([("bus-2", 20.40, 85.90, 5.0, 2000.0, "stale")])
+    assert reader.offsets["bus-2"] == HEADER.size + SLOT.size
+    assert reader.get("bus-1") is None
+    assert status_of(reader.get("bus-2")[4]) == "stale"
+    reader.close()
+
+
+def test_full_table_and_torn_slots_send_readers_elsewhere(tmp_path):
+    path = tmp_path / "positions"
+    writer, reader = open_table(path, capacity=2), open_table(path, capacity=2)
+    writer.claim()
+    assert writer.put("bus-1", 1, 2, 3, 4) and writer.put("bus-2", 1, 2, 3, 4)
+    assert not writer.put("bus-3", 1, 2, 3, 4)
+    assert reader.get("bus-1") is not None
+    # A writer that died halfway through leaves the sequence odd
+    struct.pack_into("<Q", writer.buffer, HEADER.size, 7)
+    assert reader.get("bus-1") is None
+    writer.put("bus-1", 5, 6, 7, 8)
+    assert reader.get("bus-1") == (5, 6, 7, 8, 1)
+    writer.close()
+    reader.close()
+
+
+def keep_writing(path: str, seconds: float):
+    """Rewrite two vehicles whose fields always satisfy lng == lat + 1 and speed == lat * 2"""
+    table = open_table(path)
+    table.claim()
+    deadline = time.time() + seconds
+    n = 0
+    while time.time() < deadline:
+        n += 1
+        for vehicle_id in ("bus-1", "bus-2"):
+            table.put(vehicle_id, float(n), n + 1.0, n * 2.0, float(n))
+    table.close()
+
+
+def test_readers_never_see_a_half_written_slot(tmp_path):
+    path = str(tmp_path / "positions")
+    writer = multiprocessing.get_context("spawn").Process(target=keep_writing, args=(path, 1.5))
+    writer.start()
+    reader = open_table(path)
+    seen = 0
+    deadline = time.time() + 10
+    while writer.is_alive() and time.time() < deadline:
+        for vehicle_id in ("bus-1", "bus-2"):
+            position = reader.get(vehicle_id)
+            if position is not None:
+                lat, lng, speed, _, _ = position
+                assert lng == lat + 1 and speed == lat * 2
+                seen += 1
+    writer.join()
+    reader.close()
+    assert seen > 0
+
+
+def test_bus_positions_are_served_without_reading_vehicles(monkeypatch):
+    async def scenario():
+        async with running_app() as client:
+            driver = auth(await create_bus_driver(1))
+            await client.post("/api/driver/start-trip", headers=driver, json={"vehicle_id": "bus-1"})
+            await client.post("/api/gps/receive", json={
+                "imei": "BUS-IMEI-1", "latitude": 20.30, "longitude": 85.82, "speed": 20,
+                "timestamp": "2026-01-05T08:00:00+00:00"})
+            assert server.positions.writer
+
+            async def no_reads(*args, **kwargs):
+                raise AssertionError("vehicle read from the database")
+
+            monkeypatch.setattr(server.db.vehicles, "find_one", no_reads)
+            bus, = (await client.get("/api/public/buses")).json()["buses"]
+            assert bus["location"] == {"lat": 20.30, "lng": 85.82, "speed": 20,
+                                       "timestamp": "2026-01-05T08:00:00+00:00"}
+            assert (bus["vehicle_number"], bus["tracker_status"]) == ("BUS-1", "live")
+            eta = (await client.get("/api/public/bus/bus-1/eta", params={"user_lat": 20.31, "user_lng": 85.82})).json()
+            assert eta["bus_location"]["lat"] == 20.30 and eta["distance_km"] == 1.11
+
+            await server.apply_tracker_statuses([("bus-1", "stale")])
+            bus, = (await client.get("/api/public/buses")).json()["buses"]
+            assert bus["tracker_status"] == "stale"
+
+            # Vehicles the table doesn't hold still come from the database
+            monkeypatch.undo()
+            headers = auth(await admin_token(client))
+            await client.delete("/api/admin/vehicles/bus-1", headers=headers)
+            assert server.positions.get("bus-1") is None
+            response = await client.get("/api/public/bus/bus-1/eta", params={"user_lat": 20.31, "user_lng": 85.82})
+            assert response.status_code == 404
+        assert not server.positions.writer
+
+    asyncio.run(scenario())
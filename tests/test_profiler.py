@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import server
+from tests.conftest import admin_token, auth, running_app
+
+
+def spin(seconds: float):
+    """Hold the event loop thread, the way a synchronous call on a request path would"""
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def block_the_loop(seconds: float):
+    time.sleep(seconds)
+
+
+def test_window_profile_collects_the_loop_threads_stacks():
+    async def scenario():
+        async with running_app() as client:
+            headers = auth(await admin_token(client))
+            response = await client.post("/api/admin/profiler/start", headers=headers,
+                                         json={"mode": "window", "duration_s": 30, "interval_ms": 1})
+            assert response.status_code == 200
+            assert response.json()["running"] is True
+            response = await client.post("/api/admin/profiler/start", headers=headers, json={"mode": "window"})
+            assert response.status_code == 400
+
+            spin(0.2)
+            status = (await client.post("/api/admin/profiler/stop", headers=headers)).json()
+            assert status["running"] is False and status["samples"] > 0
+
+            response = await client.get("/api/admin/profiler/profile", headers=headers)
+            lines = response.text.splitlines()
+            assert any("test_profiler.py:spin" in line for line in lines)
+            # Collapsed format: root-first frames joined by ';', then the sample count
+            stack, count = lines[0].rsplit(" ", 1)
+            assert int(count) > 0 and ";" in stack
+
+    asyncio.run(scenario())
+
+
+def test_route_profile_keeps_only_the_chosen_routes_requests():
+    async def scenario():
+        async with running_app() as client:
+            headers = auth(await admin_token(client))
+            response = await client.post("/api/admin/profiler/start", headers=headers, json={
+                "mode": "route", "route": "/api/auth/login", "percent": 100, "duration_s": 30, "interval_ms": 1
+            })
+            assert response.status_code == 200
+            # bcrypt keeps each login on the loop thread long enough to be sampled
+            for _ in range(2):
+                await admin_token(client)
+                await client.get("/api/public/buses")
+            await client.post("/api/admin/profiler/stop", headers=headers)
+
+            stacks = (await client.get("/api/admin/profiler/profile", headers=headers)).text
+            assert "server.py:login" in stacks
+            assert "server.py:get_active_buses" not in stacks
+            assert (await client.get("/api/admin/profiler/status", headers=headers)).json()["mode"] == "route"
+
+            response = await client.post("/api/admin/profiler/start", headers=headers, json={"mode": "route"})
+            assert response.status_code == 400
+            response = await client.post("/api/admin/profiler/start", headers=headers, json={"mode": "everything"})
+            assert response.status_code == 400
+
+    asyncio.run(scenario())
+
+
+def test_watchdog_reports_loop_stalls_with_the_blocking_stack():
+    async def scenario():
+        async with running_app() as client:
+            headers = auth(await admin_token(client))
+            # The login's bcrypt is a stall too: let the heartbeat run so this one is reported on its own
+            await asyncio.sleep(server.watchdog.threshold)
+            block_the_loop(server.watchdog.threshold * 3)
+            # Let the heartbeat resume so the stall's full length is recorded
+            await asyncio.sleep(server.watchdog.threshold)
+
+            report = (await client.get("/api/admin/profiler/blocking", headers=headers)).json()
+            assert report["threshold_ms"] == round(server.watchdog.threshold * 1000, 1)
+            stalls = [event for event in report["events"] if "test_profiler.py:block_the_loop" in (event["stack"] or "")]
+            assert len(stalls) == 1
+            assert stalls[0]["blocked_ms"] >= server.watchdog.threshold * 2 * 1000
+
+            signup = await client.post("/api/auth/signup", json={
+                "name": "Student", "phone": "9000000001", "password": "pw", "registration_id": "REG1"
+            })
+            response = await client.get("/api/admin/profiler/blocking", headers=auth(signup.json()["access_token"]))
+            assert response.status_code == 403
+
+    asyncio.run(scenario())
@@ -0,0 +1,96 @@
+import asyncio
+
+import server
+from report_policy import EtaWatchers, ReportPolicy
+from tests.conftest import running_app
+from tests.test_viewports import add_bus
+
+
+def test_intervals_follow_motion_and_duty():
+    policy = ReportPolicy()
+    assert policy.interval(0) == 60
+    assert policy.interval(0, on_trip=True) == 20
+    assert policy.interval(15, on_trip=True) == 10
+    assert policy.interval(45, on_trip=True) == 5
+    assert policy.interval(0, on_booking=True) == 3
+    assert policy.interval(0, waiting_km=4.0) == 5
+    assert policy.interval(20, waiting_km=0.5) == 2
+    assert policy.interval(0, on_booking=True, waiting_km=0.2) == 2
+
+
+def test_load_stretches_routine_intervals_only():
+    policy = ReportPolicy()
+    assert policy.interval(15, on_trip=True, load=2.0) == 20
+    assert policy.interval(15, on_trip=True, load=50.0) == 40
+    assert policy.interval(0, load=50.0) == 240
+    assert policy.interval(0, on_booking=True, load=50.0) == 3
+    assert policy.interval(20, waiting_km=0.5, load=50.0) == 2
+    assert ReportPolicy(parked_s=600).interval(0) == 300
+
+
+def test_eta_watchers_expire():
+    watchers = EtaWatchers(ttl_s=60, per_vehicle=2)
+    assert watchers.nearest_km("bus-1", 20.285, 85.815, 0) is None
+    watchers.note("bus-1", 20.285, 85.815, 0)
+    watchers.note("bus-1", 20.300, 85.830, 30)
+    assert watchers.nearest_km("bus-1", 20.285, 85.815, 45) == 0
+    # The nearer lookup is older and goes first
+    assert 2.0 < watchers.nearest_km("bus-1", 20.285, 85.815, 75) < 2.5
+    assert watchers.nearest_km("bus-1", 20.285, 85.815, 120) is None
+    assert watchers.watchers == {}
+
+
+def test_repeated_lookups_are_known_until_refresh_is_due():
+    watchers = EtaWatchers(refresh_s=30)
+    assert not watchers.known("bus-1", 20.285, 85.815, 0)
+    watchers.note("bus-1", 20.285, 85.815, 0)
+    assert watchers.known("bus-1", 20.2852, 85.8151, 10)
+    # Somewhere else, another vehicle, or due for a refresh: worth noting again
+    assert not watchers.known("bus-1", 20.290, 85.815, 10)
+    assert not watchers.known("bus-2", 20.285, 85.815, 10)
+    assert not watchers.known("bus-1", 20.285, 85.815, 31)
+
+
+def test_polling_the_eta_broadcasts_only_new_watch_state(monkeypatch):
+    async def scenario():
+        async with running_app() as client:
+            bus = await add_bus(1, 20.285, 85.815)
+            broadcasts = []
+            run_everywhere = server.sio.manager.run_everywhere
+
+            async def recording(name, data):
+                if name == "eta_watched":
+                    broadcasts.append(data)
+                await run_everywhere(name, data)
+
+            monkeypatch.setattr(server.sio.manager, "run_everywhere", recording)
+
+            for user_lat in (20.287, 20.287, 20.287, 20.295):
+                response = await client.get(f"/api/public/bus/{bus}/eta",
+                                            params={"user_lat": user_lat, "user_lng": 85.816})
+                assert response.status_code == 200
+            assert [data["lat"] for data in broadcasts] == [20.287, 20.295]
+
+    asyncio.run(scenario())
+
+
+def test_gps_response_tells_the_tracker_when_to_report():
+    async def scenario():
+        async with running_app() as client:
+            bus = await add_bus(1, 20.285, 85.815)
+
+            async def fix() -> dict:
+                response = await client.post("/api/gps/receive", json={
+                    "imei": "BUS-IMEI-1", "latitude": 20.285, "longitude": 85.815, "speed": 0})
+                assert response.status_code == 200
+                return response.json()
+
+            assert (await fix())["next_report_interval_s"] == 60
+            # A student a few hundred metres away looks up its ETA
+            response = await client.get(f"/api/public/bus/{bus}/eta",
+                                        params={"user_lat": 20.287, "user_lng": 85.816})
+            assert response.status_code == 200
+            body = await fix()
+            assert body["status"] == "live" and body["next_report_interval_s"] == 2
+
+    asyncio.run(scenario())
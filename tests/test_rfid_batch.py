@@ -0,0 +1,93 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import server
+from tests.conftest import admin_token, auth, running_app
+
+START = datetime.now(timezone.utc) - timedelta(minutes=10)
+
+
+def scan(device: str, registration_id: str, seconds: float) -> dict:
+    return {"rfid_device_id": device, "student_registration_id": registration_id,
+            "student_name": f"Student {registration_id}", "phone": "9000000001",
+            "timestamp": (START + timedelta(seconds=seconds)).isoformat()}
+
+
+class CountingCollection:
+    """Wraps a collection to count calls per method"""
+
+    def __init__(self, collection, calls):
+        self._collection = collection
+        self._calls = calls
+
+    def __getattr__(self, name):
+        self._calls[(self._collection.name, name)] = self._calls.get((self._collection.name, name), 0) + 1
+        return getattr(self._collection, name)
+
+
+def test_scan_batch_uses_registry_and_bulk_writes(monkeypatch):
+    async def scenario():
+        async with running_app() as client:
+            headers = auth(await admin_token(client))
+            await client.post("/api/auth/signup", json={
+                "name": "Asha", "phone": "9000000001", "password": "pw", "registration_id": "REG1"
+            })
+            device = (await client.post("/api/admin/rfid-devices", headers=headers,
+                                        json={"rfid_id": "GATE-1", "location_name": "Main gate"})).json()
+            await client.post("/api/admin/rfid-devices", headers=headers,
+                              json={"rfid_id": "GATE-2", "location_name": "Library"})
+            await client.post("/api/admin/rfid-sections", headers=headers,
+                              json={"from_rfid": "GATE-1", "to_rfid": "GATE-2", "distance_m": 400})
+
+            storage = server.db
+            calls = {}
+            monkeypatch.setattr(type(storage), "__getattr__",
+                                lambda self, name, original=type(storage).__getattr__:
+                                CountingCollection(original(self, name), calls))
+
+            response = await client.post("/api/rfid/scan-batch",
+                                         json={"scans": [scan("GATE-1", f"REG{n}", 0) for n in range(20)]})
+            assert response.json()["violations"] == 0
+            # 400 m in 20 + n seconds: above 40 km/h for n < 16
+            scans = [scan("GATE-2", f"REG{n}", 20 + n) for n in range(20)] + [scan("GATE-9", "REG1", 30)]
+            response = await client.post("/api/rfid/scan-batch", json={"scans": scans})
+            body = response.json()
+            assert body["received"] == 21
+            assert body["violations"] == 16
+            assert body["unknown_devices"] == 1
+            assert body["results"][0]["section_speed"] == 72.0
+            assert body["results"][19] == {"status": "ok", "section_speed": 36.9}
+            assert body["results"][-1] == {"status": "unknown_device"}
+            assert body["results"][1]["status"] == "violation"
+
+            # One registry load, one scan insert per batch, one student lookup and one offence insert
+            assert calls.get(("rfid_devices", "find"), 0) == 1
+            assert calls.get(("rfid_devices", "find_one"), 0) == 0
+            assert calls.get(("rfid_scans", "insert_many"), 0) == 2
+            assert calls.get(("users", "find"), 0) == 1
+            assert calls.get(("users", "find_one"), 0) == 0
+            assert calls.get(("offences", "insert_many"), 0) == 1
+            assert calls.get(("offences", "insert_one"), 0) == 0
+
+            # Cached registry: later scans skip the device lookup
+            calls.clear()
+            response = await client.post("/api/rfid/scan", json=scan("GATE-1", "REG1", 300))
+            assert response.json()["message"] == "Scan recorded, no violation"
+            assert ("rfid_devices", "find") not in calls
+            monkeypatch.undo()
+
+            offence = await server.db.offences.find_one({"id": body["results"][1]["offence_id"]})
+            assert offence["student_id"] is not None and offence["speed"] == 68.6
+            assert offence["section"]["from_name"] == "Main gate"
+            assert (await client.get("/api/admin/stats", headers=headers)).json()["total_offences"] == 16
+            assert await server.db.rfid_scans.count_documents({}) == 41
+
+            # Deleting a device invalidates the registry immediately
+            await client.delete(f"/api/admin/rfid-devices/{device['id']}", headers=headers)
+            response = await client.post("/api/rfid/scan", json=scan("GATE-1", "REG1", 400))
+            assert response.status_code == 404
+
+            response = await client.post("/api/rfid/scan-batch", json={"scans": []})
+            assert response.status_code == 422
+
+    asyncio.run(scenario())
@@ -0,0 +1,127 @@
+import asyncio
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import server
+from section_control import SectionTracker
+from tests.conftest import admin_token, auth, running_app
+
+
+def tracker_with_gates() -> SectionTracker:
+    tracker = SectionTracker(max_section_s=600, sweep_interval_s=60)
+    tracker.set_distances([("GATE-1", "GATE-2", 400), ("GATE-3", "GATE-2", 250)])
+    return tracker
+
+
+def test_section_speed_between_consecutive_gates():
+    tracker = tracker_with_gates()
+    assert tracker.observe("REG1", "GATE-1", 1000.0) is None
+    # Workers share passages, so the worker that took a scan sees it again: a repeat changes nothing
+    assert tracker.observe("REG1", "GATE-1", 1000.0) is None
+    section = tracker.observe("REG1", "GATE-2", 1036.0)
+    assert (section.from_gate, section.to_gate, section.meters, section.seconds) == ("GATE-1", "GATE-2", 400, 36)
+    assert round(section.kmh, 1) == 40.0
+    # Distances are symmetric; gate pairs without a distance only update the passage
+    assert round(tracker.observe("REG1", "GATE-3", 1054.0).kmh, 1) == 50.0
+    assert tracker.observe("REG1", "GATE-1", 1100.0) is None
+    assert tracker.observe("REG1", "GATE-1", 1110.0) is None
+    # A late scan doesn't replace the newer passage
+    assert tracker.observe("REG1", "GATE-2", 1090.0) is None
+    assert tracker.passages["REG1"].ts == 1110.0
+    # Too long between gates to say anything about speed
+    assert tracker.observe("REG1", "GATE-2", 1110.0 + 601) is None
+
+
+def test_passages_expire_oldest_first():
+    tracker = tracker_with_gates()
+    for n in range(100):
+        tracker.observe(f"REG{n}", "GATE-1", float(n))
+    tracker.observe("REG0", "GATE-1", 500.0)
+    assert tracker.expire(650.0) == 49  # REG1..REG49 passed before 650 - 600
+    assert "REG0" in tracker.passages and "REG49" not in tracker.passages and "REG50" in tracker.passages
+    # Sweeps also run as scans arrive
+    tracker.observe("REG999", "GATE-2", 2000.0)
+    assert len(tracker) == 1
+
+
+def test_twenty_thousand_students_fit_in_a_few_megabytes():
+    tracker = tracker_with_gates()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for n in range(20_000):
+            tracker.observe(f"REG{n:08d}", "GATE-1" if n % 2 else "GATE-2", 1_760_000_000.0 + n * 0.01)
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    assert len(tracker) == 20_000
+    assert used < 5 * 1024 * 1024
+
+
+def test_sections_are_configured_by_admins_and_survive_restart():
+    async def scenario():
+        async with running_app() as client:
+            headers = auth(await admin_token(client))
+            for gate, name in (("GATE-1", "Main gate"), ("GATE-2", "Library")):
+                await client.post("/api/admin/rfid-devices", headers=headers,
+                                  json={"rfid_id": gate, "location_name": name})
+            response = await client.post("/api/admin/rfid-sections", headers=headers,
+                                         json={"from_rfid": "GATE-1", "to_rfid": "GATE-9", "distance_m": 300})
+            assert response.status_code == 404
+            response = await client.post("/api/admin/rfid-sections", headers=headers,
+                                         json={"from_rfid": "GATE-1", "to_rfid": "GATE-1", "distance_m": 300})
+            assert response.status_code == 400
+            await client.post("/api/admin/rfid-sections", headers=headers,
+                              json={"from_rfid": "GATE-1", "to_rfid": "GATE-2", "distance_m": 300})
+            # Setting the pair again, either way round, replaces the distance
+            await client.post("/api/admin/rfid-sections", headers=headers,
+                              json={"from_rfid": "GATE-2", "to_rfid": "GATE-1", "distance_m": 600})
+            sections = (await client.get("/api/admin/rfid-sections", headers=headers)).json()["sections"]
+            assert [section["distance_m"] for section in sections] == [600]
+
+            start = datetime.now(timezone.utc) - timedelta(seconds=120)
+            response = await client.post("/api/rfid/scan", json={
+                "rfid_device_id": "GATE-1", "student_registration_id": "REG1", "student_name": "Asha",
+                "phone": "9000000001", "speed": 12, "timestamp": start.isoformat()
+            })
+            assert response.json()["message"] == "Scan recorded, no violation"
+
+            # A restarted worker rebuilds the last passages from recorded scans
+            await server.load_section_tracker()
+            assert "REG1" in server.section_tracker.passages
+            response = await client.post("/api/rfid/scan", json={
+                "rfid_device_id": "GATE-2", "student_registration_id": "REG1", "student_name": "Asha",
+                "phone": "9000000001", "speed": 12, "timestamp": (start + timedelta(seconds=30)).isoformat()
+            })
+            assert response.json()["message"] == "Speed violation recorded"
+            offence = (await client.get("/api/admin/offences", headers=headers)).json()["offences"][0]
+            assert offence["speed"] == 72.0
+            assert offence["section"]["distance_m"] == 600
+
+            await client.delete(f"/api/admin/rfid-sections/{sections[0]['id']}", headers=headers)
+            assert server.section_tracker.distances() != []  # cleared on the next registry load
+            await server.get_rfid_registry()
+            assert server.section_tracker.distances() == []
+
+    asyncio.run(scenario())
+
+
+def test_a_passage_scanned_on_another_worker_closes_the_section_here():
+    async def scenario():
+        async with running_app() as client:
+            headers = auth(await admin_token(client))
+            for gate in ("GATE-1", "GATE-2"):
+                await client.post("/api/admin/rfid-devices", headers=headers,
+                                  json={"rfid_id": gate, "location_name": gate})
+            await client.post("/api/admin/rfid-sections", headers=headers,
+                              json={"from_rfid": "GATE-1", "to_rfid": "GATE-2", "distance_m": 600})
+
+            start = datetime.now(timezone.utc) - timedelta(seconds=120)
+            await server.gate_passages({"passages": [["REG2", "GATE-1", start.timestamp()]]})
+            response = await client.post("/api/rfid/scan", json={
+                "rfid_device_id": "GATE-2", "student_registration_id": "REG2", "student_name": "Ravi",
+                "phone": "9000000002", "speed": 12, "timestamp": (start + timedelta(seconds=30)).isoformat()
+            })
+            assert response.json()["message"] == "Speed violation recorded"
+
+    asyncio.run(scenario())
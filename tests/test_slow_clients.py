@@ -0,0 +1,130 @@
+import asyncio
+import json
+
+import socketio
+
+import metrics
+from socket_managers import LocalManager
+
+
+class FakeEngineIOSocket:
+    """Stands in for an engine.io socket: packets wait in `queue` until the client reads them"""
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.closed = False
+
+    async def send(self, pkt):
+        await self.queue.put(pkt)
+
+    def read_all(self):
+        """The client catches up: take everything the transport has queued"""
+        frames = []
+        while not self.queue.empty():
+            pkt = self.queue.get_nowait()
+            self.queue.task_done()
+            if isinstance(pkt.data, str) and pkt.data.startswith("2"):
+                frames.append(json.loads(pkt.data[1:]))
+        return frames
+
+
+async def connect(sio, eio_sid: str, room: str = "map") -> FakeEngineIOSocket:
+    socket = sio.eio.sockets[eio_sid] = FakeEngineIOSocket()
+    sid = await sio.manager.connect(eio_sid, '/')
+    await sio.manager.enter_room(sid, '/', room, eio_sid=eio_sid)
+    return socket
+
+
+async def keep_up(socket: FakeEngineIOSocket, frames: list):
+    """A client on a good connection reads every packet as it arrives"""
+    while True:
+        await socket.queue.get()
+        socket.queue.task_done()
+        frames.append(1)
+
+
+async def read_until_idle(socket: FakeEngineIOSocket):
+    frames = []
+    for _ in range(50):
+        frames += socket.read_all()
+        await asyncio.sleep(0)
+    return frames
+
+
+def test_slow_client_gets_latest_positions_and_every_booking_event():
+    async def scenario():
+        manager = LocalManager(queue_depth=64)
+        sio = socketio.AsyncServer(async_mode='asgi', client_manager=manager)
+        slow = await connect(sio, "slow")
+        fast_frames = []
+        reader = asyncio.ensure_future(keep_up(await connect(sio, "fast"), fast_frames))
+        dropped = metrics.SOCKET_FRAMES_DROPPED.values.get(("coalesced",), 0)
+
+        for step in range(10):
+            for vehicle in ("bus-1", "bus-2", "bus-3"):
+                await sio.emit("vehicle_location", {"vehicle_id": vehicle, "step": step}, room="map")
+                await asyncio.sleep(0.001)
+            await sio.emit("booking_pending", {"booking_id": f"b{step}"}, room="map")
+
+        # The fast client kept up; the slow one holds one frame in its transport and a short outbox
+        outbox = manager.outboxes["slow"]
+        assert len(outbox.entries) == 3 + 10
+        frames = await read_until_idle(slow)
+        locations = [(data["vehicle_id"], data["step"]) for event, data in frames if event == "vehicle_location"]
+        # Replaced frames move behind the ones emitted before their newest position
+        assert locations == [("bus-1", 0), ("bus-1", 9), ("bus-2", 9), ("bus-3", 9)]
+        assert [data["booking_id"] for event, data in frames if event == "booking_pending"] == \
+            [f"b{step}" for step in range(10)]
+        assert outbox.dropped == 26
+        assert metrics.SOCKET_FRAMES_DROPPED.values[("coalesced",)] - dropped == 26
+        assert manager.outboxes["fast"].dropped == 0 and len(fast_frames) == 40
+        reader.cancel()
+
+        stats = {client["sid"]: client for client in manager.client_stats()}
+        assert stats[outbox.sid]["depth"] == 0 and stats[outbox.sid]["delivered"] == 14
+        await manager.close()
+
+    asyncio.run(scenario())
+
+
+def test_full_outbox_drops_the_oldest_position_first():
+    async def scenario():
+        manager = LocalManager(queue_depth=4)
+        sio = socketio.AsyncServer(async_mode='asgi', client_manager=manager)
+        slow = await connect(sio, "slow")
+        for vehicle in range(10):
+            await sio.emit("vehicle_location", {"vehicle_id": f"bus-{vehicle}"}, room="map")
+            await asyncio.sleep(0)
+        frames = await read_until_idle(slow)
+        assert [data["vehicle_id"] for _, data in frames] == ["bus-0", "bus-6", "bus-7", "bus-8", "bus-9"]
+        await manager.close()
+
+    asyncio.run(scenario())
+
+
+def test_clients_that_stay_slow_are_disconnected():
+    async def scenario():
+        manager = LocalManager(slow_client_s=0.05, max_backlog=20)
+        sio = socketio.AsyncServer(async_mode='asgi', client_manager=manager)
+        disconnected = []
+        sio.on("disconnect", lambda sid, reason: disconnected.append(sid))
+
+        stalled = await connect(sio, "stalled")
+        await sio.emit("booking_pending", {"booking_id": "b1"}, room="map")
+        await asyncio.sleep(0.1)
+        assert "stalled" not in manager.outboxes
+        assert not manager.is_connected(disconnected[0], '/')
+
+        # Booking events are never dropped, so an ever-growing backlog disconnects too
+        backlogged = await connect(sio, "backlogged", room="drivers")
+        for n in range(25):
+            await sio.emit("booking_pending", {"booking_id": f"b{n}"}, room="drivers")
+        await asyncio.sleep(0)
+        assert "backlogged" not in manager.outboxes
+        assert len(disconnected) == 2
+        assert metrics.SOCKET_SLOW_DISCONNECTS.values[("stalled",)] >= 1
+        assert metrics.SOCKET_SLOW_DISCONNECTS.values[("backlog",)] >= 1
+        assert stalled.queue.qsize() >= 1 and backlogged.queue.qsize() >= 1
+        await manager.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,128 @@
+import asyncio
+import json
+
+import socketio
+
+from socket_managers import LocalManager, MemoryBroker, MemoryPubSubManager
+
+
+class Worker:
+    """An AsyncServer on a shared broker with fake clients recording what they receive"""
+
+    def __init__(self, broker: MemoryBroker, batch_window_s: float = 0.005):
+        self.manager = MemoryPubSubManager(broker, batch_window_s=batch_window_s)
+        self.sio = socketio.AsyncServer(async_mode='asgi', client_manager=self.manager)
+        self.received = {}
+        self.sio._send_eio_packet = self.deliver
+        self.sio.manager_initialized = True
+        self.manager.initialize()
+
+    async def deliver(self, eio_sid, packet):
+        event, data = json.loads(packet.data[1:])
+        self.received.setdefault(eio_sid, []).append((event, data))
+
+    async def connect(self, eio_sid: str, *rooms: str) -> str:
+        sid = await self.manager.connect(eio_sid, '/')
+        for room in rooms:
+            await self.manager.enter_room(sid, '/', room, eio_sid=eio_sid)
+        return sid
+
+
+def test_emits_reach_clients_on_other_workers_in_batches():
+    async def scenario():
+        broker = MemoryBroker()
+        a, b = Worker(broker), Worker(broker)
+        await a.connect("a-client", "map")
+        await b.connect("b-client", "map")
+        await b.connect("b-other", "elsewhere")
+
+        for n in range(50):
+            await a.sio.emit("vehicle_location", {"vehicle_id": f"v{n}", "n": n}, room="map")
+        await asyncio.sleep(0)
+        assert len(a.received["a-client"]) == 50  # local clients don't wait for the broker
+        await asyncio.sleep(0.05)
+
+        assert [data["n"] for _, data in b.received["b-client"]] == list(range(50))
+        assert "b-other" not in b.received
+        assert a.manager.published_messages == 50
+        assert a.manager.published_batches == 1
+        await a.manager.close()
+        await b.manager.close()
+
+    asyncio.run(scenario())
+
+
+def test_room_membership_and_closing_span_workers():
+    async def scenario():
+        broker = MemoryBroker()
+        a, b = Worker(broker, batch_window_s=0), Worker(broker, batch_window_s=0)
+        await a.connect("a-phone", "user:1")
+        await b.connect("b-laptop", "user:1")
+        await b.connect("b-stranger", "user:2")
+
+        # Joining a user's sockets to a booking room reaches the ones on the other worker
+        await a.manager.enter_room_members('/', "user:1", "booking:9")
+        await asyncio.sleep(0.01)
+        await a.sio.emit("booking_accepted", {"id": "9"}, room="booking:9")
+        await asyncio.sleep(0.01)
+        assert a.received["a-phone"] == [("booking_accepted", {"id": "9"})]
+        assert b.received["b-laptop"] == [("booking_accepted", {"id": "9"})]
+        assert "b-stranger" not in b.received
+
+        await b.sio.close_room("booking:9")
+        await asyncio.sleep(0.01)
+        await a.sio.emit("booking_completed", {"id": "9"}, room="booking:9")
+        await asyncio.sleep(0.01)
+        assert len(a.received["a-phone"]) == 1 and len(b.received["b-laptop"]) == 1
+        await a.manager.close()
+        await b.manager.close()
+
+    asyncio.run(scenario())
+
+
+def test_local_manager_enters_room_members():
+    async def scenario():
+        manager = LocalManager()
+        sio = socketio.AsyncServer(async_mode='asgi', client_manager=manager)
+        sid = await manager.connect("eio-1", '/')
+        await manager.enter_room(sid, '/', "user:1", eio_sid="eio-1")
+        await manager.enter_room_members('/', "user:1", "booking:1")
+        await manager.enter_room_members('/', "user:404", "booking:1")
+        assert [s for s, _ in manager.get_participants('/', "booking:1")] == [sid]
+        assert sio.manager is manager
+
+    asyncio.run(scenario())
+
+
+def test_handlers_run_on_every_worker():
+    async def scenario():
+        broker = MemoryBroker()
+        a, b = Worker(broker), Worker(broker)
+        calls = []
+
+        def record(name):
+            async def handler(data):
+                calls.append((name, data["vehicle_id"]))
+            return handler
+
+        async def broken(data):
+            raise RuntimeError("handler bug")
+
+        async def ignore(data):
+            pass
+
+        a.manager.add_handler("vehicle_moved", record("a"))
+        b.manager.add_handler("vehicle_moved", record("b"))
+        a.manager.add_handler("broken", ignore)
+        b.manager.add_handler("broken", broken)
+
+        await a.manager.run_everywhere("broken", {})
+        await a.manager.run_everywhere("vehicle_moved", {"vehicle_id": "bus-1"})
+        assert calls == [("a", "bus-1")]  # this worker's handler runs straight away
+        await asyncio.sleep(0.05)
+        # The failing handler on b didn't stop its listener
+        assert calls == [("a", "bus-1"), ("b", "bus-1")]
+        await a.manager.close()
+        await b.manager.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import uuid
+from collections import defaultdict
+
+import server
+from tests.conftest import auth, running_app
+from tests.test_booking_transitions import book, create_driver_with_ambulance
+
+
+class SocketHarness:
+    """Drives Socket.IO connections through the real server handlers and records what each socket is sent"""
+
+    def __init__(self, monkeypatch):
+        self.sent = defaultdict(list)
+        monkeypatch.setattr(server.sio.eio, "send", self._send)
+        monkeypatch.setattr(server.sio.eio, "send_packet", self._send_packet)
+
+    async def _send(self, eio_sid, data):
+        self.sent[eio_sid].append(data)
+
+    async def _send_packet(self, eio_sid, pkt):
+        self.sent[eio_sid].append(pkt.data)
+
+    async def connect(self, token=None, query: str = "", auth_fields: dict = None) -> str:
+        eio_sid = str(uuid.uuid4())
+        server.sio.environ[eio_sid] = {"QUERY_STRING": query}
+        payload = dict(auth_fields or {}, **({"token": token} if token else {}))
+        await server.sio._handle_connect(eio_sid, "/", payload or None)
+        return eio_sid
+
+    async def disconnect(self, eio_sid: str):
+        await server.sio._handle_disconnect(eio_sid, "/")
+
+    async def message(self, eio_sid: str, event: str, data):
+        await server.sio._handle_event(eio_sid, "/", None, [event, data])
+        # Event handlers run as background tasks
+        await asyncio.sleep(0.01)
+
+    async def settle(self):
+        """Wait for every client outbox to drain"""
+        while any(outbox.task for outbox in server.sio.manager.outboxes.values()):
+            await asyncio.sleep(0)
+
+    def in_room(self, eio_sid: str, room: str) -> bool:
+        return any(eio == eio_sid for _, eio in server.sio.manager.get_participants("/", room))
+
+    def refused(self, eio_sid: str) -> bool:
+        return any(packet.startswith("4") for packet in self.sent[eio_sid])
+
+    def events(self, eio_sid: str):
+        return [json.loads(packet[1:]) for packet in self.sent[eio_sid] if packet.startswith("2")]
+
+    def event_names(self, eio_sid: str):
+        return [event[0] for event in self.events(eio_sid)]
+
+
+async def student_token(client, phone: str, registration_id: str) -> str:
+    response = await client.post("/api/auth/signup", json={
+        "name": "Student", "phone": phone, "password": "pw", "registration_id": registration_id
+    })
+    return response.json()["access_token"]
+
+
+def test_booking_events_only_reach_creator_and_driver(monkeypatch):
+    async def scenario():
+        sockets = SocketHarness(monkeypatch)
+        async with running_app() as client:
+            driver_token = await create_driver_with_ambulance(1)
+            bystander = await sockets.connect(await student_token(client, "9000000002", "REG2"))
+            anonymous = await sockets.connect()
+            driver = await sockets.connect(driver_token)
+
+            # The creator's socket must exist before booking; book() signs up REG1 first
+            creator_token = (await client.post("/api/auth/signup", json={
+                "name": "Student", "phone": "9000000001", "password": "pw", "registration_id": "REG1"
+            })).json()["access_token"]
+            creator = await sockets.connect(query=f"token={creator_token}")
+            booking = (await client.post("/api/public/ambulance/book", headers=auth(creator_token), json={
+                "student_registration_id": "REG1", "phone": "9000000001", "place": "hostel",
+                "user_location": {"lat": 20.30, "lng": 85.83}
+            })).json()
+
+            await sockets.settle()
+            # Every socket starts with the fleet snapshot
+            assert sockets.event_names(creator) == ["fleet_snapshot", "new_booking"]
+            # No ambulance is located, so drivers get a notice without the student's details
+            assert sockets.event_names(driver) == ["fleet_snapshot", "booking_pending"]
+            assert "phone" not in sockets.events(driver)[1][1]
+            assert sockets.event_names(bystander) == sockets.event_names(anonymous) == ["fleet_snapshot"]
+
+            accepted = await client.post(f"/api/driver/accept-booking/{booking['id']}", headers=auth(driver_token))
+            otp = accepted.json()["otp"]
+            await sockets.settle()
+            assert sockets.event_names(creator)[-1] == "booking_accepted"
+            assert sockets.event_names(driver)[-1] == "booking_accepted"
+
+            # A reconnecting driver rejoins the booking room
+            await sockets.disconnect(driver)
+            driver = await sockets.connect(driver_token)
+            await client.post("/api/gps/receive", json={
+                "imei": "AMB-IMEI-1", "latitude": 20.295, "longitude": 85.825, "speed": 30
+            })
+            await sockets.settle()
+            for sid in (creator, driver):
+                assert sockets.event_names(sid)[-2:] == ["vehicle_location", "eta_update"]
+            for sid in (bystander, anonymous):
+                assert sockets.event_names(sid) == ["fleet_snapshot", "vehicle_location"]
+
+            await client.post("/api/driver/verify-otp", headers=auth(driver_token),
+                              json={"booking_id": booking["id"], "otp": otp})
+            await client.post(f"/api/driver/complete-booking/{booking['id']}", headers=auth(driver_token))
+            await sockets.settle()
+            assert sockets.event_names(creator)[-1] == "booking_completed"
+            assert sockets.event_names(driver)[-1] == "booking_completed"
+            assert "booking_accepted" not in sockets.event_names(bystander)
+            assert not sockets.in_room(creator, f"booking:{booking['id']}")
+
+            for sid in (bystander, anonymous, driver, creator):
+                await sockets.disconnect(sid)
+
+    asyncio.run(scenario())
+
+
+def test_sockets_cannot_forge_identity_or_join_private_rooms(monkeypatch):
+    async def scenario():
+        sockets = SocketHarness(monkeypatch)
+        async with running_app() as client:
+            assert sockets.refused(await sockets.connect("not-a-jwt"))
+
+            booking = await book(client)
+            snoop = await sockets.connect()
+            await sockets.message(snoop, "join_room", {"room": f"booking:{booking['id']}"})
+            await sockets.message(snoop, "join_room", {"room": "drivers"})
+            assert not sockets.in_room(snoop, f"booking:{booking['id']}")
+            assert not sockets.in_room(snoop, "drivers")
+            await sockets.message(snoop, "join_room", {"room": "campus-news"})
+            assert sockets.in_room(snoop, "campus-news")
+            await sockets.disconnect(snoop)
+
+    asyncio.run(scenario())
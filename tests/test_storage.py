@@ -0,0 +1,99 @@
+import asyncio
+
+from pymongo import ReturnDocument
+
+from tests.conftest import admin_token, auth
+from storage import MemoryStorage
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_memory_find_filters_sort_and_projection():
+    async def scenario():
+        db = MemoryStorage()
+        await db.users.insert_many([
+            {"id": "1", "name": "Asha", "role": "student", "phone": "111", "password": "x"},
+            {"id": "2", "name": "Bikash", "role": "driver", "phone": "222", "password": "x"},
+            {"id": "3", "name": "asmita", "role": "student", "phone": "333", "password": "x"},
+        ])
+        students = await db.users.find(
+            {"role": "student", "$or": [{"name": {"$regex": "^as", "$options": "i"}}, {"phone": "222"}]},
+            {"_id": 0, "password": 0}
+        ).sort("name", -1).to_list(10)
+        assert [s["id"] for s in students] == ["3", "1"]
+        assert "password" not in students[0] and "_id" not in students[0]
+        assert await db.users.count_documents({"id": {"$in": ["1", "2", "9"]}}) == 2
+        assert await db.users.find_one({"registration_id": None, "id": "2"}, {"_id": 0, "name": 1}) == {"name": "Bikash"}
+
+    run(scenario())
+
+
+def test_memory_updates_keep_indexes_consistent():
+    async def scenario():
+        db = MemoryStorage()
+        await db.vehicles.create_index("gps_imei")
+        await db.vehicles.insert_one({"id": "v1", "gps_imei": "A", "current_location": None})
+
+        result = await db.vehicles.update_one({"id": "v1"}, {"$set": {"gps_imei": "B"}})
+        assert result.modified_count == 1
+        assert await db.vehicles.find_one({"gps_imei": "A"}) is None
+        assert (await db.vehicles.find_one({"gps_imei": "B"}, {"_id": 0}))["id"] == "v1"
+
+        unchanged = await db.vehicles.update_one({"id": "v1"}, {"$set": {"gps_imei": "B"}})
+        assert unchanged.matched_count == 1 and unchanged.modified_count == 0
+
+        await db.stats.update_one({"id": "dashboard"}, {"$inc": {"total": 2}}, upsert=True)
+        after = await db.stats.find_one_and_update(
+            {"id": "dashboard"}, {"$inc": {"total": -1}, "$max": {"peak": 5}},
+            projection={"_id": 0}, return_document=ReturnDocument.AFTER
+        )
+        assert after == {"id": "dashboard", "total": 1, "peak": 5}
+
+        deleted = await db.vehicles.find_one_and_delete({"gps_imei": "B"}, {"_id": 0, "id": 1})
+        assert deleted == {"id": "v1"}
+        assert await db.vehicles.count_documents({}) == 0
+
+    run(scenario())
+
+
+def test_stored_documents_do_not_alias_caller_objects():
+    async def scenario():
+        db = MemoryStorage()
+        doc = {"id": "b1", "user_location": {"lat": 1.0, "lng": 2.0}}
+        await db.bookings.insert_one(doc)
+        assert "_id" in doc  # like Motor, insert_one assigns _id on the caller's dict
+        doc["user_location"]["lat"] = 99.0
+        fetched = await db.bookings.find_one({"id": "b1"})
+        assert fetched["user_location"]["lat"] == 1.0
+        fetched["user_location"]["lat"] = 50.0
+        assert (await db.bookings.find_one({"id": "b1"}))["user_location"]["lat"] == 1.0
+
+    run(scenario())
+
+
+def test_api_runs_in_process_on_memory_storage(app_client):
+    async def scenario():
+        async with app_client() as client:
+            token = await admin_token(client)
+            response = await client.post("/api/admin/vehicles", headers=auth(token), json={
+                "vehicle_number": "OD-02-1234", "gps_imei": "IMEI-1", "barcode": "BC-1", "vehicle_type": "bus"
+            })
+            assert response.status_code == 200
+
+            response = await client.post("/api/auth/signup", json={
+                "name": "Student", "phone": "9000000001", "password": "pw", "registration_id": "REG1"
+            })
+            assert response.status_code == 200
+
+            response = await client.post("/api/gps/receive", json={
+                "imei": "IMEI-1", "latitude": 20.29, "longitude": 85.82, "speed": 30
+            })
+            assert response.status_code == 200
+
+            stats = (await client.get("/api/admin/stats", headers=auth(token))).json()
+            assert stats["total_buses"] == 1
+            assert stats["total_students"] == 1
+
+    run(scenario())
@@ -0,0 +1,63 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import server
+from tests.conftest import auth, running_app
+from tests.test_analytics import create_bus_driver
+from trip_stats import TripAccumulator
+
+
+def test_fixes_fold_into_running_totals():
+    trip = TripAccumulator("trip-1", speed_limit=40, idle_kmh=3, max_gap_s=120)
+    # 0.01 degrees of latitude is about 1.11 km
+    for ts, lat, speed in ((0, 20.30, 0), (60, 20.30, 30), (120, 20.31, 50), (150, 20.32, 2), (1150, 20.32, 0)):
+        assert trip.add(lat, 85.82, speed, ts)
+    assert not trip.add(20.40, 85.82, 99, 1000)  # arrived late, already past it
+
+    summary = trip.summary()
+    assert 2.2 < summary["distance_km"] < 2.3
+    assert summary["max_speed_kmh"] == 50
+    # Idle while the last fix said 0 or 2 km/h; the 1000 s silence counts as 120 s
+    assert summary["idle_s"] == 60 + 120
+    assert summary["overspeed_s"] == 30
+    assert summary["tracked_s"] == 60 + 60 + 30 + 120
+    assert summary["avg_speed_kmh"] == round(trip.distance_km / (270 / 3600), 1)
+
+    resumed = TripAccumulator("trip-1", speed_limit=40)
+    resumed.restore(summary)
+    assert resumed.add(20.32, 85.82, 10, 2000) and resumed.summary() == summary
+
+
+def test_trip_statistics_are_flushed_during_and_at_the_end_of_a_trip():
+    async def scenario():
+        async with running_app() as client:
+            headers = auth(await create_bus_driver(1))
+            trip = (await client.post("/api/driver/start-trip", headers=headers,
+                                      json={"vehicle_id": "bus-1"})).json()
+            start = datetime.now(timezone.utc) - timedelta(minutes=10)
+
+            async def fix(seconds: int, lat: float, speed: float):
+                await client.post("/api/gps/receive", json={
+                    "imei": "BUS-IMEI-1", "latitude": lat, "longitude": 85.82, "speed": speed,
+                    "timestamp": (start + timedelta(seconds=seconds)).isoformat()})
+
+            await fix(0, 20.30, 45)
+            await fix(60, 20.31, 45)
+            assert await server.flush_trip_stats() == 1
+            assert await server.flush_trip_stats() == 0  # nothing new since
+            active = (await client.get("/api/driver/active-trip", headers=headers)).json()["trip"]
+            assert active["overspeed_s"] == 60 and 1.1 < active["distance_km"] < 1.12
+
+            # A restarted worker carries on from the flushed totals and the vehicle's last fix
+            await server.load_trip_stats()
+            await fix(120, 20.32, 0)
+            await fix(180, 20.32, 0)
+            await client.post(f"/api/driver/end-trip/{trip['id']}", headers=headers)
+            assert "bus-1" not in server.trip_stats
+
+            ended, = (await client.get("/api/driver/my-trips", headers=headers)).json()["trips"]
+            assert 2.2 < ended["distance_km"] < 2.25
+            assert (ended["max_speed_kmh"], ended["overspeed_s"], ended["idle_s"]) == (45, 120, 60)
+            assert ended["avg_speed_kmh"] == round(ended["distance_km"] / (180 / 3600), 1)
+
+    asyncio.run(scenario())
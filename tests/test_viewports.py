@@ -0,0 +1,137 @@
+import asyncio
+import uuid
+from datetime import datetime, timezone
+
+import server
+from tests.conftest import admin_token, auth, running_app
+from tests.test_socket_rooms import SocketHarness
+from viewports import Viewport, ViewportIndex
+
+# Two viewports over the campus: the main gate area and the hostels to its north-east
+GATE = {"south": 20.280, "west": 85.810, "north": 20.290, "east": 85.820}
+HOSTELS = {"south": 20.295, "west": 85.825, "north": 20.305, "east": 85.835}
+
+
+def box(bounds):
+    return bounds["south"], bounds["west"], bounds["north"], bounds["east"]
+
+
+def test_fixes_enter_move_within_and_leave_viewports():
+    index = ViewportIndex(cell_deg=0.01)
+    index.subscribe("gate", *box(GATE))
+    index.subscribe("hostels", *box(HOSTELS))
+    index.subscribe("campus", 20.0, 85.5, 20.5, 86.0)
+
+    change = index.move("bus-1", 20.285, 85.815, {"vehicle_id": "bus-1"})
+    assert (change.entered, change.moved, change.left) == ({"gate", "campus"}, set(), set())
+    change = index.move("bus-1", 20.286, 85.816, {"vehicle_id": "bus-1"})
+    assert (change.entered, change.moved, change.left) == (set(), {"gate", "campus"}, set())
+    change = index.move("bus-1", 20.300, 85.830, {"vehicle_id": "bus-1"})
+    assert (change.entered, change.moved, change.left) == ({"hostels"}, {"campus"}, {"gate"})
+    # Outside every box but in a cell one of them overlaps
+    change = index.move("bus-1", 20.306, 85.830, {"vehicle_id": "bus-1"})
+    assert (change.entered, change.moved, change.left) == (set(), {"campus"}, {"hostels"})
+
+    assert index.remove("bus-1") == {"campus"}
+    assert index.showing["campus"] == set()
+    index.unsubscribe("campus")
+    assert index.move("bus-1", 20.285, 85.815, {}).entered == {"gate"}
+    assert index.unsubscribe("gate") and not index.unsubscribe("gate")
+    assert index.shown_in == {} and index.cells.keys() == {(2029, 8582), (2029, 8583), (2030, 8582), (2030, 8583)}
+
+
+def test_fixes_only_look_at_viewports_in_their_cell(monkeypatch):
+    index = ViewportIndex(cell_deg=0.01, max_cells=100)
+    for n in range(5000):
+        lat = 10 + (n % 70) * 0.1
+        index.subscribe(f"far-{n}", lat, 75.0, lat + 0.005, 75.005)
+    index.subscribe("gate", *box(GATE))
+    index.subscribe("world", -90, -180, 90, 180)
+    assert index.wide == {"world"}
+
+    checked = []
+    contains = Viewport.contains
+    monkeypatch.setattr(Viewport, "contains", lambda viewport, lat, lng: checked.append(viewport) or
+                        contains(viewport, lat, lng))
+    change = index.move("bus-1", 20.285, 85.815, {"vehicle_id": "bus-1"})
+    assert change.entered == {"gate", "world"}
+    assert len(checked) == 2
+
+
+def test_subscribing_returns_the_vehicles_already_inside():
+    index = ViewportIndex(cell_deg=0.01)
+    index.move("bus-1", 20.285, 85.815, {"vehicle_id": "bus-1"})
+    index.move("bus-2", 20.300, 85.830, {"vehicle_id": "bus-2"})
+    assert index.subscribe("map", *box(GATE)) == [{"vehicle_id": "bus-1"}]
+    # Panning the map replaces the viewport
+    assert index.subscribe("map", *box(HOSTELS)) == [{"vehicle_id": "bus-2"}]
+    assert index.shown_in == {"bus-2": {"map"}}
+    assert len(index.subscribe("map", -90, -180, 90, 180)) == 2
+
+
+async def add_bus(number: int, lat: float, lng: float) -> str:
+    vehicle_id = str(uuid.uuid4())
+    await server.db.vehicles.insert_one({
+        "id": vehicle_id, "vehicle_number": f"BUS-{number}", "gps_imei": f"BUS-IMEI-{number}",
+        "barcode": f"BUS-BC-{number}", "vehicle_type": "bus", "assigned_to": None, "is_out_of_station": False,
+        "current_location": {"lat": lat, "lng": lng, "speed": 0,
+                             "timestamp": datetime.now(timezone.utc).isoformat()},
+        "current_point": server.geo_point(lat, lng), "created_at": datetime.now(timezone.utc).isoformat()
+    })
+    return vehicle_id
+
+
+def test_viewport_sockets_only_hear_about_vehicles_inside(monkeypatch):
+    async def scenario():
+        sockets = SocketHarness(monkeypatch)
+        async with running_app() as client:
+            parked = await add_bus(1, 20.285, 85.815)
+            moving = await add_bus(2, 20.300, 85.830)
+            await server.load_fleet()
+
+            everything = await sockets.connect()
+            gate = await sockets.connect()
+            await sockets.message(gate, "subscribe_viewport", {"south": "20.3", "west": 85.81})
+            await sockets.message(gate, "subscribe_viewport", {**GATE, "north": 20.0})
+            assert gate not in server.viewports
+            await sockets.message(gate, "subscribe_viewport", GATE)
+            await sockets.settle()
+            assert sockets.events(gate)[1:] == [["viewport_snapshot", {"vehicles": [
+                server.viewports.payloads[parked]]}]]
+            assert not sockets.in_room(gate, "fleet")
+
+            async def fix(imei: str, lat: float, lng: float):
+                response = await client.post("/api/gps/receive", json={
+                    "imei": imei, "latitude": lat, "longitude": lng, "speed": 20})
+                assert response.status_code == 200
+                await sockets.settle()  # one position per vehicle stays queued otherwise
+
+            await fix("BUS-IMEI-2", 20.301, 85.831)  # still among the hostels
+            await fix("BUS-IMEI-2", 20.288, 85.818)  # drives to the gate
+            await fix("BUS-IMEI-1", 20.286, 85.816)
+            await fix("BUS-IMEI-2", 20.300, 85.830)  # and back
+            await sockets.settle()
+            assert [(name, data["vehicle_id"]) for name, data in sockets.events(gate)[2:]] == [
+                ("vehicle_enter", moving), ("vehicle_location", parked), ("vehicle_leave", moving)]
+            assert sockets.events(gate)[2][1]["location"]["lat"] == 20.288
+            assert sockets.event_names(everything) == ["fleet_snapshot"] + ["vehicle_location"] * 4
+
+            headers = auth(await admin_token(client))
+            await client.delete(f"/api/admin/vehicles/{parked}", headers=headers)
+            await sockets.settle()
+            assert sockets.events(gate)[-1] == ["vehicle_leave", {"vehicle_id": parked}]
+
+            # Back to the whole fleet
+            await sockets.message(gate, "unsubscribe_viewport", None)
+            await fix("BUS-IMEI-2", 20.301, 85.831)
+            await sockets.settle()
+            assert sockets.event_names(gate)[-1] == "vehicle_location"
+            assert sockets.in_room(gate, "fleet")
+
+            await sockets.message(everything, "join_room", {"room": "fleet"})
+            await sockets.message(gate, "subscribe_viewport", GATE)
+            await sockets.disconnect(gate)
+            assert gate not in server.viewports
+            await sockets.disconnect(everything)
+
+    asyncio.run(scenario())